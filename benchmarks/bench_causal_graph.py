@@ -0,0 +1,121 @@
+"""Compares the per-request latency of causality lookups from SQLite and from the in-memory CausalGraph.
+
+    python -m benchmarks.bench_causal_graph --scale 10 --requests 5000 --output causal-graph-benchmark.json
+"""
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import tracemalloc
+from benchmarks.synthetic_resources import generate_resources
+from causality_agent.causality_agent import CausalityAgent
+from causality_agent.causal_graph import CausalGraph, estimate_graph_bytes
+
+
+def make_requests(path, count, seed=0):
+    """
+    Picks lookups of which about half have an answer
+    :return: (find_causality params, find_causality_targets params)
+    """
+    rnd = random.Random(seed)
+    cadb = sqlite3.connect(path + '/causality-dataset.db')
+    pairs = cadb.execute("SELECT Id1, Id2 FROM Causality").fetchall()
+    rels = [row[0] for row in cadb.execute("SELECT DISTINCT Rel FROM Causality")]
+    cadb.close()
+    genes = sorted(set(gene for pair in pairs for gene in pair))
+
+    causality = []
+    targets = []
+    for _ in range(count):
+        source, target = rnd.choice(pairs) if rnd.random() < 0.5 else (rnd.choice(genes), rnd.choice(genes))
+        causality.append({'source': {'id': source}, 'target': {'id': target},
+                          'direction': rnd.choice([None, 'strict'])})
+        targets.append({'id': rnd.choice(genes), 'rel': rnd.choice(rels + ['modulates'])})
+    return causality, targets
+
+
+def measure_graph(cadb):
+    """
+    Builds a CausalGraph while tracing allocations
+    :return: (graph, bytes it retains)
+    """
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    graph = CausalGraph(cadb)
+    graph_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    return graph, graph_bytes
+
+
+def time_requests(method, params):
+    """
+    :return: Latencies in microseconds
+    """
+    latencies = []
+    for param in params:
+        start = time.perf_counter()
+        method(param)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return latencies
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {'mean_us': round(sum(latencies) / len(latencies), 2),
+            'p50_us': round(latencies[len(latencies) // 2], 2),
+            'p95_us': round(latencies[int(len(latencies) * 0.95)], 2),
+            'max_us': round(latencies[-1], 2)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', type=int, default=1, help='scale of the synthetic resources')
+    parser.add_argument('--resources', help='use this resource folder instead of synthetic resources')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--output', default='causal-graph-benchmark.json')
+    args = parser.parse_args(argv)
+
+    path = args.resources or tempfile.mkdtemp(prefix='causality-graph-bench-')
+    try:
+        if not args.resources:
+            generate_resources(path, args.scale)
+
+        sql_agent = CausalityAgent(path)
+        start = time.time()
+        graph_agent = CausalityAgent(path, in_memory=True)
+        load_seconds = time.time() - start
+
+        causality, targets = make_requests(path, args.requests)
+        mismatches = sum(1 for param in causality
+                         if sql_agent.find_causality(param) != graph_agent.find_causality(param))
+        mismatches += sum(1 for param in targets
+                          if sql_agent.find_causality_targets(param) != graph_agent.find_causality_targets(param))
+
+        graph, graph_bytes = measure_graph(graph_agent.cadb)
+        results = {'scale': None if args.resources else args.scale, 'requests': args.requests,
+                   'edges': len(graph.edges), 'genes': len(graph.genes),
+                   'graph_memory_bytes': graph_bytes,
+                   'graph_estimated_bytes': estimate_graph_bytes(graph_agent.cadb),
+                   'graph_load_seconds': round(load_seconds, 3),
+                   'mismatches': mismatches, 'latency': {}}
+
+        for name, agent in [('sqlite', sql_agent), ('graph', graph_agent)]:
+            results['latency'][name] = {
+                'find_causality': summarize(time_requests(agent.find_causality, causality)),
+                'find_causality_targets': summarize(time_requests(agent.find_causality_targets, targets)),
+            }
+    finally:
+        if not args.resources:
+            shutil.rmtree(path, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
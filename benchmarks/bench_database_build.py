@@ -0,0 +1,150 @@
+"""Times the steps of the causality database build on synthetic resources.
+
+Every step runs in its own process, so its peak RSS isn't hidden by earlier steps.
+Results are written as JSON to compare releases:
+
+    python -m benchmarks.bench_database_build --scales 1 10 100 --output build-benchmark.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks.synthetic_resources import generate_resources
+from causality_agent.database_initializer import DatabaseInitializer, schema_version
+
+
+# The populate_tables steps in build order, with the arguments they take besides self
+build_steps = [
+    ('populate_correlation_table', True),
+    ('populate_causality_pnnl_ovarian_table', True),
+    ('populate_causality_table', True),
+    ('populate_mutsig_table', True),
+    ('classify_correlations', False),
+    ('rank_correlations', False),
+    ('populate_sif_relations_table', True),
+    ('populate_mutex_table', True),
+    ('populate_tcga_names_table', True),
+    ('populate_cellular_components_table', True),
+    ('build_indexes', False),
+]
+
+
+def run_step(path, method, takes_path):
+    """
+    Runs one DatabaseInitializer method on the database in path. Runs in a fresh process.
+    :return: (seconds, rows, peak RSS in kB)
+    """
+    db_initializer = DatabaseInitializer(path, build=False)
+    start = time.time()
+    with db_initializer.bulk_load_settings():
+        if takes_path:
+            getattr(db_initializer, method)(path)
+        else:
+            getattr(db_initializer, method)()
+    seconds = time.time() - start
+    db_initializer.cadb.close()
+
+    rows = sum(stats['rows'] for stats in db_initializer.load_stats.values())
+    return seconds, rows, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_full_build(path, workers):
+    """
+    Builds the whole database from scratch. Runs in a fresh process.
+    :return: (seconds, rows, peak RSS in kB of this process and its finished workers)
+    """
+    start = time.time()
+    db_initializer = DatabaseInitializer(path, workers=workers)
+    seconds = time.time() - start
+    db_initializer.cadb.close()
+
+    rows = sum(stats['rows'] for stats in db_initializer.load_stats.values())
+    peak_rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return seconds, rows, peak_rss
+
+
+def in_fresh_process(function, *args):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(function, *args).result()
+
+
+def remove_database(path):
+    for name in os.listdir(path):
+        if name.startswith('causality-dataset'):
+            os.remove(os.path.join(path, name))
+
+
+def make_record(name, seconds, rows, peak_rss):
+    return {'step': name, 'seconds': round(seconds, 4), 'rows': rows,
+            'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None, 'peak_rss_kb': peak_rss}
+
+
+def benchmark_scale(path, scale, workers):
+    """
+    Generates the resources of a scale in path and times each build step,
+    then a full sequential and a full parallel build
+    :return: Result dictionary of the scale
+    """
+    start = time.time()
+    lines = generate_resources(path, scale)
+    result = {'scale': scale, 'generated_lines': lines, 'generation_seconds': round(time.time() - start, 2),
+              'steps': []}
+
+    for method, takes_path in build_steps:
+        seconds, rows, peak_rss = in_fresh_process(run_step, path, method, takes_path)
+        result['steps'].append(make_record(method, seconds, rows, peak_rss))
+        print('%4dx %-40s %8.2f s %10d rows %8d kB' % (scale, method, seconds, rows, peak_rss))
+
+    result['db_size_bytes'] = os.path.getsize(os.path.join(path, 'causality-dataset.db'))
+
+    for name, build_workers in [('populate_tables', 1), ('populate_tables_parallel', workers)]:
+        remove_database(path)
+        seconds, rows, peak_rss = in_fresh_process(run_full_build, path, build_workers)
+        record = make_record(name, seconds, rows, peak_rss)
+        record['workers'] = build_workers
+        result['steps'].append(record)
+        print('%4dx %-40s %8.2f s %10d rows %8d kB' % (scale, name, seconds, rows, peak_rss))
+
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes of the parallel build')
+    parser.add_argument('--output', default='build-benchmark.json')
+    parser.add_argument('--keep', help='keep the generated resources in this folder')
+    args = parser.parse_args(argv)
+
+    results = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+               'sqlite': sqlite3.sqlite_version, 'schema_version': schema_version, 'platform': platform.platform(),
+               'cpu_count': os.cpu_count(), 'scales': []}
+
+    for scale in args.scales:
+        path = tempfile.mkdtemp(prefix='causality-bench-%dx-' % scale)
+        try:
+            results['scales'].append(benchmark_scale(path, scale, args.workers))
+        finally:
+            if args.keep:
+                shutil.move(path, os.path.join(args.keep, '%dx' % scale))
+            else:
+                shutil.rmtree(path, ignore_errors=True)
+
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, indent=2)
+    print('Results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,116 @@
+"""Measures the latency and the allocations of the result objects of causality, correlation and mutex lookups.
+
+Only the public CausalityAgent methods are called, so runs on different versions compare:
+
+    python -m benchmarks.bench_records --scale 10 --output records-benchmark.json
+"""
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import tracemalloc
+from benchmarks.synthetic_resources import generate_resources
+from causality_agent.causality_agent import CausalityAgent
+
+
+causality_keys = ['id1', 'mods1', 'id2', 'mods2', 'rel', 'uri_str']
+correlation_keys = ['id1', 'pSite1', 'id2', 'pSite2', 'correlation', 'pVal', 'explainable']
+mutex_keys = ['group', 'score', 'alteration_set', 'network']
+
+
+def serialize(results, keys):
+    """
+    Reads every field the way the KQML responses do
+    """
+    return [dict((key, result[key]) for key in keys) for result in results or []]
+
+
+def measure(name, calls, repeat):
+    """
+    Times the calls without tracing, keeping the fastest of repeat runs,
+    then runs them once more to count the allocations with tracemalloc
+    :param calls: List of functions without arguments
+    :param repeat:
+    :return: Result dictionary
+    """
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for call in calls:
+            call()
+        run_seconds = time.perf_counter() - start
+        seconds = run_seconds if seconds is None else min(seconds, run_seconds)
+
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    kept = [call() for call in calls]
+    retained_blocks = sys.getallocatedblocks() - blocks
+    retained_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+
+    return {'lookup': name, 'calls': len(calls), 'mean_us': round(seconds / len(calls) * 1e6, 2),
+            'retained_blocks_per_call': round(retained_blocks / len(calls), 1),
+            'retained_bytes_per_call': round(retained_bytes / len(calls), 1), 'peak_bytes': peak_bytes}
+
+
+def make_calls(agent, path, hub_cnt):
+    cadb = sqlite3.connect(path + '/causality-dataset.db')
+    hubs = [row[0] for row in cadb.execute("SELECT Id1 FROM Causality GROUP BY Id1 ORDER BY COUNT(*) DESC LIMIT ?",
+                                           (hub_cnt,))]
+    correlated = [row[0] for row in cadb.execute("SELECT Id1 FROM Correlations GROUP BY Id1 "
+                                                 "ORDER BY COUNT(*) DESC LIMIT ?", (hub_cnt,))]
+    mutex = cadb.execute("SELECT m.Gene, g.Disease FROM MutexMembers m INNER JOIN MutexGroups g "
+                         "ON g.GroupId = m.GroupId GROUP BY m.Gene, g.Disease ORDER BY COUNT(*) DESC LIMIT ?",
+                         (hub_cnt,)).fetchall()
+    cadb.close()
+
+    def next_correlations(gene, count=20):
+        agent.reset_indices()
+        return [agent.find_next_correlation(gene) for _ in range(count)]
+
+    return {
+        'find_causality_targets': ([lambda gene=gene: agent.find_causality_targets({'id': gene, 'rel': 'modulates'})
+                                    for gene in hubs], causality_keys),
+        'find_next_correlation': ([lambda gene=gene: [corr for corr in next_correlations(gene) if corr != '']
+                                   for gene in correlated], correlation_keys),
+        'find_mutex': ([lambda gene=gene, disease=disease: agent.find_mutex(gene, disease, None, None)
+                        for gene, disease in mutex], mutex_keys),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scale', type=int, default=1, help='scale of the synthetic resources')
+    parser.add_argument('--resources', help='use this resource folder instead of synthetic resources')
+    parser.add_argument('--genes', type=int, default=200, help='genes queried by each lookup')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs, the fastest is kept')
+    parser.add_argument('--output', default='records-benchmark.json')
+    args = parser.parse_args(argv)
+
+    path = args.resources or tempfile.mkdtemp(prefix='causality-records-bench-')
+    try:
+        if not args.resources:
+            generate_resources(path, args.scale)
+        agent = CausalityAgent(path)
+
+        results = {'scale': None if args.resources else args.scale, 'lookups': []}
+        for name, (calls, keys) in make_calls(agent, path, args.genes).items():
+            results['lookups'].append(measure(name, calls, args.repeat))
+            results['lookups'].append(measure(name + ' + serialize',
+                                              [lambda call=call: serialize(call(), keys) for call in calls],
+                                              args.repeat))
+    finally:
+        if not args.resources:
+            shutil.rmtree(path, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
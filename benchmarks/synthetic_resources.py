@@ -0,0 +1,163 @@
+"""Generates synthetic resource folders in the formats read by DatabaseInitializer.
+Sizes grow linearly with the scale factor, so 1, 10 and 100 give comparable runs."""
+import os
+import random
+from causality_agent.database_initializer import tcga_study_names, loc_list, opposite_rel, mutex_variants
+
+
+# Sizes of the 1x resource set
+base_sizes = {
+    'sif_edges': 100000,
+    'causal_priors': 5000,
+    'causative_relations': 500,
+    'correlations': 20000,
+    'mutex_groups': 40,  # per study and variant
+    'gmt_sets': 200,
+    'gmt_set_size': 50,
+}
+
+# The gene universe stops growing at the size of the human genome
+max_genes = 20000
+
+sif_relation_types = ['controls-state-change-of', 'controls-expression-of', 'in-complex-with', 'interacts-with',
+                      'controls-transport-of', 'catalysis-precedes', 'controls-production-of', 'neighbor-of']
+
+
+def generate_resources(path, scale=1, seed=0):
+    """
+    Writes a complete synthetic resource folder
+    :param path: Folder to write into, created if missing
+    :param scale: Multiplier of base_sizes
+    :param seed: Seed of the random generator
+    :return: {file name: number of generated lines}
+    """
+    rnd = random.Random(seed)
+    sizes = dict((name, int(size * scale)) for name, size in base_sizes.items())
+    sizes['mutex_groups'] = base_sizes['mutex_groups']
+    sizes['gmt_set_size'] = base_sizes['gmt_set_size']
+    genes = ['G%05d' % i for i in range(min(2000 * scale, max_genes))]
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    causative = make_site_relations(rnd, genes, sizes['causative_relations'])
+
+    return {
+        'PC.sif': write_pc_sif(rnd, path, genes, sizes['sif_edges']),
+        'causal-priors.txt': write_causal_priors(rnd, path, genes, sizes['causal_priors']),
+        'causative-data-centric.sif': write_causative_sif(rnd, path, causative),
+        'PNNL-ovarian-correlations.txt': write_correlations(rnd, path, genes, causative, sizes['correlations']),
+        'scores-mutsig.txt': write_mutsig(rnd, path, genes),
+        'ranked-groups.txt': write_mutex(rnd, path, genes, sizes['mutex_groups']),
+        'tcga_disease_names.tsv': write_tcga_names(path),
+        'c5.cc.v6.1.symbols.gmt': write_gmt(rnd, path, genes, sizes['gmt_sets'], sizes['gmt_set_size']),
+    }
+
+
+def random_site(rnd):
+    return '%s%d' % (rnd.choice('STY'), rnd.randint(1, 1500))
+
+
+def make_site_relations(rnd, genes, count):
+    """
+    :return: List of (gene1, site1, relation, gene2, site2) phosphorylation relations
+    """
+    return [(rnd.choice(genes), random_site(rnd), rnd.choice(['phosphorylates', 'dephosphorylates']),
+             rnd.choice(genes), random_site(rnd)) for _ in range(count)]
+
+
+def write_pc_sif(rnd, path, genes, count):
+    with open(os.path.join(path, 'PC.sif'), 'w') as fp:
+        for _ in range(count):
+            fp.write('%s\t%s\t%s\n' % (rnd.choice(genes), rnd.choice(sif_relation_types), rnd.choice(genes)))
+    return count
+
+
+def write_causal_priors(rnd, path, genes, count):
+    rels = list(opposite_rel)
+    with open(os.path.join(path, 'causal-priors.txt'), 'w') as fp:
+        for i in range(count):
+            rel = rnd.choice(rels)
+            uris = 'http://pathwaycommons.org/pc2/Catalysis_%d http://pathwaycommons.org/pc2/Control_%d' % (i, i)
+            if 'phosphorylates' in rel:
+                sites = ';'.join(random_site(rnd) for _ in range(rnd.randint(1, 3)))
+                fp.write('%s\t%s\t%s\t%s\t%s\n' % (rnd.choice(genes), rel, rnd.choice(genes), uris, sites))
+            else:
+                fp.write('%s\t%s\t%s\t%s\n' % (rnd.choice(genes), rel, rnd.choice(genes), uris))
+    return count
+
+
+def write_causative_sif(rnd, path, relations):
+    with open(os.path.join(path, 'causative-data-centric.sif'), 'w') as fp:
+        for i, (gene1, site1, rel, gene2, site2) in enumerate(relations):
+            fp.write('%s-%s%s\t%s\t%s-%s%s\thttp://pathwaycommons.org/pc2/Catalysis_%d\n' %
+                     (gene1, site1, site1[0].lower(), rel, gene2, site2, site2[0].lower(), i))
+    return len(relations)
+
+
+def write_correlations(rnd, path, genes, relations, count):
+    """
+    Writes correlations where the ends of the causative relations are among the first ones,
+    so that some of them are explained
+    """
+    with open(os.path.join(path, 'PNNL-ovarian-correlations.txt'), 'w') as fp:
+        for i in range(count):
+            if i < len(relations):
+                gene1, site1, _, gene2, site2 = relations[i]
+            else:
+                gene1, site1, gene2, site2 = rnd.choice(genes), random_site(rnd), rnd.choice(genes), random_site(rnd)
+            fp.write('%s-%s%s\t%s-%s%s\t%r\t%r\n' % (gene1, site1, site1[0].lower(), gene2, site2, site2[0].lower(),
+                                                     rnd.uniform(-1, 1), rnd.random()))
+    return count
+
+
+def write_mutsig(rnd, path, genes):
+    header = ['rank', 'gene', 'longname', 'codelen', 'nnei', 'nncd', 'nsil', 'nmis', 'nstp', 'nspl', 'nind',
+              'nnon', 'npat', 'nsite', 'pCV', 'pCL', 'pFN', 'p', 'q']
+    line_cnt = 0
+    for study in tcga_study_names:
+        folder = os.path.join(path, 'TCGA', study)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        with open(os.path.join(folder, 'scores-mutsig.txt'), 'w') as fp:
+            fp.write('\t'.join(header) + '\n')
+            for rank, gene in enumerate(genes, 1):
+                counts = '\t'.join(str(rnd.randint(0, 400)) for _ in range(11))
+                p_val = rnd.random() ** 3
+                fp.write('%d\t%s\t%s protein\t%s\t%e\t%e\t%e\t%e\t%e\n' %
+                         (rank, gene, gene, counts, p_val, p_val, p_val, p_val, min(1.0, p_val * 10)))
+        line_cnt += len(genes)
+    return line_cnt
+
+
+def write_mutex(rnd, path, genes, count):
+    line_cnt = 0
+    for study in tcga_study_names:
+        for alteration_set, network in mutex_variants:
+            folder = os.path.join(path, 'tcga-mutex-results', study, alteration_set, network)
+            if not os.path.isdir(folder):
+                os.makedirs(folder)
+            with open(os.path.join(folder, 'ranked-groups.txt'), 'w') as fp:
+                fp.write('Score\tq-val\tMembers\n')
+                for _ in range(count):
+                    members = rnd.sample(genes, rnd.randint(2, 6))
+                    fp.write('%r\t%r\t%s\n' % (rnd.random() * 0.1, rnd.random(), '\t'.join(members)))
+            line_cnt += count
+    return line_cnt
+
+
+def write_tcga_names(path):
+    with open(os.path.join(path, 'tcga_disease_names.tsv'), 'w') as fp:
+        fp.write('longName\tabbr\n')
+        for study in tcga_study_names:
+            fp.write('%s cancer\t%s\n' % (study.lower(), study))
+    return len(tcga_study_names)
+
+
+def write_gmt(rnd, path, genes, count, set_size):
+    names = loc_list + ['GO_COMPONENT_%d' % i for i in range(max(0, count - len(loc_list)))]
+    with open(os.path.join(path, 'c5.cc.v6.1.symbols.gmt'), 'w') as fp:
+        for name in names:
+            members = rnd.sample(genes, min(set_size, len(genes)))
+            fp.write('%s\thttp://www.broadinstitute.org/gsea/msigdb/cards/%s\t%s\n' % (name, name, '\t'.join(members)))
+    return len(names)
@@ -0,0 +1,123 @@
+import sys
+import time
+import logging
+from .records import CausalityRecord, decode_sites
+
+
+logger = logging.getLogger('CausalA')
+
+# Approximate bytes the graph takes for each relationship besides its URI string, and for each gene.
+# Measured with tracemalloc by benchmarks/bench_causal_graph.py, rounded up.
+edge_bytes = 300
+gene_bytes = 800
+
+
+def estimate_graph_bytes(cadb):
+    """
+    Estimates the memory a CausalGraph of the database would take, from counts that SQLite
+    gets without building the graph
+    :param cadb: Connection to the causality database
+    :return: Bytes
+    """
+    with cadb:
+        cur = cadb.cursor()
+        edge_cnt, uri_bytes = cur.execute("SELECT COUNT(*), IFNULL(SUM(LENGTH(UriStr)), 0) FROM Causality").fetchone()
+        gene_cnt = cur.execute("SELECT COUNT(*) FROM (SELECT Id1 FROM Causality UNION SELECT Id2 FROM Causality)")\
+            .fetchone()[0]
+    return edge_cnt * edge_bytes + gene_cnt * gene_bytes + uri_bytes
+
+
+class CausalGraph:
+    """ Keeps the Causality table in memory to answer causality lookups without SQL"""
+
+    def __init__(self, cadb):
+        """
+        Reads the whole Causality table in file order
+        :param cadb: Connection to the causality database
+        """
+        start = time.time()
+
+        # gene symbols are interned to ids, so the adjacency keeps small integers
+        self.genes = []
+        self.gene_ids = {}
+        # (id1, sites1, id2, sites2, rel, uri_str) of every relationship in file order
+        self.edges = []
+        # {gene id: {rel: [edge index]}} from sources and from targets
+        self.forward = {}
+        self.reverse = {}
+
+        with cadb:
+            cur = cadb.cursor()
+            for id1, p_site1, id2, p_site2, rel, uri_str in \
+                    cur.execute("SELECT Id1, PSite1, Id2, PSite2, Rel, UriStr FROM Causality ORDER BY rowid"):
+                self.add_edge(id1, decode_sites(p_site1), id2, decode_sites(p_site2), rel, uri_str)
+
+        logger.info('Loaded %d causal relationships of %d genes into memory in %.2f s' %
+                    (len(self.edges), len(self.genes), time.time() - start))
+
+    def intern(self, gene):
+        gene_id = self.gene_ids.get(gene)
+        if gene_id is None:
+            gene_id = len(self.genes)
+            self.gene_ids[gene] = gene_id
+            self.genes.append(gene)
+        return gene_id
+
+    def add_edge(self, id1, sites1, id2, sites2, rel, uri_str):
+        gene1 = self.intern(id1)
+        gene2 = self.intern(id2)
+        rel = sys.intern(rel)
+        edge_ind = len(self.edges)
+        self.edges.append((gene1, sites1, gene2, sites2, rel, uri_str))
+        self.forward.setdefault(gene1, {}).setdefault(rel, []).append(edge_ind)
+        self.reverse.setdefault(gene2, {}).setdefault(rel, []).append(edge_ind)
+
+    def to_causality(self, edge_ind):
+        """
+        :param edge_ind:
+        :return: CausalityRecord
+        """
+        gene1, sites1, gene2, sites2, rel, uri_str = self.edges[edge_ind]
+        return CausalityRecord(self.genes[gene1], sites1, self.genes[gene2], sites2, rel, uri_str)
+
+    def find_causality(self, sources, targets, strict=False):
+        """
+        Finds the first relationship from any of sources to any of targets
+        :param sources: List of gene symbols
+        :param targets: List of gene symbols
+        :param strict: If True, relations of the form is-...-by are skipped
+        :return: Causality object, or '' if there is none
+        """
+        target_ids = set(self.gene_ids[target] for target in targets if target in self.gene_ids)
+        first = None
+        for source in sources:
+            for rel, edge_inds in self.forward.get(self.gene_ids.get(source), {}).items():
+                if strict and 'is' in rel:
+                    continue
+                for edge_ind in edge_inds:
+                    if first is not None and edge_ind >= first:
+                        break
+                    if self.edges[edge_ind][2] in target_ids:
+                        first = edge_ind
+                        break
+
+        return self.to_causality(first) if first is not None else ''
+
+    def find_targets(self, sources, rel=None):
+        """
+        Finds the relationships from sources
+        :param sources: List of gene symbols
+        :param rel: Relation type, any if None
+        :return: List of causality objects in file order
+        """
+        edge_inds = []
+        for source in sources:
+            rels = self.forward.get(self.gene_ids.get(source), {})
+            if rel is None:
+                for rel_edge_inds in rels.values():
+                    edge_inds.extend(rel_edge_inds)
+            else:
+                edge_inds.extend(rels.get(rel, []))
+
+        return [self.to_causality(edge_ind) for edge_ind in sorted(set(edge_inds))]
+
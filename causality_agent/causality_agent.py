@@ -1,39 +1,238 @@
-import re
-from .database_initializer import DatabaseInitializer
-import http.client, urllib.parse
-import requests
+import os
+import time
+import logging
+import threading
+from .database_initializer import DatabaseInitializer, read_generation
+from .connection_pool import ConnectionPool
+from .causal_graph import CausalGraph, estimate_graph_bytes
+from .records import CausalityRecord, CorrelationRecord, MutexRecord, decode_sites
+from .path_search import PathSearch, path_relations, default_max_depth, default_max_expansions
+from .upstream_index import UpstreamIndex
+from .location_index import LocationIndex, component_name
+from .session_store import SessionStore, default_max_sessions, default_session_ttl
+from .disease_resolver import DiseaseResolver
+from .mutsig_matrix import MutSigMatrix
+from .gene_summary_cache import GeneSummaryCache, cache_name
+from .summary_client import SummaryClient, default_gene_summary_url, default_summary_timeout
+from .result_cache import ResultCache, cached_result, default_result_cache_bytes
+
+logger = logging.getLogger('CausalA')
+
+# Largest estimated size of the in-memory causal graph; a larger graph isn't built and lookups stay in SQLite
+graph_memory_budget = 512 * 2 ** 20
+
+# Seconds between checks of the database generation, which changes when another process updates the database
+generation_check_interval = 1
+
+# Pair rows bound per query by find_causality_many, three parameters each,
+# staying below the 999 variables that older SQLite builds allow
+max_pair_rows = 300
+
+# First Causality row of each pair, picked by MIN(rowid), whose bare columns SQLite takes from the same row
+causality_pairs_query = "WITH Pairs(PairId, Source, Target) AS (VALUES %s) " \
+                        "SELECT Pairs.PairId, MIN(Causality.rowid), Causality.* FROM Pairs " \
+                        "INNER JOIN Causality ON Causality.Id1 = Pairs.Source AND Causality.Id2 = Pairs.Target " \
+                        "%sGROUP BY Pairs.PairId"
+
 
 class CausalityAgent:
-    def __init__(self, path):
-        self.corr_ind = 0
-        self.causality_ind = 0
+    # Representative lookups of each query method, checked against the indexes by check_query_plans
+    plan_queries = [
+        (causality_pairs_query % ("(?, ?, ?), (?, ?, ?)", "WHERE instr(Causality.Rel, 'is') = 0 "),
+         (0, 'MAPK1', 'JUND', 1, 'MAPK1', 'ERF')),
+        ("SELECT * FROM Causality WHERE Rel = ? AND Id1 IN (?, ?) ORDER BY rowid",
+         ('phosphorylates', 'MAPK1', 'BRAF')),
+        ("SELECT Rank, Id1, PSite1, Id2, PSite2, Corr, PVal FROM RankedCorrelations "
+         "WHERE Gene = ? AND Explained = ? AND Rank >= ? ORDER BY Rank LIMIT 1", ('AKT1', 1, 0)),
+        ("SELECT * FROM Correlations WHERE Id1 = ? AND PSite1 = ?  AND Id2 = ?  AND PSite2 = ? "
+         "OR Id1 = ? AND PSite1 = ?  AND Id2 = ?  AND PSite2 = ? ",
+         ('AKT1', 'S473S', 'BRAF', 'S365S', 'BRAF', 'S365S', 'AKT1', 'S473S')),
+        ("SELECT g.GroupId, g.Score, a.Gene, g.AlterationSet, g.Network FROM MutexMembers m "
+         "INNER JOIN MutexGroups g ON g.GroupId = m.GroupId "
+         "INNER JOIN MutexMembers a ON a.GroupId = g.GroupId "
+         "WHERE m.Gene = ?1 AND g.Disease = ?2 "
+         "AND (?3 IS NULL OR g.AlterationSet = ?3) AND (?4 IS NULL OR g.Network = ?4) "
+         "ORDER BY g.GroupId, a.Position", ('TP53', 'BRCA', None, None)),
+        ("SELECT RelId FROM SifRelationTypes WHERE Rel = ?", ('controls-state-change-of',)),
+        ("SELECT Id2, Id1 FROM Sif_Relations WHERE RelId = ? ORDER BY Id2, Id1", (1,)),
+        ("SELECT Component FROM CellularComponents WHERE Gene = ?", ('AKT1',)),
+    ]
+
+    def __init__(self, path, snapshot=False, in_memory=False, max_sessions=default_max_sessions,
+                 session_ttl=default_session_ttl, load_to_memory=False, gene_summary_url=default_gene_summary_url,
+                 gene_summary_timeout=default_summary_timeout, result_cache_bytes=default_result_cache_bytes,
+                 gene_summary_cache=None, sif_relations=None):
+        """
+        :param path: Path to the folder that keeps all the data files
+        :param snapshot: Open the read-only database snapshot
+        :param in_memory: Answer causality lookups from a CausalGraph loaded at startup
+        :param load_to_memory: Copy the whole database into memory at startup. Startup takes longer
+        and the process keeps the database in its memory, but no query waits for the disk.
+        :param max_sessions: Most (conversation, gene) correlation cursors kept
+        :param session_ttl: Seconds a correlation cursor is kept after its last use
+        :param gene_summary_url: Service asked for the gene summaries missing from the cache
+        :param gene_summary_timeout: Seconds to wait for the service
+        :param result_cache_bytes: Largest total size of the query results kept, no results are kept if 0
+        :param gene_summary_cache: Database file of the gene summary cache, gene-summaries.db in path if None.
+        The summaries are kept in memory if it can't be opened or written.
+        :param sif_relations: Relation types loaded from PC.sif, all of them if None.
+        Sif_Relations is loaded again when it changes.
+        """
+        # [explained rank, unexplained rank] of the next correlation, per conversation and gene
+        self.cursors = SessionStore(lambda: [0, 0], max_sessions, session_ttl)
+
+        self.path = path
+        self.db_initializer = DatabaseInitializer(path, snapshot=snapshot, sif_relations=sif_relations)
+
+        # queries run on read-only connections of their own thread, so requests can be served concurrently
+        self.db_initializer.cadb.close()
+        self.pool = ConnectionPool(self.db_initializer.db_file, immutable=snapshot, memory=load_to_memory)
+
+        self.in_memory = in_memory
+        self.graph = self.load_graph() if in_memory else None
+
+        # disease names of the TCGA studies, matched in memory
+        self.disease_resolver = DiseaseResolver(path)
+
+        # summaries of the biogene service, kept apart from the read-only causality database
+        if gene_summary_cache is None:
+            gene_summary_cache = os.path.join(path, cache_name)
+        self.summary_client = SummaryClient(GeneSummaryCache(gene_summary_cache), gene_summary_url,
+                                            timeout=gene_summary_timeout)
+
+        # built at the first query that needs them
+        self.path_search = None
+        self.upstream_index = None
+        self.location_index = None
+        self.mutsig_matrix = None
+        # the index_lock guards the generation the indexes are kept for, and each index
+        # has a lock of its own, so a slow build doesn't hold up the builds of the others
+        self.index_lock = threading.Lock()
+        self.index_build_locks = dict((name, threading.Lock()) for name in
+                                      ['path_search', 'upstream_index', 'location_index', 'mutsig_matrix'])
+
+        # results of the find methods, keyed by the generation of the database they were read from
+        self.result_cache = ResultCache(result_cache_bytes) if result_cache_bytes else None
+        self.generation = read_generation(self.cadb)
+        self.generation_checked = time.monotonic()
 
-        self.db_initializer = DatabaseInitializer(path)
+    def __del__(self):
+        self.pool.close()
+        self.summary_client.close()
 
-        self.cadb = self.db_initializer.cadb
+    def load_graph(self):
+        """
+        :return: CausalGraph of the database, None if its estimated size is over the memory budget
+        """
+        graph_bytes = estimate_graph_bytes(self.cadb)
+        if graph_bytes > graph_memory_budget:
+            logger.warning('The causal graph would take about %.1f MB, more than the budget of %.1f MB. '
+                           'Causality lookups stay in the database.' %
+                           (graph_bytes / 2 ** 20, graph_memory_budget / 2 ** 20))
+            return None
+        return CausalGraph(self.cadb)
 
-    def __del__(self):
-        self.cadb.close()
+    def refresh_generation(self):
+        """
+        Rereads the generation of the database at most every generation_check_interval seconds.
+        When it changed, the results and the indexes read from the old contents are dropped.
+        :return: The current generation
+        """
+        now = time.monotonic()
+        if now - self.generation_checked < generation_check_interval:
+            return self.generation
+        self.generation_checked = now
+
+        generation = read_generation(self.cadb)
+        if generation != self.generation:
+            logger.info('The database changed from generation %s to %s' % (self.generation, generation))
+            graph = self.load_graph() if self.in_memory else None
+            with self.index_lock:
+                self.path_search = None
+                self.upstream_index = None
+                self.location_index = None
+                self.mutsig_matrix = None
+                if self.in_memory:
+                    self.graph = graph
+                self.generation = generation
+            if self.result_cache is not None:
+                self.result_cache.clear()
+        return self.generation
+
+    def reopen(self):
+        """
+        Opens the database file again, after DatabaseInitializer rebuilt it or replaced the snapshot,
+        or to copy it into memory again. Call it between requests, as it closes the old connections.
+        :return:
+        """
+        pool = self.pool
+        self.pool = ConnectionPool(pool.db_file, immutable=pool.immutable, memory=pool.memory_uri is not None)
+        pool.close()
+        self.generation_checked = -generation_check_interval
+        self.refresh_generation()
+
+    @property
+    def cadb(self):
+        """
+        :return: Database connection of the calling thread
+        """
+        return self.pool.connection()
 
-    def reset_indices(self):
-        self.corr_ind = 0
-        self.causality_ind = 0
+    def get_index(self, name, make_index):
+        """
+        Builds a lookup index at its first use. Threads asking for it meanwhile wait for the same build.
+        An index whose build overlapped a change of the generation answers only the request that built it.
+        :param name: Attribute keeping the index
+        :param make_index: Function building the index
+        :return:
+        """
+        index = getattr(self, name)
+        if index is None:
+            with self.index_build_locks[name]:
+                index = getattr(self, name)
+                if index is None:
+                    generation = self.generation
+                    index = make_index()
+                    with self.index_lock:
+                        if self.generation == generation:
+                            setattr(self, name, index)
+        return index
+
+    def reset_indices(self, conversation=None):
+        """
+        Restarts the correlations of every gene in a conversation from the first one
+        :param conversation: Conversation id, None for requests without one
+        :return:
+        """
+        self.cursors.reset(conversation)
 
-    def get_tcga_abbr(self, long_name):
+    def check_query_plans(self):
         """
-        Gets the study abbreviation given its long name
-        :param long_name:
+        Asserts that the query plan of every lookup in plan_queries searches an index
+        instead of scanning a whole table. Scans of the query's own VALUES lists are fine.
         :return:
         """
+        unindexed = []
         with self.cadb:
             cur = self.cadb.cursor()
+            tables = set(row[0] for row in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+            for query, args in self.plan_queries:
+                plan = cur.execute("EXPLAIN QUERY PLAN " + query, args).fetchall()
+                scans = [row[-1] for row in plan if row[-1].startswith('SCAN') and 'INDEX' not in row[-1] and
+                         row[-1].split()[1] in tables]
+                if scans:
+                    unindexed.append('%s: %s' % (query, '; '.join(scans)))
 
-            name = cur.execute("SELECT Abbr FROM TCGA WHERE longName = ?", (long_name,)).fetchone()
+        if unindexed:
+            raise AssertionError('Queries without an index:\n' + '\n'.join(unindexed))
 
-            if not name:
-                return None
-
-            return name[0]
+    def get_tcga_abbr(self, long_name):
+        """
+        Gets the study abbreviation given its long name, allowing for wording variations and typos
+        :param long_name: Disease name or study abbreviation in any case
+        :return: Study abbreviation, None if the name can't be resolved
+        """
+        return self.disease_resolver.resolve(long_name)
 
 
     @staticmethod
@@ -41,41 +240,7 @@ class CausalityAgent:
         """
           Convertd a row from sql table into causality object
         """
-
-        sites1 = re.findall('([TYS][0-9]+)', row[1])
-        sites2 = re.findall('([TYS][0-9]+)', row[3])
-
-        mods1 = [{'mod_type': 'phosphorylation',
-                  'residue': site[0],
-                  'position': site[1:],
-                  'is_modified': True}
-                  for site in sites1]
-
-        if not sites1:
-            mods1 = [{'mod_type': 'phosphorylation',
-                  'residue': None,
-                  'position': None,
-                  'is_modified': True}]
-
-        mods2 = [{'mod_type': 'phosphorylation',
-                  'residue': site[0],
-                  'position': site[1:],
-                  'is_modified': True}
-                  for site in sites2]
-
-        if not sites2:
-            mods2 = [{'mod_type': 'phosphorylation',
-                      'residue': None,
-                      'position': None,
-                      'is_modified': True}]
-
-        causality = {'id1': row[0], 'mods1': mods1,
-                     'id2': row[2], 'mods2': mods2,
-                     'rel': row[4],
-                     'uri_str': row[5]
-                     }
-        return causality
-
+        return CausalityRecord(row[0], decode_sites(row[1]), row[2], decode_sites(row[3]), row[4], row[5])
 
     @staticmethod
     def row_to_correlation(row):
@@ -85,17 +250,7 @@ class CausalityAgent:
         :param row:
         :return:
         """
-        l1 = len(row[1])
-        p_site1 = row[1][1:l1-1]
-
-        l2 = len(row[3])
-        p_site2 = row[3][1:l2-1]
-
-        corr = {'id1': row[0], 'pSite1': p_site1,
-                'id2': row[2], 'pSite2': p_site2, 'correlation': row[4],
-                'pVal': row[5],
-                'explainable': "unassigned"}
-        return corr
+        return CorrelationRecord(row[0], row[1][1:-1], row[2], row[3][1:-1], row[4], row[5])
 
     def find_causality(self, param):
         """
@@ -103,67 +258,130 @@ class CausalityAgent:
         :param param: {source:{id: }, target:{id:}}
         :return:
         """
+        sources = param.get('source').get('id')
+        targets = param.get('target').get('id')
 
-        with self.cadb:
-            cur = self.cadb.cursor()
-            sources = param.get('source').get('id')
-            targets = param.get('target').get('id')
-            direction = param.get('direction')
+        return self.find_causality_many([(sources, targets)], param.get('direction'))[0]
 
-            if isinstance(sources, list):
-                source_str = "(" + ", ".join((("'" + str(source) + "'") for source in sources)) + ")"
-            else:
-                source_str = "('" + sources + "')"
+    @cached_result
+    def find_causality_many(self, pairs, direction=None):
+        """
+        Finds the causal relationship of many source and target pairs in one query
+        :param pairs: List of (source, target), where source and target are a gene or a list of genes
+        :param direction: If 'strict', relations of the form is-...-by are skipped
+        :return: List of causality objects in the order of pairs, '' for pairs without a relationship
+        """
+        gene_lists = []
+        for sources, targets in pairs:
+            if not isinstance(sources, list):
+                sources = [sources]
+            if not isinstance(targets, list):
+                targets = [targets]
+            gene_lists.append(([str(source) for source in sources], [str(target) for target in targets]))
 
-            if isinstance(targets, list):
-                target_str = "(" + ", ".join((("'" + str(target) + "'") for target in targets)) + ")"
-            else:
-                target_str = "('" + targets + "')"
+        strict = direction is not None and direction.lower() == 'strict'
 
-            query = "SELECT * FROM Causality WHERE Id1 IN " + source_str + "AND Id2 IN  " + target_str
+        if self.graph is not None:
+            return [self.graph.find_causality(sources, targets, strict) for sources, targets in gene_lists]
 
-            rows = cur.execute(query).fetchall()
+        expanded = [(pair_id, source, target) for pair_id, (sources, targets) in enumerate(gene_lists)
+                    for source in sources for target in targets]
 
-            if len(rows) > 0:
-                for row in rows:
-                    if direction and direction.lower() == 'strict':  # return the first active row
-                        if 'is' not in row[4]:
-                            causality = self.row_to_causality(row)
-                            return causality
-                    else:  # return the first row
-                        causality = self.row_to_causality(row)
-                        return causality
+        # (rowid, row) of the first relationship of each pair, in causal priors file order
+        first_rows = {}
+        with self.cadb:
+            cur = self.cadb.cursor()
+            for i in range(0, len(expanded), max_pair_rows):
+                chunk = expanded[i:i + max_pair_rows]
+                query = causality_pairs_query % (", ".join(["(?, ?, ?)"] * len(chunk)),
+                                                 "WHERE instr(Causality.Rel, 'is') = 0 " if strict else "")
+                args = [arg for pair in chunk for arg in pair]
+                for row in cur.execute(query, args):
+                    pair_id, rowid = row[0], row[1]
+                    if pair_id not in first_rows or rowid < first_rows[pair_id][0]:
+                        first_rows[pair_id] = (rowid, row[2:])
+
+        return [self.row_to_causality(first_rows[pair_id][1]) if pair_id in first_rows else ''
+                for pair_id in range(len(pairs))]
+
+    @cached_result
+    def find_causal_path(self, source, target, max_depth=default_max_depth, max_expansions=default_max_expansions):
+        """
+        Finds a shortest chain of causal relationships from source to target
+        :param source: Gene symbol
+        :param target: Gene symbol
+        :param max_depth: Most relationships on the path
+        :param max_expansions: Most genes expanded before giving up
+        :return: List of causality objects from source to target, None if there is no path within the limits
+        """
+        path_search = self.get_index('path_search', self.make_path_search)
+        if not path_search:
+            return self.find_direct_path(str(source), str(target))
 
-            return ''
+        return path_search.find_path(str(source), str(target), max_depth, max_expansions)
 
+    def make_path_search(self):
+        """
+        :return: PathSearch over the causal graph, False if the graph is over the memory budget
+        """
+        graph = self.graph if self.graph is not None else self.load_graph()
+        if graph is None:
+            return False
+        return PathSearch(graph)
 
+    def find_direct_path(self, source, target):
+        """
+        Finds a path of one relationship in SQLite, for when the causal graph is over the memory budget
+        :param source: Gene symbol
+        :param target: Gene symbol
+        :return: List of the first causality object from source to target over path_relations, None if there is none
+        """
+        if source == target:
+            return None
+        with self.cadb:
+            cur = self.cadb.cursor()
+            row = cur.execute("SELECT Id1, PSite1, Id2, PSite2, Rel, UriStr FROM Causality "
+                              "WHERE Id1 = ? AND Id2 = ? AND Rel IN (%s) ORDER BY rowid LIMIT 1" %
+                              ', '.join('?' * len(path_relations)), [source, target] + path_relations).fetchone()
+        if row is None:
+            return None
+        return [self.row_to_causality(row)]
 
+    @cached_result
     def find_causality_targets(self, param):
         """
         Finds the causal relationship from gene list
         :param param: param: {id:[]}
         :return:
         """
-        with self.cadb:
-            cur = self.cadb.cursor()
-            genes = param.get('id')
+        genes = param.get('id')
+
+        if not isinstance(genes, list):
+            genes = [genes]
+        genes = [str(gene) for gene in genes]
 
-            if isinstance(genes, list):
-                id_str =  ", ".join((("'" + str(gene) + "'") for gene in genes))
+        rel = param.get('rel')
+
+        if self.graph is not None:
+            if rel.upper() in ("MODULATES", "IS-MODULATED-BY"):
+                targets = self.graph.find_targets(genes)
             else:
-                id_str = "('" + genes + "')"
+                targets = self.graph.find_targets(genes, rel)
+            return targets if targets else None
 
-            rel = param.get('rel')
+        with self.cadb:
+            cur = self.cadb.cursor()
+            id_str = ", ".join("?" * len(genes))
 
             if rel.upper() == "MODULATES":
-                query = "SELECT * FROM Causality WHERE Id1 IN " + "(" + id_str + ")";
-                rows = cur.execute(query).fetchall()
+                query = "SELECT * FROM Causality WHERE Id1 IN (" + id_str + ") ORDER BY rowid"
+                rows = cur.execute(query, genes).fetchall()
             elif rel.upper() == "IS-MODULATED-BY":
-                query = "SELECT * FROM Causality WHERE Id1 IN " + "(" + id_str + ")";
-                rows = cur.execute(query).fetchall()
+                query = "SELECT * FROM Causality WHERE Id1 IN (" + id_str + ") ORDER BY rowid"
+                rows = cur.execute(query, genes).fetchall()
             else:
-                query = "SELECT * FROM Causality WHERE Rel = ?  AND Id1 IN " + "(" + id_str + ")";
-                rows = cur.execute(query, (rel,)).fetchall()
+                query = "SELECT * FROM Causality WHERE Rel = ? AND Id1 IN (" + id_str + ") ORDER BY rowid"
+                rows = cur.execute(query, [rel] + genes).fetchall()
 
 
             if not rows:
@@ -176,41 +394,39 @@ class CausalityAgent:
 
             return targets
 
-    def find_next_correlation(self, gene):
+    def find_next_correlation(self, gene, conversation=None):
         """
         Returns the next interesting relationship about gene. Can be explained or unexplained
         :param gene:
+        :param conversation: Conversation id, None for requests without one
         :return:
         """
-
         with self.cadb:
             cur = self.cadb.cursor()
 
-            causal_rows = cur.execute("SELECT * FROM Explained_Correlations "
-                                      "WHERE Id1 = ? OR Id2 = ? ORDER BY ABS(Corr) DESC", (gene, gene)).fetchall()
-
-            row_cnt = len(causal_rows)
-
-            if row_cnt > self.causality_ind:
-                row = causal_rows[self.causality_ind]
-                self.causality_ind = self.causality_ind + 1
-
-                corr = self.get_correlation_between(row[0], row[1], row[2], row[3])
-                corr['explainable'] = "explainable"
+            # the cursor ranks point into the ranked correlations of the gene, read one row at a time.
+            # A row taken by a concurrent request of the conversation is skipped.
+            while True:
+                rank = self.cursors.get(conversation, gene)[0]
+                row = cur.execute("SELECT Rank, Id1, PSite1, Id2, PSite2, Corr, PVal FROM RankedCorrelations "
+                                  "WHERE Gene = ? AND Explained = 1 AND Rank >= ? ORDER BY Rank LIMIT 1",
+                                  (gene, rank)).fetchone()
+                if row is None or self.cursors.advance(conversation, gene, 0, rank, row[0] + 1):
+                    break
+
+            if row:
+                corr = self.row_to_correlation(row[1:])
+                corr.explainable = "explainable"
             else:
-                corr = self.find_next_unexplained_correlation(gene)
+                corr = self.find_next_unexplained_correlation(gene, conversation)
 
             # revert correlation info
-            if corr != '' and corr['id2'] == gene:
-                tmp = corr['id1']
-                corr['id1'] = corr['id2']
-                corr['id2'] = tmp
-                tmp = corr['pSite1']
-                corr['pSite1'] = corr['pSite2']
-                corr['pSite2'] = tmp
+            if corr != '' and corr.id2 == gene:
+                corr.swap()
 
             return corr
 
+    @cached_result
     def get_correlation_between(self, gene1, p_site1, gene2, p_site2):
         """
         When We are sure that there is a correlation between these
@@ -236,116 +452,106 @@ class CausalityAgent:
 
             return corr
 
-    def find_next_unexplained_correlation(self, gene):
+    def find_next_unexplained_correlation(self, gene, conversation=None):
         """
         Finds the next highest unexplained correlation
         :param gene:
+        :param conversation: Conversation id, None for requests without one
         :return:
         """
         with self.cadb:
             cur = self.cadb.cursor()
-            rows = cur.execute("SELECT * FROM Unexplained_Correlations "
-                               "WHERE Id1 = ? OR Id2 = ? ORDER BY ABS(Corr) DESC",
-                               (gene, gene)).fetchall()
-
-
-            row_cnt = len(rows)
-            if row_cnt > self.corr_ind:
-                row = rows[self.corr_ind]
-                self.corr_ind = self.corr_ind + 1
-                corr = self.row_to_correlation(row)
-                corr['explainable'] = "unexplainable"
+            while True:
+                rank = self.cursors.get(conversation, gene)[1]
+                row = cur.execute("SELECT Rank, Id1, PSite1, Id2, PSite2, Corr, PVal FROM RankedCorrelations "
+                                  "WHERE Gene = ? AND Explained = 0 AND Rank >= ? ORDER BY Rank LIMIT 1",
+                                  (gene, rank)).fetchone()
+                if row is None or self.cursors.advance(conversation, gene, 1, rank, row[0] + 1):
+                    break
+
+            if row:
+                corr = self.row_to_correlation(row[1:])
+                corr.explainable = "unexplainable"
                 return corr
             else:
                 return ''
 
+    @cached_result
     def find_mutation_significance(self, gene, disease):
         """
         :param single gene name and a tcga study abbreviation
         :return: string, mutation significance
         """
-        with self.cadb:
-            cur = self.cadb.cursor()
+        return self.find_mutation_significance_many([gene], [disease]).get(gene, {}).get(disease)
 
-            p_val = cur.execute("SELECT PVal FROM MutSig WHERE Id = ? AND Disease = ?", (gene, disease)).fetchone()
-
-            if not p_val:
-                return None
-            if p_val[0] < 0.01:
-                return 'highly significant'
-            elif p_val[0] < 0.05:
-                return 'significant'
-            else:
-                return 'not significant'
+    @cached_result
+    def find_mutation_significance_many(self, genes, diseases=None):
+        """
+        Finds the mutation significance of every gene in every disease at once
+        :param genes: List of gene symbols
+        :param diseases: List of TCGA study abbreviations, all studies if None
+        :return: {gene: {disease: mutation significance}}, without the pairs missing from MutSig
+        """
+        matrix = self.get_index('mutsig_matrix', lambda: MutSigMatrix(self.path, self.cadb, self.generation))
+        return matrix.find_significance([str(gene) for gene in genes], diseases)
 
-    def find_mutex(self, gene, disease):
+    @cached_result
+    def find_mutex(self, gene, disease, alteration_set='whole', network='no-network'):
         """Find a mutually exclusive group that includes gene
         :param single gene name and a tcga study abbreviation
+        :param alteration_set: whole, mutations-only or outliers-excluded. All of them if None.
+        :param network: no-network, PC2v7, fries290K, fries290K-PC2v7 or fries290K-leidos-PC2v7. All of them if None.
         :return object list
         """
 
         with self.cadb:
             cur = self.cadb.cursor()
-            groups = cur.execute("SELECT * FROM Mutex WHERE Disease = ? AND "
-                                 "(Id1 = ? OR Id2 = ? OR Id3 = ? OR Id4 = ? OR Id5 = ?) ",
-                                 (disease, gene, gene, gene, gene, gene)).fetchall()
-
-        if not groups:
+            rows = cur.execute("SELECT g.GroupId, g.Score, a.Gene, g.AlterationSet, g.Network FROM MutexMembers m "
+                               "INNER JOIN MutexGroups g ON g.GroupId = m.GroupId "
+                               "INNER JOIN MutexMembers a ON a.GroupId = g.GroupId "
+                               "WHERE m.Gene = ?1 AND g.Disease = ?2 "
+                               "AND (?3 IS NULL OR g.AlterationSet = ?3) AND (?4 IS NULL OR g.Network = ?4) "
+                               "ORDER BY g.GroupId, a.Position",
+                               (gene, disease, alteration_set, network)).fetchall()
+
+        if not rows:
             return None
         # format groups
         mutex_list = []
-        for group in groups:
-            mutex = {'group': [], 'score': str(round(group[len(group) - 1], 2))}
-            for i in range(1, len(group) - 1):
-                if group[i] is not None:
-                    mutex['group'].append(group[i])
-            mutex_list.append(mutex)
+        group_id = None
+        for row in rows:
+            if row[0] != group_id:
+                group_id = row[0]
+                mutex = MutexRecord([], str(round(row[1], 2)), row[3], row[4])
+                mutex_list.append(mutex)
+            mutex.group.append(row[2])
 
         return mutex_list
 
-    def find_common_upstreams(self, genes):
+    @cached_result
+    def find_common_upstreams(self, genes, min_count=None):
         """
         Find common upstreams between a list of genes
         :param genes:
-        :return:
+        :param min_count: If given, upstreams of at least this many of the genes instead of all of them
+        :return: List of upstream symbols, the ones shared by more genes first
         """
+        if len(genes) < 2:
+            return ''
 
-        with self.cadb:
-            cur = self.cadb.cursor()
-
-            if len(genes) < 2:
-                return ''
-
-            gene1 = genes[0]
-            gene2 = genes[1]
-
-            upstreams = cur.execute("SELECT s1.Id1 FROM Sif_Relations s1 "
-                                    "INNER JOIN Sif_Relations s2 ON (s2.Id1 = s1.Id1 AND s1.Id2 = ? AND s2.id2 = ? AND  "
-                                    "s1.Rel = 'controls-state-change-of' AND s2.Rel = s1.Rel)",
-                                    (gene1, gene2)).fetchall()
-
-            if not upstreams:
-                return None
-
-            for i in range(2, len(genes)):
-                gene = genes[i]
-
-                upstream_arr = []
-                for upstream in upstreams:
-                    upstream_arr.append(upstream[0])
-
-                query = "SELECT Id1 FROM Sif_Relations WHERE Rel = 'controls-state-change-of' AND Id2 = ? AND Id1 IN (" \
-                        + ", ".join((("'"+str(upstream)+"'") for upstream in upstream_arr)) + ")"
+        upstream_index = self.get_index('upstream_index', lambda: UpstreamIndex(self.cadb))
 
-                upstreams = cur.execute(query, (gene,)).fetchall()
+        if min_count is None:
+            upstreams = upstream_index.find_common(genes)
+        else:
+            upstreams = [symbol for symbol, _ in upstream_index.find_common_at_least(genes, min_count)]
 
-            #format upstreams
-            upstream_list = []
-            for genes in upstreams:
-                upstream_list.append(str(genes[0]))
+        if not upstreams:
+            return None
 
-            return upstream_list
+        return upstreams
 
+    @cached_result
     def find_cellular_location(self, gene):
         """
         Find subcellular location of the gene
@@ -360,81 +566,44 @@ class CausalityAgent:
 
         return location
 
+    @cached_result
     def find_most_likely_cellular_location(self, genes):
         """
-        Given a set of gene names, find the most likely cell location
+        Given a set of gene names, find the most likely cell location.
+        For more than one gene, the location has to be common to at least two of them.
         :param genes:
-        :return:
+        :return: Names of the locations with the most genes, all of them if tied
         """
+        location_index = self.get_index('location_index', lambda: LocationIndex(self.cadb))
 
-        loc_names = {}
-        max_loc_names = []
-        with self.cadb:
-            cur = self.cadb.cursor()
-
-            max_loc_cnt = 0
-            max_loc_name = ""
-            for gene in genes:
-
-                locations = cur.execute("SELECT Component FROM CellularComponents WHERE Gene = ?",
-                                        (gene,)).fetchall()
-                for location in locations:
-                    if (location in loc_names):
-                        loc_names[location[0]] += 1
-                    else:
-                        loc_names[location[0]] = 1
-                    if loc_names[location[0]] >= max_loc_cnt:
-                        max_loc_cnt = loc_names[location[0]]
-
-            # format locations
-            for location in locations:
-                if loc_names[location[0]] == max_loc_cnt:
-                    loc_name = str.strip(location[0], 'GO_')
-                    max_loc_names.append(loc_name.lower())
-                    # max_loc_names.append(str(location[0]).encode('utf8'))
-
-        return max_loc_names
-
-    def find_gene_summary(self, gene):
-        pc_url = "http://www.pathwaycommons.org/biogene/retrieve.do?"
-
-
-        headers = {"Content-type": "application/x-www-form-urlencoded","Accept": "text/plain"}
-
-
-        params = urllib.parse.urlencode({'query': gene, 'org': 'human', 'format':'json'})
-
-        # sending get request and saving the response as response object
-        r = requests.get(url=pc_url, params=params)
-
-        # extracting data in json format
-        data = r.json()
-
-        # conn = http.client.HTTPConnection(pc_url)
-        #
-        # conn.request("GET", "/retrieve.do?", params, headers)
-        #
-        #
-        #
-        # r2 = conn.getresponse()
-        #
-        #
-        #
-        # if r2.status != 200:
-        #     return -1
-        #
-        # data = r2.read().decode("utf-8")
-
-        if data['geneInfo'] and len(data['geneInfo']) > 0 and data['geneInfo'][0]['geneSummary']:
-            return data['geneInfo'][0]['geneSummary']
-        else:
-            return ""
-
+        components, gene_cnt = location_index.find_most_likely(genes)
 
+        if len(set(genes)) > 1 and gene_cnt < 2:
+            return []
 
+        return [component_name(component) for component in components]
 
+    def find_gene_summary(self, gene):
+        """
+        :param gene:
+        :return: Summary of the gene, "" if it has none or the service can't be reached
+        """
+        return self.summary_client.get_summary(gene)
 
+    def find_gene_summaries(self, genes):
+        """
+        :param genes: List of gene symbols
+        :return: {gene: summary}, fetched concurrently
+        """
+        return self.summary_client.get_summaries(genes)
 
+    def prefetch_gene_summaries(self, genes):
+        """
+        Fetches the summaries of the genes in the background, so the requests likely to follow are answered locally
+        :param genes: List of gene symbols
+        :return:
+        """
+        self.summary_client.prefetch(genes)
 
 
 # ca = CausalityAgent('./resources')
@@ -1,9 +1,16 @@
+import time
+# start of the imports, for systems that don't tell when the process started
+_import_time = time.time()
+
 import sys
 import os
 import json
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from bioagents import Bioagent
 from .causality_agent import CausalityAgent
+from .summary_client import default_gene_summary_url
 from indra.sources.trips.processor import TripsProcessor
 from kqml import KQMLModule, KQMLPerformative, KQMLList, KQMLString, KQMLToken
 
@@ -12,6 +19,26 @@ logging.basicConfig(format='%(levelname)s: %(name)s - %(message)s',
                     level=logging.INFO)
 logger = logging.getLogger('CausalA')
 
+
+def process_start_time():
+    """
+    :return: Time the process started, read from /proc, or the time this module started to import
+    where /proc isn't available
+    """
+    try:
+        with open('/proc/self/stat') as fp:
+            # the fields after the command name, which may contain spaces, start with the third one
+            fields = fp.read().rsplit(')', 1)[1].split()
+        # the 22nd field is the start in clock ticks since boot
+        running = time.clock_gettime(time.CLOCK_BOOTTIME) - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, AttributeError, IndexError, ValueError):
+        return _import_time
+    return time.time() - running
+
+
+# Startup times are measured from the start of the process, before the bioagents and indra imports
+_load_time = process_start_time()
+
 _resource_dir = os.path.dirname(os.path.realpath(__file__)) + '/resources/'
 
 
@@ -22,15 +49,51 @@ class CausalityModule(Bioagent):
              'DATASET-CORRELATED-ENTITY', 'FIND-COMMON-UPSTREAMS',
              'RESTART-CAUSALITY-INDICES', 'FIND-MUTEX', 'FIND-MUTATION-SIGNIFICANCE',
              'RESET-CAUSALITY-INDICES',  'FIND-CELLULAR-LOCATION-FROM-NAMES',
-             'FIND-CELLULAR-LOCATION', 'FIND-GENE-SUMMARY']
+             'FIND-CELLULAR-LOCATION', 'FIND-GENE-SUMMARY', 'FIND-MUTATION-SIGNIFICANCE-MANY']
 
-    def __init__(self, **kwargs):
-        self.CA = CausalityAgent(_resource_dir)
+    def __init__(self, snapshot=False, in_memory=False, threads=1, load_to_memory=False,
+                 gene_summary_url=default_gene_summary_url, gene_summary_cache=None, sif_relations=None, **kwargs):
+        """
+        :param snapshot: Answer from the read-only database snapshot, which is shared
+        by all the agent processes on a host
+        :param in_memory: Answer causality lookups from the in-memory causal graph
+        :param threads: Number of threads answering requests. With more than one,
+        a slow request doesn't hold up the others.
+        :param load_to_memory: Copy the whole database into memory at startup
+        :param gene_summary_url: Service asked for the gene summaries missing from the cache
+        :param gene_summary_cache: Database file of the gene summary cache, in the resource folder if None
+        :param sif_relations: Relation types loaded from PC.sif, all of them if None
+        """
+        self.CA = CausalityAgent(_resource_dir, snapshot=snapshot, in_memory=in_memory,
+                                 load_to_memory=load_to_memory, gene_summary_url=gene_summary_url,
+                                 gene_summary_cache=gene_summary_cache, sif_relations=sif_relations)
+        logger.info('Opened the causality database %.2f s after startup' % (time.time() - _load_time))
+        self.first_request_time = None
+        self.executor = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+        # messages are written whole, one thread at a time
+        self.send_lock = threading.Lock()
         # Call the constructor of KQMLModule
         super(CausalityModule, self).__init__(**kwargs)
 
+    def receive_request(self, msg, content):
+        if self.executor is None:
+            self.answer_request(msg, content)
+        else:
+            self.executor.submit(self.answer_request, msg, content).add_done_callback(log_request_failure)
+
+    def answer_request(self, msg, content):
+        super(CausalityModule, self).receive_request(msg, content)
+        if self.first_request_time is None:
+            self.first_request_time = time.time() - _load_time
+            logger.info('Answered the first request %.2f s after startup' % self.first_request_time)
+
+    def send(self, msg):
+        with self.send_lock:
+            super(CausalityModule, self).send(msg)
+
     def respond_reset_causality_indices(self, content):
-        self.CA.reset_indices()
+        # only the correlations of the given conversation restart
+        self.CA.reset_indices(content.gets('CONVERSATION'))
         reply = KQMLList('SUCCESS')
         return reply
 
@@ -58,16 +121,27 @@ class CausalityModule(Bioagent):
 
         result = self.CA.find_causality({'source': source, 'target': target, 'direction':direction})
 
-        if not result:
+        if result:
+            path = [result]
+        else:
+            # no direct relationship, look for a chain of them
+            max_depth = content.gets('MAX-DEPTH')
+            if max_depth:
+                path = self.CA.find_causal_path(source_name, target_name, max_depth=int(max_depth))
+            else:
+                path = self.CA.find_causal_path(source_name, target_name)
+
+        if not path:
             return self.make_failure('NO_PATH_FOUND')
 
-        indra_json = json.dumps([make_indra_json(result)])
+        indra_json = json.dumps([make_indra_json(r) for r in path])
 
         reply = KQMLList('SUCCESS')
         reply.sets('paths', indra_json)
 
         # Send PC links to provenance tab
-        self.send_provenance(result) # ['uri_str'])
+        for r in path:
+            self.send_provenance(r) # ['uri_str'])
 
         return reply
 
@@ -128,6 +202,9 @@ class CausalityModule(Bioagent):
         if not result:
             return self.make_failure('NO_PATH_FOUND')
 
+        # the summaries of the targets are often asked next
+        self.CA.prefetch_gene_summaries([r['id2'] for r in result])
+
         # Send PC links to provenance tab
         # Multiple interactions are sent separately
         for r in result:
@@ -197,7 +274,7 @@ class CausalityModule(Bioagent):
             return self.make_failure('MISSING_MECHANISM')
 
         source_name = source_names[0]
-        res = self.CA.find_next_correlation(source_name)
+        res = self.CA.find_next_correlation(source_name, content.gets('CONVERSATION'))
         if res == '':
             return self.make_failure('NO_PATH_FOUND')
 
@@ -226,7 +303,12 @@ class CausalityModule(Bioagent):
         for gene_name in gene_names:
             gene_list.append(str(gene_name))
 
-        result = self.CA.find_common_upstreams(gene_list)
+        # upstreams of at least this many of the genes, all of them if missing
+        min_count = content.gets('MIN-COUNT')
+        if min_count:
+            result = self.CA.find_common_upstreams(gene_list, min_count=int(min_count))
+        else:
+            result = self.CA.find_common_upstreams(gene_list)
 
         if not result:
             return self.make_failure('NO_UPSTREAM_FOUND')
@@ -240,6 +322,16 @@ class CausalityModule(Bioagent):
 
         return reply
 
+    def resolve_disease(self, disease_arg):
+        """
+        :param disease_arg: ekb-xml of the disease
+        :return: Abbreviation of the TCGA study of the disease, None if it can't be resolved
+        """
+        disease_names = _get_term_names(disease_arg)
+        if not disease_names:
+            return None
+        return self.CA.get_tcga_abbr(disease_names[0])
+
     def respond_find_mutation_significance(self, content):
         """Response content to find-mutation-significance request"""
         gene_arg = content.gets('GENE')
@@ -256,12 +348,7 @@ class CausalityModule(Bioagent):
         if not disease_arg:
             return self.make_failure('MISSING_MECHANISM')
 
-        disease_names = _get_term_names(disease_arg)
-        if not disease_names:
-            return self.make_failure('INVALID_DISEASE')
-
-        disease_name = disease_names[0].replace("-", " ").lower()
-        disease_abbr = self.CA.get_tcga_abbr(disease_name)
+        disease_abbr = self.resolve_disease(disease_arg)
         if disease_abbr is None:
             return self.make_failure('INVALID_DISEASE')
 
@@ -275,6 +362,46 @@ class CausalityModule(Bioagent):
 
         return reply
 
+    def respond_find_mutation_significance_many(self, content):
+        """Response content to find-mutation-significance-many request, for every gene in every disease"""
+        genes_arg = content.gets('GENES')
+        if not genes_arg:
+            return self.make_failure('MISSING_MECHANISM')
+
+        gene_names = _get_term_names(genes_arg)
+        if not gene_names:
+            return self.make_failure('MISSING_MECHANISM')
+
+        # all the diseases if missing
+        disease_abbrs = None
+        diseases_arg = content.gets('DISEASES')
+        if diseases_arg:
+            disease_names = _get_term_names(diseases_arg)
+            if not disease_names:
+                return self.make_failure('INVALID_DISEASE')
+            disease_abbrs = [self.CA.get_tcga_abbr(disease_name) for disease_name in disease_names]
+            if None in disease_abbrs:
+                return self.make_failure('INVALID_DISEASE')
+
+        result = self.CA.find_mutation_significance_many([str(gene_name) for gene_name in gene_names], disease_abbrs)
+
+        if not result:
+            return self.make_failure('MISSING_MECHANISM')
+
+        reply = KQMLList('SUCCESS')
+
+        mutsig = KQMLList()
+        for gene, significances in result.items():
+            for disease, significance in significances.items():
+                pair = KQMLList()
+                pair.set('gene', gene)
+                pair.set('disease', disease)
+                pair.sets('mutsig', significance)
+                mutsig.append(pair)
+        reply.set('mutsig', mutsig)
+
+        return reply
+
     def respond_find_mutex(self, content):
         """Response content to find-mutex request"""
 
@@ -294,16 +421,19 @@ class CausalityModule(Bioagent):
             return self.make_failure('MISSING_MECHANISM')
 
 
-        disease_names = _get_term_names(disease_arg)
-        if not disease_names:
-            return self.make_failure('INVALID_DISEASE')
-
-        disease_name = disease_names[0].replace("-", " ").lower()
-        disease_abbr = self.CA.get_tcga_abbr(disease_name)
+        disease_abbr = self.resolve_disease(disease_arg)
         if disease_abbr is None:
             return self.make_failure('INVALID_DISEASE')
 
-        result = self.CA.find_mutex(gene_name, disease_abbr)
+        # optional result variant, 'all' selects every variant
+        alteration_set = content.gets('ALTERATION-SET') or 'whole'
+        network = content.gets('NETWORK') or 'no-network'
+        if alteration_set.lower() == 'all':
+            alteration_set = None
+        if network.lower() == 'all':
+            network = None
+
+        result = self.CA.find_mutex(gene_name, disease_abbr, alteration_set, network)
 
         if not result:
             return self.make_failure('NO_MUTEX_GENES_FOUND')
@@ -322,6 +452,10 @@ class CausalityModule(Bioagent):
                 genes.append(gene)
 
             groups.set('group', genes)
+            # with 'all' the groups come from several variants, which are told apart
+            if alteration_set is None or network is None:
+                groups.set('alteration-set', r['alteration_set'])
+                groups.set('network', r['network'])
             mutex.append(groups)
             # mutex.append(groups)
 
@@ -408,12 +542,7 @@ class CausalityModule(Bioagent):
         if not disease_arg:
             return self.make_failure('MISSING_MECHANISM')
 
-        disease_names = _get_term_names(disease_arg)
-        if not disease_names:
-            return self.make_failure('INVALID_DISEASE')
-
-        disease_name = disease_names[0].replace("-", " ").lower()
-        disease_abbr = self.CA.get_tcga_abbr(disease_name)
+        disease_abbr = self.resolve_disease(disease_arg)
         if disease_abbr is None:
             return self.make_failure('INVALID_DISEASE')
 
@@ -472,15 +601,21 @@ def _get_term_names(term_str):
     return agent_names
 
 
+def log_request_failure(future):
+    if future.exception() is not None:
+        logger.error('Request failed: %r' % future.exception())
+
+
 def make_indra_json(causality):
     """Convert causality response to indra format
         Causality format is (id1, res1, pos1, id2,res2, pos2, rel)"""
 
-    causality['rel'] = causality['rel'].upper()
+    rel = causality['rel'].upper()
 
     indra_relation_map = {
         "PHOSPHORYLATES": "Phosphorylation",
         "IS-PHOSPHORYLATED-BY": "Phosphorylation",
+        "DEPHOSPHORYLATES": "Dephosphorylation",
         "IS-DEPHOSPHORYLATED-BY": "Dephosphorylation",
         "UPREGULATES-EXPRESSION": "IncreaseAmount",
         "EXPRESSION-IS-UPREGULATED-BY": "IncreaseAmount",
@@ -488,10 +623,10 @@ def make_indra_json(causality):
         "EXPRESSION-IS-DOWNREGULATED-BY": "DecreaseAmount"
     }
 
-    rel_type = indra_relation_map[causality['rel']]
+    rel_type = indra_relation_map[rel]
 
-    s, t = ('2', '1') if 'IS' in causality['rel'] else ('1', '2')
-    subj, obj = ('enz', 'sub') if 'PHOSPHO' in causality['rel'] else \
+    s, t = ('2', '1') if 'IS' in rel else ('1', '2')
+    subj, obj = ('enz', 'sub') if 'PHOSPHO' in rel else \
                 ('subj', 'obj')
 
     # if "PHOSPHO" in causality['rel']:  # phosphorylation
@@ -508,4 +643,36 @@ def make_indra_json(causality):
 
 
 if __name__ == "__main__":
-    CausalityModule(argv=sys.argv[1:])
+    argv = sys.argv[1:]
+    snapshot = '--snapshot' in argv
+    if snapshot:
+        argv.remove('--snapshot')
+    in_memory = '--in-memory' in argv
+    if in_memory:
+        argv.remove('--in-memory')
+    load_to_memory = '--load-to-memory' in argv
+    if load_to_memory:
+        argv.remove('--load-to-memory')
+    threads = 1
+    if '--threads' in argv:
+        ind = argv.index('--threads')
+        threads = int(argv[ind + 1])
+        del argv[ind:ind + 2]
+    gene_summary_url = default_gene_summary_url
+    if '--gene-summary-url' in argv:
+        ind = argv.index('--gene-summary-url')
+        gene_summary_url = argv[ind + 1]
+        del argv[ind:ind + 2]
+    gene_summary_cache = None
+    if '--gene-summary-cache' in argv:
+        ind = argv.index('--gene-summary-cache')
+        gene_summary_cache = argv[ind + 1]
+        del argv[ind:ind + 2]
+    sif_relations = None
+    if '--sif-relations' in argv:
+        ind = argv.index('--sif-relations')
+        sif_relations = argv[ind + 1].split(',')
+        del argv[ind:ind + 2]
+    CausalityModule(argv=argv, snapshot=snapshot, in_memory=in_memory, threads=threads,
+                    load_to_memory=load_to_memory, gene_summary_url=gene_summary_url,
+                    gene_summary_cache=gene_summary_cache, sif_relations=sif_relations)
@@ -0,0 +1,123 @@
+import os
+import time
+import logging
+import sqlite3
+import weakref
+import resource
+import threading
+from .database_initializer import connect_read_only
+
+
+logger = logging.getLogger('CausalA')
+
+
+def resident_size():
+    """
+    :return: Resident set size of the process in bytes, its peak where the current one isn't available
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ThreadConnection:
+    """ Keeps the connection of one thread in its thread-local storage, which drops it when the thread ends"""
+    __slots__ = ('cadb', '__weakref__')
+
+    def __init__(self, cadb):
+        self.cadb = cadb
+
+
+def close_connection(lock, connections, cadb):
+    """
+    Closes the connection of a thread that ended, unless the pool already closed it
+    :param lock: Lock of the pool
+    :param connections: Open connections of the pool
+    :param cadb:
+    :return:
+    """
+    with lock:
+        if cadb not in connections:
+            return
+        connections.remove(cadb)
+    cadb.close()
+
+
+class ConnectionPool:
+    """ Gives each thread its own read-only connection to a database, so queries can run concurrently"""
+
+    def __init__(self, db_file, immutable=False, memory=False):
+        """
+        :param db_file:
+        :param immutable: If True, the database never changes while it is open, as for the snapshot.
+        Otherwise another process may still update it.
+        :param memory: Copy the database into memory and answer from the copy. Otherwise the
+        connections read the file through a memory map.
+        """
+        self.db_file = db_file
+        self.immutable = immutable
+        self.local = threading.local()
+        # connections of the threads still running, to close them all
+        self.connections = set()
+        self.lock = threading.Lock()
+
+        self.memory_uri = None
+        if memory:
+            self.load_into_memory()
+
+    def load_into_memory(self):
+        """
+        Copies the database, with its indexes, into a shared in-memory database with the backup API.
+        The connection doing the copy stays open, as the copy lives as long as a connection to it.
+        :return:
+        """
+        start = time.time()
+        rss = resident_size()
+
+        self.memory_uri = 'file:causality-memory-%d?mode=memory&cache=shared' % id(self)
+        self.memory_holder = sqlite3.connect(self.memory_uri, uri=True, check_same_thread=False)
+        source = connect_read_only(self.db_file, self.immutable)
+        source.backup(self.memory_holder)
+        source.close()
+
+        page_count = self.memory_holder.execute("PRAGMA page_count").fetchone()[0]
+        page_size = self.memory_holder.execute("PRAGMA page_size").fetchone()[0]
+
+        # load time, size of the in-memory database and growth of the resident set
+        self.load_seconds = time.time() - start
+        self.memory_bytes = page_count * page_size
+        self.resident_bytes = resident_size() - rss
+        logger.info('Loaded %s into memory in %.2f s: %.1f MB database, resident size grew by %.1f MB' %
+                    (os.path.basename(self.db_file), self.load_seconds, self.memory_bytes / 2 ** 20,
+                     self.resident_bytes / 2 ** 20))
+
+    def connection(self):
+        """
+        :return: Connection of the calling thread, opened at its first call and closed when the thread ends
+        """
+        holder = getattr(self.local, 'holder', None)
+        if holder is None:
+            if self.memory_uri is None:
+                cadb = connect_read_only(self.db_file, self.immutable, check_same_thread=False)
+            else:
+                cadb = sqlite3.connect(self.memory_uri, uri=True, check_same_thread=False)
+                cadb.execute("PRAGMA query_only = 1")
+            holder = ThreadConnection(cadb)
+            with self.lock:
+                self.connections.add(cadb)
+            weakref.finalize(holder, close_connection, self.lock, self.connections, cadb)
+            self.local.holder = holder
+        return holder.cadb
+
+    def close(self):
+        with self.lock:
+            for cadb in self.connections:
+                cadb.close()
+            self.connections.clear()
+            if self.memory_uri is not None:
+                self.memory_holder.close()
+                self.memory_uri = None
+        # dropping the thread-local storage runs the finalizers of the connections, which take the lock
+        self.local = threading.local()
@@ -1,9 +1,23 @@
 import os
+import sys
+import csv
+import argparse
+import time
+import uuid
+import hashlib
+import logging
+import shutil
 import sqlite3
+import tempfile
+from urllib.request import pathname2url
+from itertools import islice
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 from bioagents import BioagentException
-import csv
 
 
+logger = logging.getLogger('CausalA')
+
 tcga_study_names = ['ACC', 'BLCA', 'BRCA', 'CESC','CHOL', 'COAD', 'COADREAD', 'DLBC', 'GBM', 'GBMLGG', 'HNSC',
                     'KICH', 'KIPAN','KIRC', 'KIRP', 'LAML', 'LGG', 'LIHC', 'LUAD', 'LUSC', 'OV', 'PAAD', 'PCPG',
                     'PRAD', 'READ', 'SARC', 'SKCM', 'STAD', 'STES', 'TGCT', 'THCA', 'UCEC', 'UCS', 'UVM']
@@ -12,12 +26,131 @@ loc_list = ['GO_ENDOPLASMIC_RETICULUM', 'GO_EXTRACELLULAR_MATRIX', 'GO_MITOCHOND
             'GO_NUCLEAR_OUTER_MEMBRANE', 'GO_CYTOPLASMIC_REGION', 'GO_ENDOLYSOSOME', 'GO_CYTOSKELETON',
             'GO_LATERAL_PLASMA_MEMBRANE', 'GO_CELL_CORTEX', 'GO_CELL_BODY', 'GO_ENDOSOME']
 
+opposite_rel = {
+    'phosphorylates': 'is-phosphorylated-by',
+    'dephosphorylates': 'is-dephosphorylated-by',
+    'upregulates-expression': 'expression-is-upregulated-by',
+    'downregulates-expression': 'expression-is-downregulated-by',
+    'activates': 'is-activated-by',
+    'inhibits': 'is-inhibited-by',
+}
+
+# Column definitions of the tables. Columns after the ones a reader generates take their default.
+table_columns = {
+    'Correlations': ('Id1 TEXT', 'PSite1 TEXT', 'Id2 TEXT', 'PSite2 TEXT', 'Corr REAL', 'PVal REAL',
+                     'Explained INTEGER DEFAULT 0'),
+    'Explained_Correlations': ('Id1 TEXT', 'PSite1 TEXT', 'Id2 TEXT', 'PSite2 TEXT', 'Corr REAL', 'PVal REAL',
+                               'Rel TEXT', 'UriStr TEXT'),
+    'Unexplained_Correlations': ('Id1 TEXT', 'PSite1 TEXT', 'Id2 TEXT', 'PSite2 TEXT', 'Corr REAL', 'PVal REAL'),
+    'RankedCorrelations': ('Gene TEXT', 'Explained INTEGER', 'Rank INTEGER', 'Id1 TEXT', 'PSite1 TEXT', 'Id2 TEXT',
+                           'PSite2 TEXT', 'Corr REAL', 'PVal REAL', 'PRIMARY KEY (Gene, Explained, Rank)'),
+    'CausalityPNNLOvarian': ('Id1 TEXT', 'PSite1 TEXT', 'Id2 TEXT', 'PSite2 TEXT', 'Rel TEXT', 'UriStr TEXT'),
+    'Causality': ('Id1 TEXT', 'PSite1 TEXT', 'Id2 TEXT', 'PSite2 TEXT', 'Rel TEXT', 'UriStr TEXT'),
+    'MutSig': ('Id TEXT', 'Disease TEXT', 'PVal REAL', 'QVal REAL'),
+    'MutexGroups': ('GroupId INTEGER PRIMARY KEY', 'Disease TEXT', 'AlterationSet TEXT', 'Network TEXT',
+                    'Score REAL'),
+    'MutexMembers': ('GroupId INTEGER', 'Gene TEXT', 'Position INTEGER', 'PRIMARY KEY (GroupId, Position)'),
+    'SifGenes': ('GeneId INTEGER PRIMARY KEY', 'Symbol TEXT UNIQUE'),
+    'SifRelationTypes': ('RelId INTEGER PRIMARY KEY', 'Rel TEXT UNIQUE'),
+    'Sif_Relations': ('RelId INTEGER', 'Id2 INTEGER', 'Id1 INTEGER', 'PRIMARY KEY (RelId, Id2, Id1)'),
+    'TCGA': ('LongName TEXT', 'Abbr TEXT'),
+    'CellularComponents': ('Gene TEXT', 'Component TEXT'),
+}
+
+# Suffixes of the CREATE TABLE statements
+table_options = {
+    'Sif_Relations': ' WITHOUT ROWID',
+    'RankedCorrelations': ' WITHOUT ROWID',
+}
+
+# Tables stored as several database tables
+composite_tables = {
+    'Sif_Relations': ('SifGenes', 'SifRelationTypes', 'Sif_Relations'),
+    'Mutex': ('MutexGroups', 'MutexMembers'),
+}
+
+# Indexes serving the lookups in CausalityAgent, as (name, table, columns)
+table_indexes = [
+    ('Causality_Id1_Id2_Rel', 'Causality', 'Id1, Id2, Rel'),
+    ('Correlations_Id1_PSite1_Id2_PSite2', 'Correlations', 'Id1, PSite1, Id2, PSite2'),
+    ('MutSig_Id_Disease', 'MutSig', 'Id, Disease'),
+    ('MutexGroups_Disease_AlterationSet_Network', 'MutexGroups', 'Disease, AlterationSet, Network'),
+    ('MutexMembers_Gene_GroupId', 'MutexMembers', 'Gene, GroupId'),
+    ('CellularComponents_Gene', 'CellularComponents', 'Gene'),
+]
+
+# Alteration sets and networks of the mutex results, as (alteration set, network)
+mutex_variants = [(alteration_set, network)
+                  for alteration_set in ['whole', 'mutations-only', 'outliers-excluded']
+                  for network in ['no-network', 'PC2v7', 'fries290K', 'fries290K-PC2v7', 'fries290K-leidos-PC2v7']]
+
+# Data files of the tables that are filled per TCGA study, relative to the resource folder.
+# A study may miss some of them. The study rows of these tables are kept in their Disease column.
+study_files = {
+    'MutSig': [os.path.join('TCGA', '%s', 'scores-mutsig.txt')],
+    'Mutex': [os.path.join('tcga-mutex-results', '%s', alteration_set, network, 'ranked-groups.txt')
+              for alteration_set, network in mutex_variants],
+}
+
+# Methods computing tables from other tables, with their source tables
+derived_tables = {
+    'classify_correlations': ('Correlations', 'CausalityPNNLOvarian'),
+    'rank_correlations': ('Correlations', 'CausalityPNNLOvarian'),
+}
+
+# Layout version of the database. Databases with another version are rebuilt.
+schema_version = 6
+
+# Name of the read-only snapshot of a database with the current layout
+snapshot_name = 'causality-dataset-v%d.db' % schema_version
+
+# Prefix of the manifest records of the build options, which are kept with the data files
+# so that a changed option reloads the table it applies to
+option_prefix = 'option:'
+
+# Values of the options in builds that didn't record them
+default_options = {option_prefix + 'sif_relations': '*'}
+
+# Number of rows handed to a single executemany call
+batch_size = 10000
+
+# Settings used while the tables are bulk loaded. The previous values are restored afterwards.
+bulk_load_pragmas = [('journal_mode', 'OFF'), ('synchronous', 'OFF'), ('cache_size', -262144)]
+
+
 class DatabaseInitializer:
     """ Fills the pnnl database from the given data files"""
 
-    def __init__(self, path):
+    def __init__(self, path, workers=1, snapshot=False, sif_relations=None, build=True):
+        """
+        :param path: Path to the folder that keeps all the data files
+        :param workers: Number of processes parsing the data files when the database is built
+        :param snapshot: Open the read-only snapshot in path, building it first if it is missing
+        or its data files changed since it was written
+        :param sif_relations: Relation types loaded from PC.sif, all of them if None.
+        It is recorded in the manifest, and Sif_Relations is loaded again when it changes.
+        :param build: If False, only connect to the database without building or updating it
+        """
+        self.sif_relations = sif_relations
         db_file = os.path.join(path, 'causality-dataset.db')
+        snapshot_file = os.path.join(path, snapshot_name)
+
+        # rows, seconds and rows per second of the last load of each table
+        self.load_stats = {}
 
+        # file of the connection, the snapshot when it is used
+        self.db_file = db_file
+
+        if snapshot and os.path.isfile(snapshot_file):
+            snapshot_db = connect_read_only(snapshot_file)
+            if inputs_match_manifest(path, read_manifest(snapshot_db), self.build_options()):
+                self.db_file = snapshot_file
+                self.cadb = snapshot_db
+                return
+            # the data files changed since the snapshot was written, so the database is updated
+            # and the snapshot written again
+            snapshot_db.close()
+            logger.info('Snapshot %s is out of date' % snapshot_file)
 
         if os.path.isfile(db_file):
             self.cadb = sqlite3.connect(db_file)
@@ -26,7 +159,26 @@ class DatabaseInitializer:
             fp = open(db_file, 'w')
             fp.close()
             self.cadb = sqlite3.connect(db_file)
-            self.populate_tables(path)
+
+        if not build:
+            return
+
+        if self.read_manifest() is None or self.get_schema_version() != schema_version:
+            # new database, a database with an old layout, or the last build didn't finish
+            self.populate_tables(path, workers)
+            self.record_manifest(path)
+            self.cadb.execute("PRAGMA user_version = %d" % schema_version)
+            self.bump_generation()
+        else:
+            self.update_tables(path)
+
+        self.build_indexes()
+
+        if snapshot:
+            self.build_snapshot(snapshot_file)
+            self.cadb.close()
+            self.db_file = snapshot_file
+            self.cadb = connect_read_only(snapshot_file)
 
 
     def __del__(self):
@@ -37,256 +189,372 @@ class DatabaseInitializer:
 
 
 
-    def populate_tables(self, path):
+    def populate_tables(self, path, workers=1):
         """
         Fills all the tables in the database
         :param path: Path to the folder that keeps all the data files
+        :param workers: Number of processes parsing the data files. With more than one, see populate_tables_parallel
         :return:
         """
-        self.populate_correlation_table(path)
-        self.populate_causality_pnnl_ovarian_table(path)
-        self.populate_causality_table(path)
-        self.populate_mutsig_table(path)
-        self.populate_unexplained_table()
-        self.populate_explained_table()
-        self.populate_sif_relations_table(path)
-        self.populate_mutex_table(path)
-        self.populate_tcga_names_table(path)
-        self.populate_cellular_components_table(path)
-
-    def populate_causality_table(self, path):
+        if workers > 1:
+            self.populate_tables_parallel(path, workers)
+            return
+
+        with self.bulk_load_settings():
+            self.populate_correlation_table(path)
+            self.populate_causality_pnnl_ovarian_table(path)
+            self.populate_causality_table(path)
+            self.populate_mutsig_table(path)
+            self.classify_correlations()
+            self.rank_correlations()
+            self.populate_sif_relations_table(path)
+            self.populate_mutex_table(path)
+            self.populate_tcga_names_table(path)
+            self.populate_cellular_components_table(path)
+
+    def build_snapshot(self, snapshot_file):
         """
-        Fills the causality table
-        :param path: Path to the folder that keeps causative-data-centric.sif
+        Copies the database into a read-only snapshot file. The copy is written
+        under a temporary name and moved in place, so readers never see a partial file.
+        :param snapshot_file:
         :return:
         """
-        opposite_rel = {
-            'phosphorylates': 'is-phosphorylated-by',
-            'dephosphorylates': 'is-dephosphorylated-by',
-            'upregulates-expression': 'expression-is-upregulated-by',
-            'downregulates-expression': 'expression-is-downregulated-by',
-            'activates': 'is-activated-by',
-            'inhibits': 'is-inhibited-by',
-        }
-
+        start = time.time()
+        tmp_file = '%s.%d.tmp' % (snapshot_file, os.getpid())
+        target = sqlite3.connect(tmp_file)
         try:
-            causality_path = os.path.join(path, 'causal-priors.txt')
-        except Exception as e:
-            raise BioagentException.PathNotFoundException()
+            self.cadb.backup(target)
+            target.execute("PRAGMA journal_mode = DELETE")
+        finally:
+            target.close()
 
-        causality_file = open(causality_path, 'r')
+        os.chmod(tmp_file, 0o444)
+        os.replace(tmp_file, snapshot_file)
+        logger.info('Wrote snapshot %s in %.2f s' % (snapshot_file, time.time() - start))
 
+    def get_schema_version(self):
+        """
+        :return: The layout version the database was built with
+        """
+        return self.cadb.execute("PRAGMA user_version").fetchone()[0]
+
+    def bump_generation(self):
+        """
+        Marks a change of the table contents with a new random generation, so the readers can tell
+        their results are out of date. Unlike a counter, it differs even between two builds from scratch.
+        :return: The new generation
+        """
+        generation = uuid.uuid4().hex
         with self.cadb:
             cur = self.cadb.cursor()
-            cur.execute("DROP TABLE IF EXISTS Causality")
-            cur.execute("CREATE TABLE Causality(Id1 TEXT, PSite1 TEXT, Id2 TEXT, PSite2 TEXT, Rel TEXT, UriStr TEXT)")
-
-            for line in causality_file:
-                vals = line.split('\t')
-                # id_str1 = vals[0].upper().split('-')
-                # id1 = id_str1[0]
-                # if len(id_str1) > 1:
-                #     p_site1 = id_str1[1]
-                # else:
-                #     p_site1 = ' '
-                #
-                # id_str2 = vals[2].upper().split('-')
-                # id2 = id_str2[0]
-                #
-                # if len(id_str2) > 1:
-                #     p_site2 = id_str2[1]
-                # else:
-                #     p_site2 = ' '
-                #
-                # rel = vals[1]
-                #
-
-
-                id1 = vals[0].upper()
-                p_site1 = ' '
-                rel = vals[1]
-                id2 =  vals[2].upper()
-
-                uri_arr = []
-                if vals[3]:
-                    uri_arr = vals[3].split(" ")
-
-                if len(uri_arr) == 0:
-                    uri_arr = [vals[3]]
-
-                uri_str = ""
-                for uri in uri_arr:
-                    uri_str = uri_str + "uri= " + uri + "&"
-
-                if len(vals) > 4:
-                    p_site_str = vals[4].upper().split(';')
-
-                    for p_site2 in p_site_str:
-                        opp_rel = opposite_rel[rel]
-                        cur.execute("INSERT INTO Causality VALUES(?, ?, ?, ?, ?, ?)", (id1, p_site1, id2, p_site2, rel, uri_str))
-                        # opposite relation
-                        cur.execute("INSERT INTO Causality VALUES(?, ?, ?, ?, ?, ?)", (id2, p_site2, id1, p_site1, opp_rel, uri_str))
-                else:
-                    p_site2 = ' '
-                    opp_rel = opposite_rel[rel]
-                    cur.execute("INSERT INTO Causality VALUES(?, ?, ?, ?, ?, ?)",
-                                (id1, p_site1, id2, p_site2, rel, uri_str))
-                    # opposite relation
-                    cur.execute("INSERT INTO Causality VALUES(?, ?, ?, ?, ?, ?)",
-                                (id2, p_site2, id1, p_site1, opp_rel, uri_str))
+            cur.execute("DROP TABLE IF EXISTS Generation")
+            cur.execute("CREATE TABLE Generation(Id INTEGER PRIMARY KEY, Generation TEXT)")
+            cur.execute("INSERT INTO Generation VALUES(0, ?)", (generation,))
+        return generation
 
-        causality_file.close()
+    def read_manifest(self):
+        """
+        Reads the data file records of the last build
+        :return: {path: (table, study, size, mtime, hash)}, None if there is no manifest
+        """
+        with self.cadb:
+            return read_manifest(self.cadb)
 
-    def populate_causality_pnnl_ovarian_table(self, path):
+    def record_manifest(self, path):
         """
-        Fills the causality table for pnnl ovarian cancer data
-        :param path: Path to the folder that keeps causative-data-centric.sif
+        Records the size, modification time and content hash of all the data files
+        :param path: Path to the folder that keeps all the data files
         :return:
         """
-        opposite_rel = {
-            'phosphorylates': 'is-phosphorylated-by',
-            'dephosphorylates': 'is-dephosphorylated-by',
-            'upregulates-expression': 'expression-is-upregulated-by',
-            'downregulates-expression': 'expression-is-downregulated-by',
-            'activates': 'is-activated-by',
-            'inhibits': 'is-inhibited-by',
-        }
+        entries = []
+        for rel_path, table, study in resource_inputs(path):
+            file_path = os.path.join(path, rel_path)
+            size, mtime = file_signature(file_path)
+            entries.append((rel_path, table, study, size, mtime, hash_file(file_path)))
+        entries.extend((name, table, None, None, None, value) for name, (table, value) in self.build_options().items())
 
-        try:
-            causality_path = os.path.join(path, 'causative-data-centric.sif')
-        except Exception as e:
-            raise BioagentException.PathNotFoundException()
+        with self.cadb:
+            cur = self.cadb.cursor()
+            cur.execute("DROP TABLE IF EXISTS Manifest")
+            cur.execute("CREATE TABLE Manifest(Path TEXT PRIMARY KEY, TableName TEXT, Study TEXT, "
+                        "Size INTEGER, MTime REAL, Hash TEXT)")
+            cur.executemany("INSERT INTO Manifest VALUES(?, ?, ?, ?, ?, ?)", entries)
 
-        causality_file = open(causality_path, 'r')
+    def update_tables(self, path):
+        """
+        Repopulates only the tables, or the TCGA studies of a table, whose data files changed
+        since the manifest was recorded, together with the tables derived from them.
+        Files are hashed only when their size or modification time differ from the manifest.
+        :param path: Path to the folder that keeps all the data files
+        :return:
+        """
+        start = time.time()
+        manifest = self.read_manifest()
+        changed = []
+        stale_tables = set()
+        stale_studies = {}
+
+        for rel_path, table, study in resource_inputs(path):
+            file_path = os.path.join(path, rel_path)
+            if not os.path.isfile(file_path):
+                continue
+            size, mtime = file_signature(file_path)
+            entry = manifest.pop(rel_path, None)
+            if entry is not None and entry[2:4] == (size, mtime):
+                continue
+
+            file_hash = hash_file(file_path)
+            changed.append((rel_path, table, study, size, mtime, file_hash))
+            if entry is not None and entry[4] == file_hash:
+                continue  # touched but not modified
+
+            if study is None:
+                stale_tables.add(table)
+            else:
+                stale_studies.setdefault(table, set()).add(study)
+
+        # an option missing from the manifest of an older build had its default value
+        for name, (table, value) in self.build_options().items():
+            entry = manifest.pop(name, None)
+            recorded = entry[4] if entry is not None else default_options[name]
+            if entry is None or recorded != value:
+                changed.append((name, table, None, None, None, value))
+            if recorded != value:
+                logger.info('Build option %s changed from %s to %s' % (name[len(option_prefix):], recorded, value))
+                stale_tables.add(table)
+
+        # the entries left belong to data files that were removed
+        for rel_path, (table, study, _, _, _) in manifest.items():
+            if study is None:
+                logger.warning('Data file %s was removed, keeping the %s table' % (rel_path, table))
+            else:
+                stale_studies.setdefault(table, set()).add(study)
+
+        if not stale_tables and not stale_studies:
+            if changed or manifest:
+                self.update_manifest(changed, list(manifest))
+            return
+
+        for table in stale_tables:
+            self.load_table(table, table_readers[table](*self.reader_args(path, table)))
+
+        for table, studies in stale_studies.items():
+            self.reload_studies(path, table, sorted(studies))
+
+        for method, sources in derived_tables.items():
+            if stale_tables.intersection(sources):
+                getattr(self, method)()
+
+        self.update_manifest(changed, list(manifest))
+        self.bump_generation()
+        logger.info('Updated tables %s in %.2f s' %
+                    (', '.join(sorted(stale_tables.union(stale_studies))), time.time() - start))
+
+    def build_options(self):
+        """
+        :return: {manifest path: (table, value)} of the build options
+        """
+        return {option_prefix + 'sif_relations': ('Sif_Relations', option_value(self.sif_relations))}
 
+    def update_manifest(self, entries, removed):
+        """
+        Replaces the manifest records of changed data files and deletes those of removed ones
+        :param entries: List of (path, table, study, size, mtime, hash)
+        :param removed: Paths of the removed data files
+        :return:
+        """
         with self.cadb:
             cur = self.cadb.cursor()
-            cur.execute("DROP TABLE IF EXISTS CausalityPNNLOvarian")
-            cur.execute("CREATE TABLE CausalityPNNLOvarian(Id1 TEXT, PSite1 TEXT, Id2 TEXT, PSite2 TEXT, Rel TEXT, UriStr TEXT)")
+            cur.executemany("INSERT OR REPLACE INTO Manifest VALUES(?, ?, ?, ?, ?, ?)", entries)
+            cur.executemany("DELETE FROM Manifest WHERE Path = ?", [(rel_path,) for rel_path in removed])
 
-            for line in causality_file:
-                vals = line.split('\t')
-                id_str1 = vals[0].upper().split('-')
-                id1 = id_str1[0]
-                if len(id_str1) > 1:
-                    p_site1 = id_str1[1]
-                else:
-                    p_site1 = ' '
-
-                id_str2 = vals[2].upper().split('-')
-                id2 = id_str2[0]
+    def reload_studies(self, path, table, studies):
+        """
+        Replaces the rows of the given TCGA studies in a table filled per study
+        :param path: Path to the folder that keeps all the data files
+        :param table: Name of a table in study_files
+        :param studies: Study abbreviations
+        :return:
+        """
+        start = time.time()
+        present = [study for study in studies if list_study_files(path, table, study)]
 
-                if len(id_str2) > 1:
-                    p_site2 = id_str2[1]
-                else:
-                    p_site2 = ' '
+        with self.cadb:
+            cur = self.cadb.cursor()
+            delete_studies(cur, table, studies)
+            row_cnt = table_inserters.get(table, insert_rows)(cur, table, table_readers[table](path, present))
 
-                rel = vals[1]
+        self.report_load('%s (%s)' % (table, ', '.join(studies)), row_cnt, time.time() - start)
 
-                uri_arr = []
-                if vals[3]:
-                    uri_arr = vals[3].split(" ")
+    def populate_tables_parallel(self, path, workers):
+        """
+        Fills all the tables in the database by parsing the data files in a process pool.
+        Each job writes its rows into its own staging database, which is then attached and
+        copied into the main database. The correlation tables that join the others are
+        computed at the end. The staging copies cost extra time, so it is only faster than
+        the sequential build with a core for each worker.
+        :param path: Path to the folder that keeps all the data files
+        :param workers: Number of processes
+        :return:
+        """
+        start = time.time()
+        staging_dir = tempfile.mkdtemp(prefix='causality-staging-', dir=path)
+        jobs = make_staging_jobs(path, workers, self.reader_args(path, 'Sif_Relations'))
 
-                if len(uri_arr) == 0:
-                    uri_arr = [vals[3]]
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(stage_table, table, args, os.path.join(staging_dir, '%d.db' % i))
+                           for i, (table, args) in enumerate(jobs)]
+                # merge in job order so that the row order doesn't depend on scheduling
+                staged = [future.result() for future in futures]
+
+            with self.bulk_load_settings():
+                self.merge_staged_tables(staged)
+                self.classify_correlations()
+                self.rank_correlations()
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+        logger.info('Populated tables with %d workers in %.2f s' % (workers, time.time() - start))
+
+    def merge_staged_tables(self, staged):
+        """
+        Copies staged tables into the main database
+        :param staged: List of (table, staging file, row count, seconds) as returned by stage_table
+        :return:
+        """
+        stats = {}
+        with self.cadb:
+            cur = self.cadb.cursor()
+            for table in set(table for table, _, _, _ in staged):
+                create_table(cur, table)
 
-                uri_str = ""
-                for uri in uri_arr:
-                    uri_str = uri_str + "uri= " + uri + "&"
+        for table, staging_file, row_cnt, seconds in staged:
+            # ATTACH can't run inside a transaction
+            self.cadb.execute("ATTACH DATABASE ? AS stage", (staging_file,))
+            try:
+                with self.cadb:
+                    copy_staged_table(self.cadb.cursor(), table)
+            finally:
+                self.cadb.execute("DETACH DATABASE stage")
 
-                opp_rel = opposite_rel[rel]
-                cur.execute("INSERT INTO CausalityPNNLOvarian VALUES(?, ?, ?, ?, ?, ?)",
-                            (id1, p_site1, id2, p_site2, rel, uri_str))
-                # opposite relation
-                cur.execute("INSERT INTO CausalityPNNLOvarian VALUES(?, ?, ?, ?, ?, ?)",
-                            (id2, p_site2, id1, p_site1, opp_rel, uri_str))
+            table_rows, table_seconds = stats.get(table, (0, 0))
+            stats[table] = (table_rows + row_cnt, table_seconds + seconds)
 
-        causality_file.close()
+        for table, (row_cnt, seconds) in stats.items():
+            self.report_load(table, row_cnt, seconds)
 
-    def populate_correlation_table(self, path):
+    def build_indexes(self):
         """
-        Fills the correlation table
-        :param::path: Path to the folder that keeps PNNL-ovarian-correlations.txt
+        Creates the missing indexes in table_indexes, drops the ones no longer in it
+        and updates the query planner statistics
         :return:
         """
-
-        try:
-            pnnl_path = os.path.join(path, 'PNNL-ovarian-correlations.txt')
-        except Exception as e:
-            raise BioagentException.PathNotFoundException()
-        pnnl_file = open(pnnl_path, 'r')
-
         with self.cadb:
             cur = self.cadb.cursor()
-            cur.execute("DROP TABLE IF EXISTS Correlations")
-            cur.execute("CREATE TABLE Correlations(Id1 TEXT, PSite1 TEXT, Id2 TEXT, PSite2 TEXT, Corr REAL, PVal REAL)")
+            # indexes of primary keys and unique columns have no sql
+            existing = set(row[0] for row in cur.execute("SELECT name FROM sqlite_master "
+                                                         "WHERE type = 'index' AND sql IS NOT NULL"))
+            missing = [index for index in table_indexes if index[0] not in existing]
+            dropped = existing.difference(name for name, _, _ in table_indexes)
+            if not missing and not dropped:
+                return
+
+            start = time.time()
+            for name in dropped:
+                cur.execute("DROP INDEX %s" % name)
+            for name, table, columns in missing:
+                cur.execute("CREATE INDEX IF NOT EXISTS %s ON %s(%s)" % (name, table, columns))
+            cur.execute("ANALYZE")
+
+        logger.info('Built %d indexes and dropped %d in %.2f s' % (len(missing), len(dropped), time.time() - start))
+
+    @contextmanager
+    def bulk_load_settings(self):
+        """
+        Turns off journaling and syncing and enlarges the page cache during a build
+        :return:
+        """
+        cur = self.cadb.cursor()
+        saved = []
+        for name, value in bulk_load_pragmas:
+            saved.append((name, cur.execute("PRAGMA %s" % name).fetchone()[0]))
+            cur.execute("PRAGMA %s = %s" % (name, value))
+        try:
+            yield
+        finally:
+            for name, value in saved:
+                cur.execute("PRAGMA %s = %s" % (name, value))
 
-            for line in pnnl_file:
-                if line.find('/') > -1:  # incorrectly formatted strings
-                    continue
-                vals = line.split('\t')
-                id_str1 = vals[0].upper().split('-')
-                id1 = id_str1[0]
-                if len(id_str1) > 1:
-                    p_site1 = id_str1[1]
-                else:
-                    p_site1 = ' '
+    def reader_args(self, path, table):
+        """
+        :param path: Path to the folder that keeps all the data files
+        :param table: Name of a table in table_readers
+        :return: Arguments of the reader of a table read from a single file
+        """
+        if table == 'Sif_Relations':
+            return path, self.sif_relations
+        return path,
+
+    def load_table(self, table, rows):
+        """
+        Recreates the table and fills it with rows in chunks of batch_size
+        :param table: Name of a table in table_readers
+        :param rows: Iterable of rows as generated by its reader
+        :return: Number of inserted rows
+        """
+        start = time.time()
 
-                id_str2 = vals[1].upper().split('-')
-                id2 = id_str2[0]
+        with self.cadb:
+            cur = self.cadb.cursor()
+            create_table(cur, table)
+            row_cnt = table_inserters.get(table, insert_rows)(cur, table, rows)
 
-                if len(id_str2) > 1:
-                    p_site2 = id_str2[1]
-                else:
-                    p_site2 = ' '
+        self.report_load(table, row_cnt, time.time() - start)
+        return row_cnt
 
-                corr = float(vals[2].rstrip('\n'))
+    def report_load(self, table, row_cnt, seconds):
+        """
+        Records and logs the load rate of a table
+        :param table:
+        :param row_cnt:
+        :param seconds:
+        :return:
+        """
+        rate = row_cnt / seconds if seconds > 0 else float(row_cnt)
+        self.load_stats[table] = {'rows': row_cnt, 'seconds': seconds, 'rows_per_sec': rate}
+        logger.info('Loaded %d rows into %s in %.2f s (%.0f rows/s)' % (row_cnt, table, seconds, rate))
 
-                p_val = float(vals[3].rstrip('\n'))
+    def populate_causality_table(self, path):
+        """
+        Fills the causality table
+        :param path: Path to the folder that keeps causal-priors.txt
+        :return:
+        """
+        self.load_table('Causality', read_causal_priors(path))
 
-                cur.execute("INSERT INTO Correlations VALUES(?, ?, ?, ?, ?, ?)", (id1, p_site1, id2, p_site2, corr, p_val))
+    def populate_causality_pnnl_ovarian_table(self, path):
+        """
+        Fills the causality table for pnnl ovarian cancer data
+        :param path: Path to the folder that keeps causative-data-centric.sif
+        :return:
+        """
+        self.load_table('CausalityPNNLOvarian', read_causative_sif(path))
 
-        pnnl_file.close()
+    def populate_correlation_table(self, path):
+        """
+        Fills the correlation table
+        :param::path: Path to the folder that keeps PNNL-ovarian-correlations.txt
+        :return:
+        """
+        self.load_table('Correlations', read_correlations(path))
 
     def populate_mutsig_table(self, path):
         """
         :param path: Path to the folder that keeps TCGA folder and mutsig.txt files
         :return:
         """
-
-        try:
-            mutsig_path = os.path.join(path, 'TCGA')
-        except Exception as e:
-            raise BioagentException.PathNotFoundException()
-
-        folders = os.listdir(mutsig_path)
-
-        with self.cadb:
-            cur = self.cadb.cursor()
-            cur.execute("DROP TABLE IF EXISTS MutSig")
-            cur.execute("CREATE TABLE MutSig(Id TEXT, Disease TEXT, PVal REAL, QVal Real)")
-
-            for folder in folders:
-                try:
-                    if folder in tcga_study_names:
-                        disease_path = os.path.join(mutsig_path, folder)
-                        file_path = os.path.join(disease_path, 'scores-mutsig.txt')
-                    else:
-                        continue
-                except Exception as e:
-                    raise BioagentException.PathNotFoundException()
-
-                mutsig_file = open(file_path, 'r')
-                next(mutsig_file) # skip the header line
-
-                for line in mutsig_file:
-                    vals = line.split('\t')
-                    gene_id = vals[1]
-                    p_val = vals[17]
-                    q_val = vals[18].rstrip('\n')
-                    cur.execute("INSERT INTO MutSig VALUES(?, ?, ?, ?)", (gene_id, folder,  p_val, q_val))
-
-                mutsig_file.close()
+        self.load_table('MutSig', read_mutsig(path))
 
     def populate_mutex_table(self, path):
         """
@@ -294,79 +562,90 @@ class DatabaseInitializer:
         :param path: Path to the folder that keeps ranked-groups.txt
         :return:
         """
+        self.load_table('Mutex', read_mutex(path))
 
-        try:
-            mutex_path = os.path.join(path, 'tcga-mutex-results')
-        except Exception as e:
-            raise BioagentException.PathNotFoundException()
-
-
-        folders = os.listdir(mutex_path)
-        with self.cadb:
-            cur = self.cadb.cursor()
-            cur.execute("DROP TABLE IF EXISTS Mutex")
-            cur.execute("CREATE TABLE Mutex(Disease TEXT, Id1 TEXT, Id2 TEXT, Id3 TEXT, Id4, Id5, Score REAL)")
-            for folder in folders:
-                try:
-                    if folder in tcga_study_names:
-                        disease_path = os.path.join(mutex_path, folder)
-                        file_path = os.path.join(disease_path, 'whole/no-network/ranked-groups.txt')
-                    else:
-                        continue
-                except Exception as e:
-                    raise BioagentException.PathNotFoundException()
-
-                mutex_file = open(file_path, 'r')
-                next(mutex_file)  # skip the header line
-                for line in mutex_file:
-                    vals = line.split('\t')
-                    vals[len(vals) - 1] = vals[len(vals) - 1].rstrip('\n')
-                    score = float(vals[0])
-                    if score > 0.05:
-                        continue
-
-                    genes = []
-                    for i in range(2, len(vals)):
-                        genes.append(vals[i])
-                        # print(genes[i-2])
-
-                    # fill the rest with none
-                    for i in range(len(vals), 7):
-                        genes.append(None)
-
-
-                    cur.execute("INSERT INTO Mutex VALUES(?, ?, ?, ?, ?,?, ?)",
-                                (folder, genes[0], genes[1], genes[2], genes[3], genes[4], score))
-
-        mutex_file.close()
-    def populate_explained_table(self):
+    def classify_correlations(self):
         """
-        Find the correlations with a causal explanation
+        Splits the correlations into Explained_Correlations, one row for each causal explanation
+        in CausalityPNNLOvarian, and Unexplained_Correlations in a single pass over Correlations.
+        The explanations are looked up in a hash table keyed by the ids and sites of both ends.
+        The Explained column of Correlations is set for the explained ones.
         :return:
         """
+        start = time.time()
+        explained_cnt = 0
+        unexplained_cnt = 0
+        explained_ids = []
+
         with self.cadb:
             cur = self.cadb.cursor()
-            cur.execute("DROP TABLE IF EXISTS Explained_Correlations")
-            cur.execute("CREATE TABLE Explained_Correlations AS SELECT * FROM Correlations "
-                        "LEFT JOIN CausalityPNNLOvarian ON CausalityPNNLOvarian.Id1 = Correlations.Id1 AND CausalityPNNLOvarian.Id2 = Correlations.Id2  "
-                        "AND CausalityPNNLOvarian.PSite1 = Correlations.PSite1 AND CausalityPNNLOvarian.PSite2 = Correlations.PSite2 "
-                        "WHERE Rel IS NOT NULL",
-                        ).fetchall()
-
-    def populate_unexplained_table(self):
+            explanations = {}
+            for row in cur.execute("SELECT Id1, PSite1, Id2, PSite2, Rel, UriStr FROM CausalityPNNLOvarian "
+                                   "ORDER BY rowid"):
+                explanations.setdefault(row[:4], []).append(row[4:])
+
+            create_table(cur, 'Explained_Correlations')
+            create_table(cur, 'Unexplained_Correlations')
+
+            write_cur = self.cadb.cursor()
+            explained_rows = []
+            unexplained_rows = []
+            for row in cur.execute("SELECT rowid, Id1, PSite1, Id2, PSite2, Corr, PVal FROM Correlations"):
+                matches = explanations.get(row[1:5])
+                if matches:
+                    explained_ids.append((row[0],))
+                    explained_rows.extend(row[1:] + match for match in matches)
+                else:
+                    unexplained_rows.append(row[1:])
+
+                if len(explained_rows) >= batch_size:
+                    write_cur.executemany("INSERT INTO Explained_Correlations VALUES(?, ?, ?, ?, ?, ?, ?, ?)",
+                                          explained_rows)
+                    explained_cnt += len(explained_rows)
+                    explained_rows = []
+                if len(unexplained_rows) >= batch_size:
+                    write_cur.executemany("INSERT INTO Unexplained_Correlations VALUES(?, ?, ?, ?, ?, ?)",
+                                          unexplained_rows)
+                    unexplained_cnt += len(unexplained_rows)
+                    unexplained_rows = []
+
+            write_cur.executemany("INSERT INTO Explained_Correlations VALUES(?, ?, ?, ?, ?, ?, ?, ?)", explained_rows)
+            write_cur.executemany("INSERT INTO Unexplained_Correlations VALUES(?, ?, ?, ?, ?, ?)", unexplained_rows)
+            explained_cnt += len(explained_rows)
+            unexplained_cnt += len(unexplained_rows)
+
+            # flags are set after the scan so that Correlations isn't modified while it is read
+            cur.execute("UPDATE Correlations SET Explained = 0")
+            cur.executemany("UPDATE Correlations SET Explained = 1 WHERE rowid = ?", explained_ids)
+
+        seconds = time.time() - start
+        self.report_load('Explained_Correlations', explained_cnt, seconds)
+        self.report_load('Unexplained_Correlations', unexplained_cnt, seconds)
+
+
+    def rank_correlations(self):
         """
-        Find the correlations without a causal explanation
+        Fills RankedCorrelations with the explained and the unexplained correlations of each gene,
+        at either end, ranked by decreasing absolute correlation. Ties keep the order of the
+        Id1 = ? OR Id2 = ? lookups it replaces: rows with the gene as Id1 first, then in table order.
         :return:
         """
+        start = time.time()
+
         with self.cadb:
             cur = self.cadb.cursor()
-            cur.execute("DROP TABLE IF EXISTS Unexplained_Correlations")
-            cur.execute("CREATE TABLE Unexplained_Correlations AS SELECT * FROM Correlations "
-                        "LEFT JOIN CausalityPNNLOvarian ON CausalityPNNLOvarian.Id1 = Correlations.Id1 AND CausalityPNNLOvarian.Id2 = Correlations.Id2  "
-                        "AND CausalityPNNLOvarian.PSite1 = Correlations.PSite1 AND CausalityPNNLOvarian.PSite2 = Correlations.PSite2 "
-                        "WHERE Rel IS NULL",
-                        ).fetchall()
-
+            create_table(cur, 'RankedCorrelations')
+            for explained, table in [(1, 'Explained_Correlations'), (0, 'Unexplained_Correlations')]:
+                cur.execute("INSERT INTO RankedCorrelations "
+                            "SELECT Gene, ?, ROW_NUMBER() OVER (PARTITION BY Gene ORDER BY ABS(Corr) DESC, Side, Ord) - 1, "
+                            "Id1, PSite1, Id2, PSite2, Corr, PVal FROM "
+                            "(SELECT Id1 AS Gene, 0 AS Side, rowid AS Ord, Id1, PSite1, Id2, PSite2, Corr, PVal FROM %s "
+                            "UNION ALL "
+                            "SELECT Id2, 1, rowid, Id1, PSite1, Id2, PSite2, Corr, PVal FROM %s WHERE Id2 != Id1)"
+                            % (table, table), (explained,))
+            row_cnt = cur.execute("SELECT COUNT(*) FROM RankedCorrelations").fetchone()[0]
+
+        self.report_load('RankedCorrelations', row_cnt, time.time() - start)
 
     def populate_sif_relations_table(self, path):
         """
@@ -374,28 +653,7 @@ class DatabaseInitializer:
         :param path: Path to the folder that keeps PC.sif
         :return:
         """
-
-        try:
-            pc_path = os.path.join(path, 'PC.sif')
-        except Exception as e:
-            raise BioagentException.PathNotFoundException()
-
-        pc_file = open(pc_path, 'r')
-
-        with self.cadb:
-            cur = self.cadb.cursor()
-            cur.execute("DROP TABLE IF EXISTS Sif_Relations")
-            cur.execute("CREATE TABLE Sif_Relations(Id1 TEXT,  Id2 TEXT, Rel TEXT)")
-            for line in pc_file:
-                vals = line.split('\t')
-                id1 = vals[0].upper()
-                id2 = (vals[2].rstrip('\n')).upper()
-                rel = vals[1]
-                cur.execute("INSERT INTO Sif_Relations VALUES(?, ?, ?)", (id1, id2, rel))
-
-        pc_file.close()
-
-
+        self.load_table('Sif_Relations', read_sif_relations(*self.reader_args(path, 'Sif_Relations')))
 
     def populate_tcga_names_table(self, path):
         """
@@ -403,26 +661,7 @@ class DatabaseInitializer:
         :param path: Path to the folder that keeps  tcga_disease_names.tsv
         :return:
         """
-
-        try:
-            tcga_path = os.path.join(path, 'tcga_disease_names.tsv')
-        except Exception as e:
-            raise BioagentException.PathNotFoundException()
-
-        with open(tcga_path, 'rU') as tcga_file:
-            tcga_file = csv.reader(tcga_file, delimiter='\t')
-
-            with self.cadb:
-                cur = self.cadb.cursor()
-                cur.execute("DROP TABLE IF EXISTS TCGA")
-                cur.execute("CREATE TABLE TCGA(LongName TEXT, Abbr TEXT)")
-
-                next(tcga_file)  # skip the header line
-
-                for row in tcga_file:
-                    cur.execute("INSERT INTO TCGA VALUES(?, ?)",
-                                (str(row[0]).lower(), str(row[1].rstrip('\n'))))
-
+        self.load_table('TCGA', read_tcga_names(path))
 
     def populate_cellular_components_table(self, path):
         """
@@ -430,38 +669,564 @@ class DatabaseInitializer:
         :param path: Path to the folder that keeps c5.cc.v6.1.symbols.gmt
         :return:
         """
-        try:
-            location_path = os.path.join(path, 'c5.cc.v6.1.symbols.gmt')
-        except Exception as e:
-            raise BioagentException.PathNotFoundException()
-
-        location_file = open(location_path, 'r')
-
-        with self.cadb:
-            cur = self.cadb.cursor()
-            cur.execute("DROP TABLE IF EXISTS CellularComponents")
-            cur.execute("CREATE TABLE CellularComponents(Gene TEXT, Component TEXT)")
-
-            for line in location_file:
+        self.load_table('CellularComponents', read_cellular_components(path))
+
+
+def read_generation(cadb):
+    """
+    :param cadb: Connection to the causality database
+    :return: Generation of the table contents, '' for a database built before generations were kept
+    """
+    if not cadb.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'Generation'").fetchone():
+        return ''
+    row = cadb.execute("SELECT Generation FROM Generation WHERE Id = 0").fetchone()
+    return str(row[0]) if row else ''
+
+
+def read_manifest(cadb):
+    """
+    :param cadb: Connection to the causality database
+    :return: {path: (table, study, size, mtime, hash)} of the data files of the last build,
+    None if there is no manifest
+    """
+    if not cadb.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'Manifest'").fetchone():
+        return None
+    rows = cadb.execute("SELECT Path, TableName, Study, Size, MTime, Hash FROM Manifest").fetchall()
+    return dict((row[0], row[1:]) for row in rows)
+
+
+def inputs_match_manifest(path, manifest, options):
+    """
+    Tells without hashing whether the data files and the options are the ones a database was built with
+    :param path: Path to the folder that keeps all the data files
+    :param manifest: Manifest of the database as returned by read_manifest
+    :param options: Build options as returned by DatabaseInitializer.build_options
+    :return: True if the same data files exist with the recorded sizes and modification times,
+    and the options have the recorded values
+    """
+    if manifest is None:
+        return False
+    signatures = {}
+    for rel_path, _, _ in resource_inputs(path):
+        file_path = os.path.join(path, rel_path)
+        if os.path.isfile(file_path):
+            signatures[rel_path] = file_signature(file_path)
+
+    recorded = dict((rel_path, tuple(entry[2:4])) for rel_path, entry in manifest.items()
+                    if not rel_path.startswith(option_prefix))
+    for name, (_, value) in options.items():
+        entry = manifest.get(name)
+        if (entry[4] if entry is not None else default_options[name]) != value:
+            return False
+    return signatures == recorded
+
+
+def option_value(relation_types):
+    """
+    :param relation_types: Relation types loaded from PC.sif, all of them if None
+    :return: The value recorded in the manifest, '*' for all the types
+    """
+    return '*' if relation_types is None else ','.join(sorted(set(relation_types)))
+
+
+def connect_read_only(db_file, immutable=True, check_same_thread=True):
+    """
+    Opens a database that no process modifies. SQLite skips locking and change detection
+    for it and reads it through a memory map, so processes share the pages in the OS cache.
+    :param db_file:
+    :param immutable: If False, the database is only opened read-only, so another process may still update it
+    :param check_same_thread: If False, the connection may be closed from another thread
+    :return: Connection
+    """
+    uri = 'file:%s?mode=ro%s' % (pathname2url(os.path.abspath(db_file)), '&immutable=1' if immutable else '')
+    cadb = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    cadb.execute("PRAGMA mmap_size = %d" % os.path.getsize(db_file))
+    return cadb
+
+
+def list_studies(path, table):
+    """
+    Lists the TCGA studies that have a data file for a table filled per study
+    :param path: Path to the folder that keeps all the data files
+    :param table: Name of a table in study_files
+    :return:
+    """
+    folder_path = os.path.join(path, study_files[table][0].split(os.sep)[0])
+    if not os.path.isdir(folder_path):
+        raise BioagentException.PathNotFoundException()
+
+    return [study for study in os.listdir(folder_path)
+            if study in tcga_study_names and list_study_files(path, table, study)]
+
+
+def list_study_files(path, table, study):
+    """
+    Lists the data files of a TCGA study for a table filled per study
+    :param path: Path to the folder that keeps all the data files
+    :param table: Name of a table in study_files
+    :param study: Study abbreviation
+    :return: Paths of the existing files, relative to the folder
+    """
+    return [pattern % study for pattern in study_files[table] if os.path.isfile(os.path.join(path, pattern % study))]
+
+
+def resource_inputs(path):
+    """
+    Lists the data files the tables are filled from
+    :param path: Path to the folder that keeps all the data files
+    :return: List of (path relative to the folder, table, study). Study is None for tables read from a single file.
+    """
+    inputs = [('PNNL-ovarian-correlations.txt', 'Correlations', None),
+              ('causative-data-centric.sif', 'CausalityPNNLOvarian', None),
+              ('causal-priors.txt', 'Causality', None),
+              ('PC.sif', 'Sif_Relations', None),
+              ('tcga_disease_names.tsv', 'TCGA', None),
+              ('c5.cc.v6.1.symbols.gmt', 'CellularComponents', None)]
+
+    for table in study_files:
+        for study in sorted(list_studies(path, table)):
+            inputs.extend((rel_path, table, study) for rel_path in list_study_files(path, table, study))
+
+    return inputs
+
+
+def file_signature(file_path):
+    """
+    :param file_path:
+    :return: (size, modification time) of the file
+    """
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime
+
+
+def hash_file(file_path):
+    """
+    :param file_path:
+    :return: SHA-1 hex digest of the file contents
+    """
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def create_table(cur, table):
+    """
+    Drops and creates the database tables of a table
+    :param cur: Database cursor
+    :param table: Name of a table in table_columns or composite_tables
+    :return:
+    """
+    cur.execute("DROP TABLE IF EXISTS %s" % table)
+    for name in composite_tables.get(table, (table,)):
+        cur.execute("DROP TABLE IF EXISTS %s" % name)
+        cur.execute("CREATE TABLE %s(%s)%s" % (name, ", ".join(table_columns[name]), table_options.get(name, '')))
+
+
+def delete_studies(cur, table, studies):
+    """
+    Deletes the rows of TCGA studies from a table filled per study
+    :param cur: Database cursor
+    :param table: Name of a table in study_files
+    :param studies: Study abbreviations
+    :return:
+    """
+    marks = ", ".join("?" * len(studies))
+    if table == 'Mutex':
+        cur.execute("DELETE FROM MutexMembers WHERE GroupId IN "
+                    "(SELECT GroupId FROM MutexGroups WHERE Disease IN (%s))" % marks, studies)
+        cur.execute("DELETE FROM MutexGroups WHERE Disease IN (%s)" % marks, studies)
+    else:
+        cur.execute("DELETE FROM %s WHERE Disease IN (%s)" % (table, marks), studies)
+
+
+def copy_staged_table(cur, table):
+    """
+    Appends the rows of a table in the attached stage database to the main database.
+    Mutex group ids are shifted past the ones already in the main database.
+    :param cur: Database cursor
+    :param table: Name of a table in table_readers
+    :return:
+    """
+    if table == 'Mutex':
+        offset = cur.execute("SELECT IFNULL(MAX(GroupId), 0) FROM main.MutexGroups").fetchone()[0]
+        cur.execute("INSERT INTO main.MutexGroups SELECT GroupId + ?, Disease, AlterationSet, Network, Score "
+                    "FROM stage.MutexGroups", (offset,))
+        cur.execute("INSERT INTO main.MutexMembers SELECT GroupId + ?, Gene, Position FROM stage.MutexMembers",
+                    (offset,))
+    else:
+        # the other tables are staged by a single job, so their ids don't collide
+        for name in composite_tables.get(table, (table,)):
+            cur.execute("INSERT INTO main.%s SELECT * FROM stage.%s" % (name, name))
+
+
+def insert_mutex_groups(cur, table, groups):
+    """
+    Inserts mutex groups into MutexGroups and their genes into MutexMembers, numbering
+    the groups after the ones already in the table
+    :param cur: Database cursor
+    :param table: Mutex
+    :param groups: Iterable of (disease, alteration set, network, score, genes)
+    :return: Number of inserted groups
+    """
+    group_id = cur.execute("SELECT IFNULL(MAX(GroupId), 0) FROM MutexGroups").fetchone()[0]
+    group_cnt = 0
+    group_rows = []
+    member_rows = []
+
+    for disease, alteration_set, network, score, genes in groups:
+        group_id += 1
+        group_rows.append((group_id, disease, alteration_set, network, score))
+        member_rows.extend((group_id, gene, i) for i, gene in enumerate(genes))
+
+        if len(member_rows) >= batch_size:
+            cur.executemany("INSERT INTO MutexGroups VALUES(?, ?, ?, ?, ?)", group_rows)
+            cur.executemany("INSERT INTO MutexMembers VALUES(?, ?, ?)", member_rows)
+            group_cnt += len(group_rows)
+            group_rows = []
+            member_rows = []
+
+    cur.executemany("INSERT INTO MutexGroups VALUES(?, ?, ?, ?, ?)", group_rows)
+    cur.executemany("INSERT INTO MutexMembers VALUES(?, ?, ?)", member_rows)
+    return group_cnt + len(group_rows)
+
+
+def insert_sif_relations(cur, table, relations):
+    """
+    Interns the gene symbols and relation types of sif relations into SifGenes and
+    SifRelationTypes and inserts the relations into Sif_Relations as integer ids.
+    Repeated relations are stored once.
+    :param cur: Database cursor
+    :param table: Sif_Relations
+    :param relations: Iterable of (gene1, relation type, gene2)
+    :return: Number of read relations
+    """
+    gene_ids = dict((symbol, gene_id) for gene_id, symbol in cur.execute("SELECT GeneId, Symbol FROM SifGenes"))
+    rel_ids = dict((rel, rel_id) for rel_id, rel in cur.execute("SELECT RelId, Rel FROM SifRelationTypes"))
+    new_genes = []
+    new_rels = []
+    edge_rows = []
+    row_cnt = 0
+
+    # the relations are staged in a rowid table, which takes appends in any order
+    cur.execute("DROP TABLE IF EXISTS temp.SifStaging")
+    cur.execute("CREATE TEMP TABLE SifStaging(RelId INTEGER, Id2 INTEGER, Id1 INTEGER)")
+
+    for gene1, rel, gene2 in relations:
+        rel_id = rel_ids.get(rel)
+        if rel_id is None:
+            rel_id = rel_ids[rel] = len(rel_ids) + 1
+            new_rels.append((rel_id, rel))
+
+        gene_id1 = gene_ids.get(gene1)
+        if gene_id1 is None:
+            gene_id1 = gene_ids[gene1] = len(gene_ids) + 1
+            new_genes.append((gene_id1, gene1))
+
+        gene_id2 = gene_ids.get(gene2)
+        if gene_id2 is None:
+            gene_id2 = gene_ids[gene2] = len(gene_ids) + 1
+            new_genes.append((gene_id2, gene2))
+
+        edge_rows.append((rel_id, gene_id2, gene_id1))
+        if len(edge_rows) >= batch_size:
+            cur.executemany("INSERT INTO SifStaging VALUES(?, ?, ?)", edge_rows)
+            row_cnt += len(edge_rows)
+            edge_rows = []
+
+    cur.executemany("INSERT INTO SifStaging VALUES(?, ?, ?)", edge_rows)
+    # the primary key is filled in its own order rather than the file order
+    cur.execute("INSERT OR IGNORE INTO Sif_Relations SELECT RelId, Id2, Id1 FROM SifStaging "
+                "ORDER BY RelId, Id2, Id1")
+    cur.execute("DROP TABLE SifStaging")
+    cur.executemany("INSERT INTO SifGenes VALUES(?, ?)", new_genes)
+    cur.executemany("INSERT INTO SifRelationTypes VALUES(?, ?)", new_rels)
+    return row_cnt + len(edge_rows)
+
+
+def insert_rows(cur, table, rows):
+    """
+    Inserts rows into an existing table in chunks of batch_size
+    :param cur: Database cursor
+    :param table: Name of a table in table_columns
+    :param rows: Iterable of value tuples, holding values for the leading columns of the table
+    :return: Number of inserted rows
+    """
+    rows = iter(rows)
+    row_cnt = 0
+
+    chunk = list(islice(rows, batch_size))
+    if chunk:
+        columns = [column.split()[0] for column in table_columns[table][:len(chunk[0])]]
+        insert = "INSERT INTO %s(%s) VALUES(%s)" % (table, ", ".join(columns), ", ".join("?" * len(columns)))
+
+    while chunk:
+        cur.executemany(insert, chunk)
+        row_cnt += len(chunk)
+        chunk = list(islice(rows, batch_size))
+
+    return row_cnt
+
+
+def make_staging_jobs(path, workers, sif_args):
+    """
+    Splits the parsing of the data files into jobs for populate_tables_parallel.
+    The TCGA studies are divided among the workers.
+    :param path: Path to the folder that keeps all the data files
+    :param workers: Number of processes
+    :param sif_args: Arguments of the Sif_Relations reader
+    :return: List of (table, reader arguments)
+    """
+    jobs = [('Sif_Relations', sif_args)]
+    jobs.extend((table, (path,)) for table in
+                ['Correlations', 'Causality', 'CausalityPNNLOvarian', 'TCGA', 'CellularComponents'])
+
+    for table in study_files:
+        studies = list_studies(path, table)
+        for i in range(min(workers, len(studies))):
+            jobs.append((table, (path, studies[i::workers])))
+
+    return jobs
+
+
+def stage_table(table, args, staging_file):
+    """
+    Parses the data files of a table into a standalone staging database. Runs in a worker process.
+    :param table: Name of a table in table_readers
+    :param args: Arguments of the reader
+    :param staging_file: Database file to create
+    :return: (table, staging file, row count, seconds)
+    """
+    start = time.time()
+    staging_db = sqlite3.connect(staging_file)
+    try:
+        with staging_db:
+            cur = staging_db.cursor()
+            cur.execute("PRAGMA journal_mode = OFF")
+            cur.execute("PRAGMA synchronous = OFF")
+            create_table(cur, table)
+            row_cnt = table_inserters.get(table, insert_rows)(cur, table, table_readers[table](*args))
+    finally:
+        staging_db.close()
+
+    return table, staging_file, row_cnt, time.time() - start
+
+
+def split_site(id_str):
+    """
+    Splits an identifier such as AKT1-S473S into the gene and its phosphosite
+    :param id_str:
+    :return: (gene, site), site is ' ' when there isn't any
+    """
+    vals = id_str.upper().split('-')
+    if len(vals) > 1:
+        return vals[0], vals[1]
+    return vals[0], ' '
+
+
+def make_uri_str(uri_field):
+    """
+    Converts the space separated uri column of a sif file into the uri string used in PC queries
+    :param uri_field:
+    :return:
+    """
+    uri_arr = []
+    if uri_field:
+        uri_arr = uri_field.split(" ")
+
+    if len(uri_arr) == 0:
+        uri_arr = [uri_field]
+
+    return "".join("uri= " + uri + "&" for uri in uri_arr)
+
+
+def read_causal_priors(path):
+    """
+    Generates the Causality rows, each relation followed by its opposite
+    :param path: Path to the folder that keeps causal-priors.txt
+    :return:
+    """
+    with open(os.path.join(path, 'causal-priors.txt'), 'r') as causality_file:
+        for line in causality_file:
+            vals = line.split('\t')
+            id1 = vals[0].upper()
+            p_site1 = ' '
+            rel = vals[1]
+            id2 = vals[2].upper()
+            uri_str = make_uri_str(vals[3])
+            opp_rel = opposite_rel[rel]
+
+            if len(vals) > 4:
+                p_sites2 = vals[4].upper().split(';')
+            else:
+                p_sites2 = [' ']
+
+            for p_site2 in p_sites2:
+                yield id1, p_site1, id2, p_site2, rel, uri_str
+                # opposite relation
+                yield id2, p_site2, id1, p_site1, opp_rel, uri_str
+
+
+def read_causative_sif(path):
+    """
+    Generates the CausalityPNNLOvarian rows, each relation followed by its opposite
+    :param path: Path to the folder that keeps causative-data-centric.sif
+    :return:
+    """
+    with open(os.path.join(path, 'causative-data-centric.sif'), 'r') as causality_file:
+        for line in causality_file:
+            vals = line.split('\t')
+            id1, p_site1 = split_site(vals[0])
+            id2, p_site2 = split_site(vals[2])
+            rel = vals[1]
+            uri_str = make_uri_str(vals[3])
+
+            yield id1, p_site1, id2, p_site2, rel, uri_str
+            # opposite relation
+            yield id2, p_site2, id1, p_site1, opposite_rel[rel], uri_str
+
+
+def read_correlations(path):
+    """
+    Generates the Correlations rows
+    :param path: Path to the folder that keeps PNNL-ovarian-correlations.txt
+    :return:
+    """
+    with open(os.path.join(path, 'PNNL-ovarian-correlations.txt'), 'r') as pnnl_file:
+        for line in pnnl_file:
+            if line.find('/') > -1:  # incorrectly formatted strings
+                continue
+            vals = line.split('\t')
+            id1, p_site1 = split_site(vals[0])
+            id2, p_site2 = split_site(vals[1])
+            corr = float(vals[2].rstrip('\n'))
+            p_val = float(vals[3].rstrip('\n'))
+
+            yield id1, p_site1, id2, p_site2, corr, p_val
+
+
+def read_mutsig(path, studies=None):
+    """
+    Generates the MutSig rows of the TCGA studies
+    :param path: Path to the folder that keeps TCGA folder and mutsig.txt files
+    :param studies: Study abbreviations to read, all studies if None
+    :return:
+    """
+    if studies is None:
+        studies = list_studies(path, 'MutSig')
+
+    for folder in studies:
+        with open(os.path.join(path, study_files['MutSig'][0] % folder), 'r') as mutsig_file:
+            next(mutsig_file)  # skip the header line
+            for line in mutsig_file:
                 vals = line.split('\t')
-                loc = vals[0]
-
-                for i in range(2, len(vals)):
-                    gene = vals[i]
-                    if loc in loc_list:
-                        cur.execute("INSERT INTO CellularComponents VALUES(?, ?)",
-                                    (gene, loc))
-
-        location_file.close()
-
-    # def get_unique_cellular_components(self):
-    #     with self.cadb:
-    #         cur = self.cadb.cursor()
-    #         locations = cur.execute("SELECT DISTINCT Component FROM CellularComponents",).fetchall()
-    #
-    #         print(locations)
-#
-# db = DatabaseInitializer(os.path.dirname(os.path.realpath(__file__)) + '/resources/')
-#
-# print(db.mutation_frequency('TP53', 'LUAD'))
+                yield vals[1], folder, vals[17], vals[18].rstrip('\n')
+
+
+def read_mutex(path, studies=None):
+    """
+    Generates the mutex groups of all result variants of the TCGA studies as
+    (disease, alteration set, network, score, genes). Groups with scores above 0.05 are skipped.
+    :param path: Path to the folder that keeps ranked-groups.txt
+    :param studies: Study abbreviations to read, all studies if None
+    :return:
+    """
+    if studies is None:
+        studies = list_studies(path, 'Mutex')
+
+    for folder in studies:
+        for (alteration_set, network), pattern in zip(mutex_variants, study_files['Mutex']):
+            file_path = os.path.join(path, pattern % folder)
+            if not os.path.isfile(file_path):
+                continue
+
+            with open(file_path, 'r') as mutex_file:
+                next(mutex_file)  # skip the header line
+                for line in mutex_file:
+                    vals = line.rstrip('\n').split('\t')
+                    score = float(vals[0])
+                    if score > 0.05:
+                        continue
 
+                    yield folder, alteration_set, network, score, vals[2:]
+
+
+def read_sif_relations(path, relation_types=None):
+    """
+    Generates the sif relations in PC.sif as (gene1, relation type, gene2)
+    :param path: Path to the folder that keeps PC.sif
+    :param relation_types: Relation types to keep, all of them if None
+    :return:
+    """
+    if relation_types is not None:
+        relation_types = set(relation_types)
+
+    with open(os.path.join(path, 'PC.sif'), 'r') as pc_file:
+        for line in pc_file:
+            vals = line.split('\t')
+            if relation_types is not None and vals[1] not in relation_types:
+                continue
+            yield vals[0].upper(), vals[1], vals[2].rstrip('\n').upper()
+
+
+def read_tcga_names(path):
+    """
+    Generates the TCGA long name and abbreviation rows
+    :param path: Path to the folder that keeps  tcga_disease_names.tsv
+    :return:
+    """
+    with open(os.path.join(path, 'tcga_disease_names.tsv'), 'r') as tcga_file:
+        tcga_reader = csv.reader(tcga_file, delimiter='\t')
+        next(tcga_reader)  # skip the header line
+
+        for row in tcga_reader:
+            yield str(row[0]).lower(), str(row[1].rstrip('\n'))
+
+
+def read_cellular_components(path):
+    """
+    Generates the gene and tracked cellular component rows
+    :param path: Path to the folder that keeps c5.cc.v6.1.symbols.gmt
+    :return:
+    """
+    with open(os.path.join(path, 'c5.cc.v6.1.symbols.gmt'), 'r') as location_file:
+        for line in location_file:
+            vals = line.rstrip('\n').split('\t')
+            loc = vals[0]
+            if loc not in loc_list:
+                continue
+
+            for gene in vals[2:]:
+                yield gene, loc
+
+
+# Row generators of the tables that are filled directly from the data files
+table_readers = {
+    'Correlations': read_correlations,
+    'CausalityPNNLOvarian': read_causative_sif,
+    'Causality': read_causal_priors,
+    'MutSig': read_mutsig,
+    'Mutex': read_mutex,
+    'Sif_Relations': read_sif_relations,
+    'TCGA': read_tcga_names,
+    'CellularComponents': read_cellular_components,
+}
+
+# Insert functions of the tables whose reader rows don't map to a single database table
+table_inserters = {
+    'Mutex': insert_mutex_groups,
+    'Sif_Relations': insert_sif_relations,
+}
+
+
+if __name__ == "__main__":
+    # Builds the database and its read-only snapshot in the given resource folder
+    logging.basicConfig(format='%(levelname)s: %(name)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Builds the database and its read-only snapshot.')
+    parser.add_argument('path', help='folder that keeps all the data files')
+    parser.add_argument('--sif-relations', help='comma-separated relation types loaded from PC.sif, all if missing')
+    args = parser.parse_args()
+    db_initializer = DatabaseInitializer(args.path, workers=os.cpu_count() or 1,
+                                         sif_relations=args.sif_relations.split(',') if args.sif_relations else None)
+    db_initializer.build_snapshot(os.path.join(args.path, snapshot_name))
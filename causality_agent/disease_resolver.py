@@ -0,0 +1,109 @@
+import re
+import logging
+from .database_initializer import read_tcga_names
+
+
+logger = logging.getLogger('CausalA')
+
+# Least trigram similarity of a name to the closest known one for the names to match,
+# and the least lead the closest one needs over the closest one of another study
+min_similarity = 0.7
+min_lead = 0.05
+
+# Words that don't tell diseases apart
+stop_words = {'and', 'of', 'the', 'with'}
+
+non_word_pattern = re.compile('[^a-z0-9]+')
+
+
+def normalize_name(name):
+    """
+    :param name: Disease name, e.g. 'Glioblastoma multiforme/Brain Lower-Grade Glioma'
+    :return: Lowercase words without punctuation or stop words, e.g. 'glioblastoma multiforme brain lower grade glioma'
+    """
+    return ' '.join(word for word in non_word_pattern.split(name.lower()) if word and word not in stop_words)
+
+
+def trigrams(name):
+    """
+    :param name: Normalized name
+    :return: Set of its character trigrams, padded so that word starts and ends count
+    """
+    padded = '  %s ' % name
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class DiseaseResolver:
+    """ Resolves disease names to TCGA study abbreviations. Names are matched exactly, then by
+    their words in any order, then approximately through a trigram index of the known names."""
+
+    def __init__(self, path):
+        """
+        :param path: Path to the folder that keeps tcga_disease_names.tsv
+        """
+        # {normalized name or abbreviation: abbreviation}
+        self.abbrs = {}
+        # {sorted words of a name: abbreviation}
+        self.word_sets = {}
+        # normalized names, their trigram sets and {trigram: indices of the names that have it}
+        self.names = []
+        self.name_trigrams = []
+        self.trigram_index = {}
+
+        for long_name, abbr in read_tcga_names(path):
+            name = normalize_name(long_name)
+            self.abbrs[name] = abbr
+            self.abbrs[abbr.lower()] = abbr
+            self.word_sets[' '.join(sorted(name.split()))] = abbr
+
+            i = len(self.names)
+            self.names.append((name, abbr))
+            self.name_trigrams.append(trigrams(name))
+            for trigram in self.name_trigrams[i]:
+                self.trigram_index.setdefault(trigram, []).append(i)
+
+    def resolve(self, disease_name):
+        """
+        :param disease_name: Disease name or TCGA study abbreviation in any case
+        :return: Abbreviation of the TCGA study, None if the name matches none or more than one
+        """
+        name = normalize_name(disease_name)
+        if not name:
+            return None
+
+        abbr = self.abbrs.get(name)
+        if abbr is None:
+            abbr = self.word_sets.get(' '.join(sorted(name.split())))
+        if abbr is None:
+            abbr = self.find_closest(name)
+        return abbr
+
+    def find_closest(self, name):
+        """
+        :param name: Normalized name
+        :return: Abbreviation of the most similar known name, None if it isn't similar enough
+        or another study's name is about as similar
+        """
+        query = trigrams(name)
+
+        # names sharing trigrams with the query, with the number they share
+        shared = {}
+        for trigram in query:
+            for i in self.trigram_index.get(trigram, ()):
+                shared[i] = shared.get(i, 0) + 1
+
+        # best Dice similarity of each study
+        scores = {}
+        for i, cnt in shared.items():
+            score = 2.0 * cnt / (len(query) + len(self.name_trigrams[i]))
+            abbr = self.names[i][1]
+            if score > scores.get(abbr, 0):
+                scores[abbr] = score
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if not ranked or ranked[0][1] < min_similarity:
+            return None
+        if len(ranked) > 1 and ranked[0][1] - ranked[1][1] < min_lead:
+            logger.info('Disease name %s is as close to %s as to %s' % (name, ranked[0][0], ranked[1][0]))
+            return None
+        return ranked[0][0]
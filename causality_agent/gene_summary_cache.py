@@ -0,0 +1,141 @@
+"""Persistent cache of the gene summaries of the PathwayCommons biogene service.
+
+A local dump pre-populates it, so the agent can answer without the service:
+
+    python -m causality_agent.gene_summary_cache summaries.tsv
+
+The dump is a TSV of gene and summary per line, or a JSON object of {gene: summary}.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import sqlite3
+import argparse
+import threading
+
+
+logger = logging.getLogger('CausalA')
+
+cache_name = 'gene-summaries.db'
+
+# Seconds a summary is kept, and seconds a gene without a summary is remembered as such.
+# Imported summaries never expire.
+default_summary_ttl = 30 * 24 * 3600
+default_negative_ttl = 24 * 3600
+
+
+class GeneSummaryCache:
+    """ Keeps gene summaries in a database of their own, next to the read-only causality database"""
+
+    def __init__(self, db_file, ttl=default_summary_ttl, negative_ttl=default_negative_ttl):
+        """
+        :param db_file:
+        :param ttl: Seconds a fetched summary is kept
+        :param negative_ttl: Seconds an empty summary is kept before the service is asked again
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # requests may be answered on several threads, which share the connection under the lock
+        self.lock = threading.Lock()
+        try:
+            self.cadb = sqlite3.connect(db_file, check_same_thread=False)
+            create_summary_table(self.cadb)
+        except sqlite3.Error as e:
+            logger.warning('Could not open %s, keeping the gene summaries in memory: %s' % (db_file, e))
+            self.cadb = sqlite3.connect(':memory:', check_same_thread=False)
+            create_summary_table(self.cadb)
+
+    def get(self, gene, now=None):
+        """
+        :param gene:
+        :param now: Time to compare the expiry with, the current time if None
+        :return: (summary, fresh), where summary is None if the gene isn't cached
+        and fresh is False for an expired one
+        """
+        with self.lock:
+            row = self.cadb.execute("SELECT Summary, Expires FROM GeneSummaries WHERE Gene = ?", (gene,)).fetchone()
+        if row is None:
+            return None, False
+        summary, expires = row
+        return summary, expires is None or expires > (time.time() if now is None else now)
+
+    def put(self, gene, summary, ttl=None):
+        """
+        Keeps a fetched summary, an empty one for a shorter time
+        :param gene:
+        :param summary: Summary, "" if the gene has none
+        :param ttl: Seconds the summary is kept, the ttl or the negative_ttl of the cache if None
+        :return:
+        """
+        if ttl is None:
+            ttl = self.ttl if summary else self.negative_ttl
+        expires = time.time() + ttl
+        with self.lock:
+            try:
+                with self.cadb:
+                    self.cadb.execute("INSERT OR REPLACE INTO GeneSummaries VALUES (?, ?, ?)",
+                                      (gene, summary, expires))
+            except sqlite3.OperationalError as e:
+                # a file that can be read but not written, e.g. in a read-only folder
+                logger.warning('Could not write to the gene summary cache, keeping it in memory: %s' % e)
+                memory_db = sqlite3.connect(':memory:', check_same_thread=False)
+                self.cadb.backup(memory_db)
+                self.cadb.close()
+                self.cadb = memory_db
+                with self.cadb:
+                    self.cadb.execute("INSERT OR REPLACE INTO GeneSummaries VALUES (?, ?, ?)",
+                                      (gene, summary, expires))
+
+    def import_summaries(self, summaries):
+        """
+        Stores summaries that never expire
+        :param summaries: Iterable of (gene, summary) pairs
+        :return: Number of summaries stored
+        """
+        with self.lock, self.cadb:
+            cur = self.cadb.executemany("INSERT OR REPLACE INTO GeneSummaries VALUES (?, ?, NULL)", summaries)
+            return cur.rowcount
+
+    def close(self):
+        self.cadb.close()
+
+
+def create_summary_table(cadb):
+    with cadb:
+        cadb.execute("CREATE TABLE IF NOT EXISTS GeneSummaries (Gene TEXT PRIMARY KEY, Summary TEXT, Expires REAL)")
+
+
+def read_dump(dump_file):
+    """
+    :param dump_file: TSV of gene and summary per line, or, ending in .json, a JSON object of {gene: summary}
+    :return: List of (gene, summary) pairs
+    """
+    with open(dump_file) as fp:
+        if dump_file.endswith('.json'):
+            return list(json.load(fp).items())
+        summaries = []
+        for line in fp:
+            columns = line.rstrip('\n').split('\t')
+            if len(columns) >= 2 and columns[0]:
+                summaries.append((columns[0], columns[1]))
+        return summaries
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Imports gene summaries from a local dump into the cache.')
+    parser.add_argument('dump', help='TSV of gene and summary, or a JSON object of {gene: summary}')
+    parser.add_argument('--cache', default=os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                                        'resources', cache_name))
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    cache = GeneSummaryCache(args.cache)
+    count = cache.import_summaries(read_dump(args.dump))
+    cache.close()
+    print('Imported %d gene summaries into %s in %.2f s' % (count, args.cache, time.time() - start))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,67 @@
+import time
+import logging
+from .database_initializer import loc_list
+
+
+logger = logging.getLogger('CausalA')
+
+
+def component_name(component):
+    """
+    :param component: GO component, e.g. GO_CELL_BODY
+    :return: Name used in the responses, e.g. cell_body
+    """
+    return component[3:].lower() if component.startswith('GO_') else component.lower()
+
+
+class LocationIndex:
+    """ Keeps the tracked cellular components of each gene as a bitmask, bit i standing for loc_list[i]"""
+
+    def __init__(self, cadb):
+        """
+        :param cadb: Connection to the causality database
+        """
+        start = time.time()
+        bits = dict((component, 1 << i) for i, component in enumerate(loc_list))
+
+        # {gene: bitmask of its components}
+        self.masks = {}
+        with cadb:
+            cur = cadb.cursor()
+            for gene, component in cur.execute("SELECT Gene, Component FROM CellularComponents"):
+                if component in bits:
+                    self.masks[gene] = self.masks.get(gene, 0) | bits[component]
+
+        logger.info('Indexed the cellular components of %d genes in %.2f s' % (len(self.masks), time.time() - start))
+
+    def get_components(self, gene):
+        """
+        :param gene:
+        :return: Tracked components of the gene in loc_list order
+        """
+        mask = self.masks.get(gene, 0)
+        return [component for i, component in enumerate(loc_list) if mask >> i & 1]
+
+    def find_most_likely(self, genes):
+        """
+        Counts the genes in each component in one pass over their bitmasks
+        :param genes: List of gene symbols. Repeated genes are counted once.
+        :return: (components with the most genes in loc_list order, their gene count).
+        No components if none of the genes has one.
+        """
+        masks = [self.masks.get(gene, 0) for gene in dict.fromkeys(genes)]
+
+        union = 0
+        for mask in masks:
+            union |= mask
+
+        counts = {}
+        for i in range(len(loc_list)):
+            if union >> i & 1:
+                counts[i] = sum(mask >> i & 1 for mask in masks)
+
+        if not counts:
+            return [], 0
+
+        max_cnt = max(counts.values())
+        return [loc_list[i] for i, cnt in sorted(counts.items()) if cnt == max_cnt], max_cnt
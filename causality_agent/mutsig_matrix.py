@@ -0,0 +1,140 @@
+import os
+import json
+import time
+import logging
+import numpy as np
+
+
+logger = logging.getLogger('CausalA')
+
+matrix_name = 'mutsig-matrix'
+
+# Significance of the p-values below each threshold, and of larger ones
+significance_tiers = [(0.01, 'highly significant'), (0.05, 'significant')]
+insignificant = 'not significant'
+
+
+class MutSigMatrix:
+    """ Keeps the MutSig p-values and q-values as a dense gene x disease x (p, q) matrix in a file
+    next to the database, memory-mapped so processes share it. Missing pairs are NaN.
+    The files are named by the database generation and never change once written, so a reader
+    can't pair the matrix of one generation with the axes of another."""
+
+    def __init__(self, path, cadb, generation):
+        """
+        Maps the matrix file of the generation, writing it first if it is missing
+        :param path: Folder of the matrix file
+        :param cadb: Connection to the causality database
+        :param generation: Generation of the database. A database without one can't tell its builds apart,
+        so its matrix is built in memory.
+        """
+        matrix_file = os.path.join(path, '%s-%s.npy' % (matrix_name, generation))
+        axes_file = os.path.join(path, '%s-%s.json' % (matrix_name, generation))
+
+        axes = None
+        if generation:
+            # the axes are written after the matrix, so the matrix is complete once they exist
+            try:
+                with open(axes_file) as fp:
+                    axes = json.load(fp)
+                matrix = np.load(matrix_file, mmap_mode='r')
+            except (OSError, ValueError):
+                # missing, or removed by a process of a newer generation
+                axes = None
+
+        if axes is None:
+            axes, matrix = self.build(cadb, generation)
+            if generation:
+                try:
+                    save_matrix(matrix_file, axes_file, axes, matrix)
+                    matrix = np.load(matrix_file, mmap_mode='r')
+                    remove_other_generations(path, generation)
+                except OSError as e:
+                    logger.warning('Could not write %s, keeping the MutSig matrix in memory: %s' % (matrix_file, e))
+
+        self.genes = dict((gene, i) for i, gene in enumerate(axes['genes']))
+        self.diseases = dict((disease, i) for i, disease in enumerate(axes['diseases']))
+        self.disease_list = axes['diseases']
+        self.matrix = matrix
+
+    @staticmethod
+    def build(cadb, generation):
+        """
+        :return: (axes, matrix) of the MutSig table, the first row of a repeated pair winning as in the lookups
+        """
+        start = time.time()
+        with cadb:
+            rows = cadb.execute("SELECT Id, Disease, PVal, QVal FROM MutSig ORDER BY rowid").fetchall()
+
+        genes = sorted(set(row[0] for row in rows))
+        diseases = sorted(set(row[1] for row in rows))
+        gene_ids = dict((gene, i) for i, gene in enumerate(genes))
+        disease_ids = dict((disease, i) for i, disease in enumerate(diseases))
+
+        matrix = np.full((len(genes), len(diseases), 2), np.nan, dtype=np.float64)
+        for gene, disease, p_val, q_val in reversed(rows):
+            matrix[gene_ids[gene], disease_ids[disease]] = (to_float(p_val), to_float(q_val))
+
+        logger.info('Built the %d x %d MutSig matrix in %.2f s' % (len(genes), len(diseases), time.time() - start))
+        return {'generation': generation, 'genes': genes, 'diseases': diseases}, matrix
+
+    def find_significance(self, genes, diseases=None):
+        """
+        :param genes: List of gene symbols
+        :param diseases: List of TCGA study abbreviations, all studies if None
+        :return: {gene: {disease: significance}} of the pairs with a p-value
+        """
+        if diseases is None:
+            diseases = self.disease_list
+        genes = [gene for gene in dict.fromkeys(genes) if gene in self.genes]
+        diseases = [disease for disease in dict.fromkeys(diseases) if disease in self.diseases]
+        if not genes or not diseases:
+            return {}
+
+        p_vals = self.matrix[np.ix_([self.genes[gene] for gene in genes],
+                                    [self.diseases[disease] for disease in diseases], [0])][:, :, 0]
+
+        # index into tier_names of every pair, -1 for pairs without a p-value
+        tier_names = [name for _, name in significance_tiers] + [insignificant]
+        present = ~np.isnan(p_vals)
+        tiers = np.select([p_vals < threshold for threshold, _ in significance_tiers] + [present],
+                          range(len(tier_names)), -1)
+
+        result = {}
+        for i, j in zip(*np.nonzero(present)):
+            result.setdefault(genes[i], {})[diseases[j]] = tier_names[tiers[i, j]]
+        return result
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def save_matrix(matrix_file, axes_file, axes, matrix):
+    """
+    Writes the matrix and then its axes under temporary names and moves them in place,
+    so other processes never map a partial file
+    """
+    suffix = '.%d.tmp' % os.getpid()
+    np.save(matrix_file + suffix, matrix)
+    os.replace(matrix_file + suffix + '.npy', matrix_file)
+    with open(axes_file + suffix, 'w') as fp:
+        json.dump(axes, fp)
+    os.replace(axes_file + suffix, axes_file)
+
+
+def remove_other_generations(path, generation):
+    """
+    Removes the matrix files of the other generations, and the unversioned ones of earlier releases.
+    Processes that mapped one keep reading it.
+    """
+    current = ['%s-%s.npy' % (matrix_name, generation), '%s-%s.json' % (matrix_name, generation)]
+    for name in os.listdir(path):
+        if name.startswith(matrix_name) and name not in current and not name.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(path, name))
+            except OSError:
+                pass
@@ -0,0 +1,116 @@
+import logging
+
+
+logger = logging.getLogger('CausalA')
+
+# Relations followed from a gene to the next one on a path. Their is-...-by forms are the same
+# relationships stored in the opposite direction, so they are left out.
+path_relations = ['phosphorylates', 'dephosphorylates', 'upregulates-expression', 'downregulates-expression']
+
+# Longest path in relationships, and the most genes expanded for one request
+default_max_depth = 3
+default_max_expansions = 5000
+
+
+class PathSearch:
+    """ Finds the shortest causal paths between two genes with a bidirectional breadth first search"""
+
+    def __init__(self, graph):
+        """
+        Precomputes the neighbors of each gene over path_relations
+        :param graph: CausalGraph
+        """
+        self.graph = graph
+
+        # {gene id: [(neighbor id, edge index)]}, one edge per neighbor, the first one in file order
+        self.successors = {}
+        self.predecessors = {}
+        for edge_ind, edge in enumerate(graph.edges):
+            if edge[4] not in path_relations or edge[0] == edge[2]:
+                continue
+            self.successors.setdefault(edge[0], {}).setdefault(edge[2], edge_ind)
+            self.predecessors.setdefault(edge[2], {}).setdefault(edge[0], edge_ind)
+
+        for neighbors in (self.successors, self.predecessors):
+            for gene_id, edges in neighbors.items():
+                neighbors[gene_id] = sorted(edges.items(), key=lambda neighbor: neighbor[1])
+
+    def find_path(self, source, target, max_depth=default_max_depth, max_expansions=default_max_expansions):
+        """
+        Expands the smaller frontier one level at a time, so a hub on one side
+        doesn't grow the search, and stops at the first level where the two sides meet
+        :param source: Gene symbol
+        :param target: Gene symbol
+        :param max_depth: Most relationships on the path
+        :param max_expansions: Most genes expanded before giving up
+        :return: List of causality objects from source to target, None if there is no path within the limits
+        """
+        source_id = self.graph.gene_ids.get(source)
+        target_id = self.graph.gene_ids.get(target)
+        if source_id is None or target_id is None or source_id == target_id:
+            return None
+
+        # {gene id: edge index it was reached by, None for the start}
+        forward_parents = {source_id: None}
+        backward_parents = {target_id: None}
+        forward_frontier = [source_id]
+        backward_frontier = [target_id]
+        forward_depth = backward_depth = 0
+        expansions = 0
+
+        while forward_frontier and backward_frontier and forward_depth + backward_depth < max_depth:
+            forward_cost = sum(len(self.successors.get(gene_id, ())) for gene_id in forward_frontier)
+            backward_cost = sum(len(self.predecessors.get(gene_id, ())) for gene_id in backward_frontier)
+
+            expansions += len(forward_frontier) if forward_cost <= backward_cost else len(backward_frontier)
+            if expansions > max_expansions:
+                logger.info('Stopped the path search from %s to %s after %d expansions' %
+                            (source, target, expansions))
+                return None
+
+            if forward_cost <= backward_cost:
+                forward_frontier, meeting = self.expand(forward_frontier, self.successors, forward_parents,
+                                                        backward_parents)
+                forward_depth += 1
+            else:
+                backward_frontier, meeting = self.expand(backward_frontier, self.predecessors, backward_parents,
+                                                         forward_parents)
+                backward_depth += 1
+
+            if meeting is not None:
+                return self.make_path(meeting, forward_parents, backward_parents)
+
+        return None
+
+    @staticmethod
+    def expand(frontier, neighbors, parents, other_parents):
+        """
+        Visits the neighbors of a frontier
+        :return: (next frontier, first gene reached from both sides or None)
+        """
+        next_frontier = []
+        for gene_id in frontier:
+            for neighbor_id, edge_ind in neighbors.get(gene_id, ()):
+                if neighbor_id in parents:
+                    continue
+                parents[neighbor_id] = edge_ind
+                if neighbor_id in other_parents:
+                    return next_frontier, neighbor_id
+                next_frontier.append(neighbor_id)
+        return next_frontier, None
+
+    def make_path(self, meeting, forward_parents, backward_parents):
+        edges = self.graph.edges
+
+        edge_inds = []
+        gene_id = meeting
+        while forward_parents[gene_id] is not None:
+            edge_inds.insert(0, forward_parents[gene_id])
+            gene_id = edges[forward_parents[gene_id]][0]
+
+        gene_id = meeting
+        while backward_parents[gene_id] is not None:
+            edge_inds.append(backward_parents[gene_id])
+            gene_id = edges[backward_parents[gene_id]][2]
+
+        return [self.graph.to_causality(edge_ind) for edge_ind in edge_inds]
@@ -0,0 +1,156 @@
+import re
+import copy
+from functools import lru_cache
+
+
+site_pattern = re.compile('([TYS][0-9]+)')
+
+
+@lru_cache(maxsize=65536)
+def decode_sites(p_site):
+    """
+    Site strings repeat a lot, so each is parsed once
+    :param p_site: Site string of a Causality row, e.g. 'S12 T15'
+    :return: Tuple of (residue, position) pairs
+    """
+    return tuple((site[0], site[1:]) for site in site_pattern.findall(p_site))
+
+
+def make_mods(sites):
+    """
+    Converts decoded sites into the modification list of a causality object
+    :param sites: Tuple of (residue, position) pairs
+    :return:
+    """
+    if not sites:
+        return [{'mod_type': 'phosphorylation', 'residue': None, 'position': None, 'is_modified': True}]
+
+    return [{'mod_type': 'phosphorylation', 'residue': residue, 'position': position, 'is_modified': True}
+            for residue, position in sites]
+
+
+class Record:
+    """ Result object with fixed attributes. It can still be read and written with the keys
+    of the dictionaries the results used to be, and to_dict makes such a dictionary."""
+    __slots__ = ()
+
+    # {dictionary key: attribute}
+    dict_keys = {}
+
+    def __getitem__(self, key):
+        if key not in self.dict_keys:
+            raise KeyError(key)
+        return getattr(self, self.dict_keys[key])
+
+    def __setitem__(self, key, value):
+        if key not in self.dict_keys:
+            raise KeyError(key)
+        setattr(self, self.dict_keys[key], value)
+
+    def __contains__(self, key):
+        return key in self.dict_keys
+
+    def get(self, key, default=None):
+        return self[key] if key in self.dict_keys else default
+
+    def copy(self):
+        """
+        :return: Record of its own, with copies of the lists it holds
+        """
+        record = object.__new__(type(self))
+        for attr in self.__slots__:
+            value = getattr(self, attr)
+            setattr(record, attr, copy.deepcopy(value) if isinstance(value, list) else value)
+        return record
+
+    def to_dict(self):
+        return dict((key, getattr(self, attr)) for key, attr in self.dict_keys.items())
+
+    def __eq__(self, other):
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, attr) == getattr(other, attr) for attr in self.dict_keys.values())
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__,
+                           ', '.join('%s=%r' % (attr, getattr(self, attr)) for attr in self.__slots__))
+
+
+class CausalityRecord(Record):
+    """ Causal relationship. Sites are kept decoded and each modification list is made at its first read,
+    then kept, so changes to it stay as they did in the dictionaries the results used to be."""
+    __slots__ = ('id1', 'sites1', 'id2', 'sites2', 'rel', 'uri_str', 'mods1_list', 'mods2_list')
+
+    dict_keys = {'id1': 'id1', 'mods1': 'mods1', 'id2': 'id2', 'mods2': 'mods2', 'rel': 'rel', 'uri_str': 'uri_str'}
+
+    def __init__(self, id1, sites1, id2, sites2, rel, uri_str):
+        self.id1 = id1
+        self.sites1 = sites1
+        self.id2 = id2
+        self.sites2 = sites2
+        self.rel = rel
+        self.uri_str = uri_str
+        self.mods1_list = None
+        self.mods2_list = None
+
+    @property
+    def mods1(self):
+        if self.mods1_list is None:
+            self.mods1_list = make_mods(self.sites1)
+        return self.mods1_list
+
+    @mods1.setter
+    def mods1(self, mods):
+        self.mods1_list = mods
+
+    @property
+    def mods2(self):
+        if self.mods2_list is None:
+            self.mods2_list = make_mods(self.sites2)
+        return self.mods2_list
+
+    @mods2.setter
+    def mods2(self, mods):
+        self.mods2_list = mods
+
+
+class CorrelationRecord(Record):
+    """ Correlation between two phosphosites"""
+    __slots__ = ('id1', 'p_site1', 'id2', 'p_site2', 'correlation', 'p_val', 'explainable')
+
+    dict_keys = {'id1': 'id1', 'pSite1': 'p_site1', 'id2': 'id2', 'pSite2': 'p_site2', 'correlation': 'correlation',
+                 'pVal': 'p_val', 'explainable': 'explainable'}
+
+    def __init__(self, id1, p_site1, id2, p_site2, correlation, p_val, explainable="unassigned"):
+        self.id1 = id1
+        self.p_site1 = p_site1
+        self.id2 = id2
+        self.p_site2 = p_site2
+        self.correlation = correlation
+        self.p_val = p_val
+        self.explainable = explainable
+
+    def swap(self):
+        """
+        Puts the second gene first
+        :return:
+        """
+        self.id1, self.id2 = self.id2, self.id1
+        self.p_site1, self.p_site2 = self.p_site2, self.p_site1
+
+
+class MutexRecord(Record):
+    """ Mutually exclusive gene group"""
+    __slots__ = ('group', 'score', 'alteration_set', 'network')
+
+    dict_keys = {'group': 'group', 'score': 'score', 'alteration_set': 'alteration_set', 'network': 'network'}
+
+    def __init__(self, group, score, alteration_set, network):
+        self.group = group
+        self.score = score
+        self.alteration_set = alteration_set
+        self.network = network
@@ -0,0 +1,145 @@
+import sys
+import inspect
+import threading
+import functools
+from collections import OrderedDict
+from .records import Record
+
+
+# Largest total size of the cached results
+default_result_cache_bytes = 64 * 2 ** 20
+
+missing = object()
+
+
+def freeze(value):
+    """
+    Makes a hashable key of query arguments, so equal arguments give equal keys
+    :param value: Argument made of strings, numbers, lists, tuples and dictionaries
+    :return:
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def approximate_size(value):
+    """
+    :param value: Query result
+    :return: Bytes taken by the result and the objects it holds
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(approximate_size(key) + approximate_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        size += sum(approximate_size(item) for item in value)
+    elif isinstance(value, Record):
+        size += sum(approximate_size(getattr(value, attr)) for attr in value.__slots__)
+    return size
+
+
+def copy_result(value):
+    """
+    Copies a kept result for one caller, so its changes reach neither the cache nor other callers
+    :param value: Query result
+    :return:
+    """
+    if isinstance(value, dict):
+        return dict((key, copy_result(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [copy_result(item) for item in value]
+    if isinstance(value, tuple):
+        return tuple(copy_result(item) for item in value)
+    if isinstance(value, Record):
+        return value.copy()
+    return value
+
+
+class ResultCache:
+    """ Keeps query results in least recently used order, evicting the oldest past max_bytes"""
+
+    def __init__(self, max_bytes=default_result_cache_bytes):
+        """
+        :param max_bytes: Largest total size of the kept results
+        """
+        self.max_bytes = max_bytes
+        # {key: (result, size)} in order of last use
+        self.results = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :param key:
+        :return: The kept result, missing if there is none
+        """
+        with self.lock:
+            entry = self.results.get(key)
+            if entry is None:
+                self.misses += 1
+                return missing
+            self.hits += 1
+            self.results.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, result):
+        size = approximate_size(result)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.results:
+                self.bytes -= self.results.pop(key)[1]
+            self.results[key] = (result, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self.results.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """
+        :return: {hits, misses, evictions, entries, bytes, max_bytes}
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.results), 'bytes': self.bytes, 'max_bytes': self.max_bytes}
+
+
+def cached_result(method):
+    """
+    Keeps the results of a CausalityAgent query method in its result_cache, keyed by the
+    database generation, the method and its arguments. Each caller gets a copy of the kept result, which it may change.
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def cached_method(self, *args, **kwargs):
+        if self.result_cache is None:
+            return method(self, *args, **kwargs)
+
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        key = (self.refresh_generation(), method.__name__, freeze(list(bound.arguments.values())[1:]))
+        try:
+            result = self.result_cache.get(key)
+        except TypeError:
+            # arguments that can't be a key
+            return method(self, *args, **kwargs)
+
+        if result is missing:
+            result = method(self, *args, **kwargs)
+            self.result_cache.put(key, result)
+        return copy_result(result)
+
+    return cached_method
@@ -0,0 +1,100 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+# Most sessions kept, and seconds a session is kept after its last use
+default_max_sessions = 10000
+default_session_ttl = 3600
+
+
+class SessionStore:
+    """ Keeps per-conversation state, keyed by (conversation, gene), evicting the least recently used
+    sessions past max_sessions and the ones unused for ttl seconds"""
+
+    def __init__(self, factory, max_sessions=default_max_sessions, ttl=default_session_ttl):
+        """
+        :param factory: Function making the state of a new session
+        :param max_sessions: Most sessions kept, which bounds the memory of the store
+        :param ttl: Seconds a session is kept after its last use, forever if None
+        """
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        # {(conversation, gene): [last use, state]} in order of last use
+        self.sessions = OrderedDict()
+        # {conversation: set of genes} to reset a conversation
+        self.conversations = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def get(self, conversation, gene):
+        """
+        :param conversation: Conversation id, None for requests without one
+        :param gene:
+        :return: State of the session, a new one if it doesn't exist or has expired
+        """
+        key = (conversation, gene)
+        now = time.monotonic()
+
+        with self.lock:
+            self.evict_expired(now)
+
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.sessions[key] = [now, self.factory()]
+                self.conversations.setdefault(conversation, set()).add(gene)
+                while len(self.sessions) > self.max_sessions:
+                    self.remove(next(iter(self.sessions)))
+            else:
+                session[0] = now
+                self.sessions.move_to_end(key)
+
+            return session[1]
+
+    def advance(self, conversation, gene, slot, rank, new_rank):
+        """
+        Moves a position kept in the state of a session, unless another request moved it first
+        :param conversation: Conversation id, None for requests without one
+        :param gene:
+        :param slot: Index of the position in the state
+        :param rank: Position the caller read
+        :param new_rank: Position to move to
+        :return: True if the position was moved, False if it or the session changed since it was read
+        """
+        with self.lock:
+            session = self.sessions.get((conversation, gene))
+            if session is None or session[1][slot] != rank:
+                return False
+            session[1][slot] = new_rank
+            return True
+
+    def reset(self, conversation):
+        """
+        Removes the sessions of a conversation
+        :param conversation: Conversation id, None for requests without one
+        :return:
+        """
+        with self.lock:
+            for gene in list(self.conversations.get(conversation, ())):
+                self.remove((conversation, gene))
+
+    def evict_expired(self, now):
+        # the least recently used sessions are first, so expired ones are at the front
+        if self.ttl is None:
+            return
+        while self.sessions:
+            key, (last_use, _) = next(iter(self.sessions.items()))
+            if now - last_use < self.ttl:
+                break
+            self.remove(key)
+
+    def remove(self, key):
+        del self.sessions[key]
+        conversation, gene = key
+        genes = self.conversations[conversation]
+        genes.discard(gene)
+        if not genes:
+            del self.conversations[conversation]
@@ -0,0 +1,209 @@
+import time
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger('CausalA')
+
+# Biogene service of PathwayCommons, seconds to wait for it, and most requests sent to it at once
+default_gene_summary_url = "http://www.pathwaycommons.org/biogene/retrieve.do"
+default_summary_timeout = 5
+default_max_concurrent = 8
+
+# Most requests sent at once for prefetches, which come on top of the other requests,
+# and most genes prefetched per call
+default_max_prefetch_concurrent = 2
+max_prefetch_genes = 50
+
+# Seconds a gene whose fetch failed is answered without asking the service, and no prefetches are sent
+failure_ttl = 300
+
+
+class SummaryClient:
+    """ Gets gene summaries from the cache, fetching the missing ones from the biogene service.
+    Fetches are scheduled on an asyncio loop of their own thread, so callers don't wait for each other
+    and a gene asked for again while it is fetched is fetched once. The blocking HTTP requests run on
+    a pool of worker threads, each with a requests session of its own, as requests doesn't promise
+    that a session is safe to share across threads."""
+
+    def __init__(self, cache, url=default_gene_summary_url, timeout=default_summary_timeout,
+                 max_concurrent=default_max_concurrent, max_prefetch_concurrent=default_max_prefetch_concurrent):
+        """
+        :param cache: GeneSummaryCache keeping the fetched summaries
+        :param url: Biogene service
+        :param timeout: Seconds to wait for the service
+        :param max_concurrent: Most requests sent to the service at once for the callers waiting for them
+        :param max_prefetch_concurrent: Most requests sent at once for prefetches. They have a budget of their
+        own, so callers don't wait behind them.
+        """
+        self.cache = cache
+        self.url = url
+        self.timeout = timeout
+        self.max_concurrent = max_concurrent
+        self.max_prefetch_concurrent = max_prefetch_concurrent
+
+        # {worker thread id: its session}, made at the first request of the thread. Each session
+        # keeps its connection alive and reuses it across the requests of its thread.
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent + max_prefetch_concurrent,
+                                           thread_name_prefix='gene-summary-request')
+
+        # made and used on the loop thread only
+        self.semaphore = None
+        self.prefetch_semaphore = None
+        # {gene: future of its summary} for the fetches in progress
+        self.in_flight = {}
+        # genes whose prefetch waits for a request slot
+        self.queued = set()
+
+        # fetches that failed, and the time of the last failure
+        self.failures = 0
+        self.failed_at = None
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='gene-summaries', daemon=True)
+        self.thread.start()
+
+    def get_summary(self, gene):
+        """
+        :param gene:
+        :return: Summary of the gene, "" if it has none or the service can't be reached
+        """
+        return asyncio.run_coroutine_threadsafe(self.fetch(gene), self.loop).result()
+
+    def get_summaries(self, genes):
+        """
+        Fetches the summaries of the genes concurrently
+        :param genes: List of gene symbols
+        :return: {gene: summary}
+        """
+        return asyncio.run_coroutine_threadsafe(self.fetch_all(genes), self.loop).result()
+
+    def prefetch(self, genes):
+        """
+        Fetches the summaries of the first max_prefetch_genes genes in the background,
+        so later requests find them in the cache
+        :param genes: List of gene symbols
+        :return:
+        """
+        genes = list(dict.fromkeys(genes))[:max_prefetch_genes]
+        asyncio.run_coroutine_threadsafe(self.fetch_all(genes, background=True), self.loop)
+
+    async def fetch_all(self, genes, background=False):
+        genes = list(dict.fromkeys(genes))
+        summaries = await asyncio.gather(*[self.fetch(gene, background) for gene in genes])
+        return dict(zip(genes, summaries))
+
+    async def fetch(self, gene, background=False):
+        """
+        :param gene:
+        :param background: If True, the fetch is a prefetch that nobody waits for
+        :return: Summary of the gene from the cache, or from the service if missing or expired
+        """
+        summary, fresh = self.cache.get(gene)
+        if fresh:
+            return summary
+
+        # a caller doesn't wait for a prefetch of the gene that hasn't started, but takes it over
+        future = self.in_flight.get(gene)
+        if future is None or (not background and gene in self.queued):
+            self.queued.discard(gene)
+            future = self.in_flight[gene] = asyncio.ensure_future(self.fetch_from_service(gene, summary,
+                                                                                          background))
+            future.add_done_callback(lambda done: self.in_flight.pop(gene) if self.in_flight.get(gene) is done
+                                     else None)
+        return await asyncio.shield(future)
+
+    async def fetch_from_service(self, gene, expired_summary, background):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrent)
+            self.prefetch_semaphore = asyncio.Semaphore(self.max_prefetch_concurrent)
+
+        if not background:
+            async with self.semaphore:
+                return await self.request_summary(gene, expired_summary)
+
+        self.queued.add(gene)
+        async with self.prefetch_semaphore:
+            if gene not in self.queued or self.recently_failed():
+                # taken over by a caller, or the service is likely still unreachable
+                self.queued.discard(gene)
+                return expired_summary or ""
+            self.queued.discard(gene)
+            return await self.request_summary(gene, expired_summary)
+
+    def recently_failed(self):
+        return self.failed_at is not None and time.monotonic() - self.failed_at < failure_ttl
+
+    async def request_summary(self, gene, expired_summary):
+        try:
+            data = await self.loop.run_in_executor(self.executor, self.request, gene)
+        except (requests.RequestException, ValueError) as e:
+            # keep the expired summary rather than no summary, and don't ask again for a while
+            self.failures += 1
+            self.failed_at = time.monotonic()
+            logger.warning('Could not get the summary of %s: %s' % (gene, e))
+            self.cache.put(gene, expired_summary or "", failure_ttl)
+            return expired_summary or ""
+
+        if data.get('geneInfo') and data['geneInfo'][0].get('geneSummary'):
+            summary = data['geneInfo'][0]['geneSummary']
+        else:
+            summary = ""
+
+        self.cache.put(gene, summary)
+        return summary
+
+    def thread_session(self):
+        """
+        :return: Session of the calling worker thread
+        """
+        thread_id = threading.get_ident()
+        with self.sessions_lock:
+            session = self.sessions.get(thread_id)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.sessions[thread_id] = session
+        return session
+
+    def request(self, gene):
+        params = {'query': gene, 'org': 'human', 'format': 'json'}
+        r = self.thread_session().get(self.url, params=params, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    async def cancel_fetches(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        if self.executor is None:
+            return
+        # prefetches nobody waits for are dropped rather than left pending on a closed loop
+        try:
+            asyncio.run_coroutine_threadsafe(self.cancel_fetches(), self.loop).result(self.timeout)
+        except (concurrent.futures.TimeoutError, RuntimeError):
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(self.timeout)
+        # at interpreter exit the loop thread is frozen and never stops
+        if not self.loop.is_running():
+            self.loop.close()
+        self.executor.shutdown(wait=False)
+        self.executor = None
+        with self.sessions_lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
+        self.cache.close()
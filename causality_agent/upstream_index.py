@@ -0,0 +1,91 @@
+import time
+import logging
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+
+logger = logging.getLogger('CausalA')
+
+# Relation type whose sources are the upstreams of a gene
+upstream_relation = 'controls-state-change-of'
+
+
+def contains(sorted_ids, gene_id):
+    ind = bisect_left(sorted_ids, gene_id)
+    return ind < len(sorted_ids) and sorted_ids[ind] == gene_id
+
+
+class UpstreamIndex:
+    """ Keeps the upstream regulators of each gene in Sif_Relations as sorted arrays of gene ids"""
+
+    def __init__(self, cadb):
+        """
+        :param cadb: Connection to the causality database
+        """
+        start = time.time()
+
+        # {gene id: array of upstream gene ids in increasing order}
+        self.upstreams = {}
+        self.gene_ids = {}
+        self.symbols = {}
+
+        with cadb:
+            cur = cadb.cursor()
+            for gene_id, symbol in cur.execute("SELECT GeneId, Symbol FROM SifGenes"):
+                self.gene_ids[symbol] = gene_id
+                self.symbols[gene_id] = symbol
+
+            rel_id = cur.execute("SELECT RelId FROM SifRelationTypes WHERE Rel = ?", (upstream_relation,)).fetchone()
+            if rel_id:
+                # the primary key order gives the upstreams of each gene sorted
+                for gene_id, upstream_id in cur.execute("SELECT Id2, Id1 FROM Sif_Relations WHERE RelId = ? "
+                                                        "ORDER BY Id2, Id1", rel_id):
+                    upstreams = self.upstreams.get(gene_id)
+                    if upstreams is None:
+                        upstreams = self.upstreams[gene_id] = array('l')
+                    upstreams.append(upstream_id)
+
+        logger.info('Indexed the upstreams of %d genes in %.2f s' % (len(self.upstreams), time.time() - start))
+
+    def get_upstreams(self, gene):
+        """
+        :param gene: Gene symbol
+        :return: Sorted array of upstream gene ids, empty for unknown genes
+        """
+        return self.upstreams.get(self.gene_ids.get(gene), array('l'))
+
+    def find_common(self, genes):
+        """
+        Intersects the upstreams of genes, starting from the smallest set
+        :param genes: List of gene symbols
+        :return: List of upstream symbols of all the genes, in gene id order
+        """
+        upstream_sets = sorted((self.get_upstreams(gene) for gene in genes), key=len)
+
+        common = upstream_sets[0]
+        for upstreams in upstream_sets[1:]:
+            if not common:
+                break
+            common = [gene_id for gene_id in common if contains(upstreams, gene_id)]
+
+        return [self.symbols[gene_id] for gene_id in common]
+
+    def find_common_at_least(self, genes, min_count):
+        """
+        Finds the upstreams shared by at least min_count of the genes
+        :param genes: List of gene symbols
+        :param min_count: Least number of genes an upstream controls
+        :return: List of (upstream symbol, number of genes), most shared first, then in gene id order
+        """
+        if min_count >= len(genes):
+            return [(symbol, len(genes)) for symbol in self.find_common(genes)]
+
+        counts = Counter()
+        for gene in genes:
+            counts.update(self.get_upstreams(gene))
+
+        common = sorted((gene_id for gene_id, count in counts.items() if count >= min_count),
+                        key=lambda gene_id: (-counts[gene_id], gene_id))
+
+        return [(self.symbols[gene_id], counts[gene_id]) for gene_id in common]
@@ -1,8 +1,25 @@
+import os
 import json
+import shutil
+import sqlite3
+import tempfile
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
 from kqml import KQMLList, KQMLString, KQMLPerformative
 from indra.statements import stmts_from_json
 from causality_agent.causality_module import _resource_dir
+from causality_agent import causality_module
 from causality_agent import causality_agent
+from causality_agent.gene_summary_cache import GeneSummaryCache
+from causality_agent.records import CausalityRecord
+from causality_agent.causal_graph import CausalGraph
+from causality_agent.path_search import PathSearch
+from causality_agent.mutsig_matrix import MutSigMatrix
+from causality_agent.connection_pool import ConnectionPool
+from causality_agent.database_initializer import DatabaseInitializer, read_generation, table_columns, snapshot_name
+from benchmarks.synthetic_resources import generate_resources
 from causality_agent.causality_module import CausalityModule
 from bioagents.tests.integration import _IntegrationTest
 from bioagents.tests.util import ekb_kstring_from_text, ekb_from_text, get_request
@@ -361,6 +378,23 @@ class TestMutex(_IntegrationTest):
         # TODO: do this without converting into string
         assert str(test_res) == str(mutex)
 
+    def create_message_all_variants(self):
+        content = KQMLList('FIND-MUTEX')
+        gene = ekb_from_text('TP53')
+        disease = ekb_from_text('breast cancer')
+        content.set('gene', gene)
+        content.set('disease', disease)
+        content.set('alteration-set', 'all')
+        msg = get_request(content)
+        return msg, content
+
+    def check_response_to_message_all_variants(self, output):
+        assert output.head() == 'SUCCESS', output
+        mutex = output.get('mutex')
+        alteration_sets = set(group.gets('alteration-set') for group in mutex)
+        assert 'whole' in alteration_sets
+        assert all(group.gets('network') == 'no-network' for group in mutex)
+
     def create_message_failure(self):
         content = KQMLList('FIND-MUTEX')
         gene = ekb_from_text('BRAF')
@@ -505,4 +539,606 @@ class TestGeneSummary(_IntegrationTest):
     def check_response_to_message_AKT1(self, output):
         assert output.head() == 'SUCCESS', output
         components = output.get('geneSummary')
-        assert 'AKT1' in components.data
\ No newline at end of file
+        assert 'AKT1' in components.data
+
+
+def test_query_plans_use_indexes():
+    ca.check_query_plans()
+
+
+def test_find_causality_many():
+    pairs = [('MAPK1', 'JUND'), ('MAPK1', ['JUND', 'ERF']), ('MAPK1', 'CREB1')]
+    results = ca.find_causality_many(pairs, 'strict')
+    assert len(results) == 3
+    for (source, targets), result in zip(pairs, results):
+        single = ca.find_causality({'source': {'id': source}, 'target': {'id': targets}, 'direction': 'strict'})
+        assert result == single
+    assert results[0]['id1'] == 'MAPK1'
+    assert results[0]['id2'] == 'JUND'
+
+
+def test_causal_graph_matches_database():
+    ca_graph = causality_agent.CausalityAgent(_resource_dir, in_memory=True)
+    assert ca_graph.graph is not None
+    for direction in [None, 'strict']:
+        param = {'source': {'id': 'MAPK1'}, 'target': {'id': ['JUND', 'ERF']}, 'direction': direction}
+        assert ca_graph.find_causality(param) == ca.find_causality(param)
+    for param in [{'id': ['MAPK1', 'BRAF'], 'rel': 'phosphorylates'}, {'id': 'BRAF', 'rel': 'modulates'}]:
+        assert ca_graph.find_causality_targets(param) == ca.find_causality_targets(param)
+
+
+def test_find_causal_path():
+    path = ca.find_causal_path('MAPK1', 'JUND')
+    assert len(path) == 1
+    assert path[0]['id1'] == 'MAPK1'
+    assert path[0]['id2'] == 'JUND'
+    path = ca.find_causal_path('MAPK1', 'JUND', max_depth=0)
+    assert path is None
+
+
+def make_path_search(edges):
+    """
+    :param edges: (source, rel, target) relationships
+    :return: PathSearch over a causal graph of only these relationships
+    """
+    cadb = sqlite3.connect(':memory:')
+    cadb.execute("CREATE TABLE Causality (Id1 TEXT, PSite1 TEXT, Id2 TEXT, PSite2 TEXT, Rel TEXT, UriStr TEXT)")
+    cadb.executemany("INSERT INTO Causality VALUES (?, '', ?, '', ?, '')",
+                     [(source, target, rel) for source, rel, target in edges])
+    path_search = PathSearch(CausalGraph(cadb))
+    cadb.close()
+    return path_search
+
+
+def path_genes(path):
+    return [path[0]['id1']] + [causality['id2'] for causality in path] if path else None
+
+
+def test_find_causal_path_multi_hop():
+    path_search = make_path_search([('A', 'phosphorylates', 'B'), ('B', 'upregulates-expression', 'C'),
+                                    ('C', 'dephosphorylates', 'D'), ('D', 'is-phosphorylated-by', 'A'),
+                                    ('A', 'phosphorylates', 'X'), ('X', 'phosphorylates', 'Y')])
+    path = path_search.find_path('A', 'D')
+    assert path_genes(path) == ['A', 'B', 'C', 'D']
+    assert [causality['rel'] for causality in path] == ['phosphorylates', 'upregulates-expression',
+                                                        'dephosphorylates']
+    # the is-...-by relationship is not followed backwards
+    assert path_search.find_path('D', 'A') is None
+    assert path_search.find_path('A', 'Q') is None
+
+
+def test_find_causal_path_depth_limit():
+    path_search = make_path_search([('A', 'phosphorylates', 'B'), ('B', 'phosphorylates', 'C'),
+                                    ('C', 'phosphorylates', 'D'), ('D', 'phosphorylates', 'E')])
+    assert path_genes(path_search.find_path('A', 'D', max_depth=3)) == ['A', 'B', 'C', 'D']
+    assert path_search.find_path('A', 'D', max_depth=2) is None
+    # E is four relationships away, beyond the default depth
+    assert path_search.find_path('A', 'E') is None
+    assert path_genes(path_search.find_path('A', 'E', max_depth=4)) == ['A', 'B', 'C', 'D', 'E']
+
+
+def test_find_causal_path_max_expansions():
+    # the source and the target each reach ten genes, and only one pair of them is connected
+    edges = [('S', 'phosphorylates', 'X%d' % ind) for ind in range(10)] + \
+            [('Y%d' % ind, 'phosphorylates', 'T') for ind in range(10)] + [('X9', 'phosphorylates', 'Y9')]
+    path_search = make_path_search(edges)
+    assert path_genes(path_search.find_path('S', 'T')) == ['S', 'X9', 'Y9', 'T']
+    # S is expanded first, then its ten successors, then Y9
+    assert path_search.find_path('S', 'T', max_expansions=10) is None
+    assert path_search.find_path('S', 'T', max_expansions=11) is None
+    assert path_genes(path_search.find_path('S', 'T', max_expansions=12)) == ['S', 'X9', 'Y9', 'T']
+
+
+def test_causal_path_over_memory_budget():
+    budget = causality_agent.graph_memory_budget
+    causality_agent.graph_memory_budget = 0
+    try:
+        ca_budget = causality_agent.CausalityAgent(_resource_dir)
+        # only a direct relationship is found, without loading the causal graph
+        for source, target in [('MAPK1', 'JUND'), ('BRAF', 'MAPK1'), ('MAPK1', 'MAPK1')]:
+            assert ca_budget.find_causal_path(source, target) == ca.find_causal_path(source, target, max_depth=1)
+        assert ca_budget.path_search is False
+        assert ca_budget.graph is None
+    finally:
+        causality_agent.graph_memory_budget = budget
+
+
+def test_find_common_upstreams_at_least():
+    genes = ['AKT1', 'BRAF', 'MAPK1']
+    common = ca.find_common_upstreams(genes)
+    at_least_two = ca.find_common_upstreams(genes, min_count=2)
+    assert set(common) <= set(at_least_two)
+    assert at_least_two[:len(common)] == common
+
+
+def test_find_next_correlation_ranked():
+    ca.reset_indices()
+    corrs = []
+    corr = ca.find_next_correlation('AKT1')
+    while corr != '':
+        corrs.append(corr)
+        corr = ca.find_next_correlation('AKT1')
+    ca.reset_indices()
+    explainable = [corr['explainable'] for corr in corrs]
+    assert explainable == sorted(explainable)
+    for kind in ['explainable', 'unexplainable']:
+        values = [abs(corr['correlation']) for corr in corrs if corr['explainable'] == kind]
+        assert values == sorted(values, reverse=True)
+    assert all(corr['id1'] == 'AKT1' for corr in corrs)
+
+
+def test_correlation_cursors_per_conversation():
+    first = ca.find_next_correlation('AKT1', 'conversation-1')
+    second = ca.find_next_correlation('AKT1', 'conversation-1')
+    assert ca.find_next_correlation('AKT1', 'conversation-2') == first
+    ca.reset_indices('conversation-1')
+    assert ca.find_next_correlation('AKT1', 'conversation-1') == first
+    assert ca.find_next_correlation('AKT1', 'conversation-2') == second
+
+
+def test_correlation_cursors_concurrent():
+    expected = []
+    corr = ca.find_next_correlation('AKT1', 'conversation-3')
+    while corr != '':
+        expected.append(corr)
+        corr = ca.find_next_correlation('AKT1', 'conversation-3')
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        corrs = list(executor.map(lambda _: ca.find_next_correlation('AKT1', 'conversation-4'),
+                                  range(len(expected) + 8)))
+    corrs = [corr for corr in corrs if corr != '']
+    # every correlation is returned once, to one of the requests
+    assert sorted(corr['correlation'] for corr in corrs) == sorted(corr['correlation'] for corr in expected)
+    ca.reset_indices('conversation-3')
+    ca.reset_indices('conversation-4')
+
+
+def test_causality_record_reads_as_dict():
+    result = ca.find_causality({'source': {'id': 'MAPK1'}, 'target': {'id': 'JUND'}})
+    assert result['id1'] == result.id1 == 'MAPK1'
+    assert result.to_dict()['mods2'] == result['mods2']
+    assert result['mods2'][0]['mod_type'] == 'phosphorylation'
+
+
+def test_causality_record_mods_written():
+    record = CausalityRecord('MAPK1', (('T', '185'),), 'JUND', (), 'phosphorylates', '')
+    assert record['mods1'][0]['position'] == '185'
+    mods = [{'mod_type': 'phosphorylation', 'residue': 'Y', 'position': '187', 'is_modified': True}]
+    record['mods1'] = mods
+    assert record['mods1'] == record.to_dict()['mods1'] == mods
+    assert record['mods2'][0]['residue'] is None
+    # a change to the list read stays, as in the dictionaries
+    record['mods2'][0]['residue'] = 'S'
+    assert record['mods2'][0]['residue'] == 'S'
+    assert record == record.copy()
+
+
+def test_most_likely_cellular_location_ties():
+    assert ca.find_most_likely_cellular_location(['AKT1', 'MAPK1']) == ['mitochondrion', 'cytoskeleton']
+    assert ca.find_most_likely_cellular_location(['MAPK1', 'RAS']) == []
+
+
+def test_concurrent_queries():
+    params = [{'id': gene, 'rel': 'modulates'} for gene in ['MAPK1', 'BRAF', 'AKT1', 'MAPK3'] * 10]
+    expected = [ca.find_causality_targets(param) for param in params]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(ca.find_causality_targets, params)) == expected
+
+
+def test_connections_closed_when_threads_end():
+    pool = ConnectionPool(ca.pool.db_file)
+    connections = []
+
+    def query():
+        cadb = pool.connection()
+        cadb.execute("SELECT COUNT(*) FROM Causality").fetchone()
+        connections.append(cadb)
+
+    for _ in range(5):
+        thread = threading.Thread(target=query)
+        thread.start()
+        thread.join()
+    assert len(connections) == 5
+    assert len(pool.connections) == 0
+    for cadb in connections:
+        try:
+            cadb.execute("SELECT 1")
+            assert False, 'the connection of an ended thread is open'
+        except sqlite3.ProgrammingError:
+            pass
+
+    # the connection of a running thread stays open until the pool is closed
+    cadb = pool.connection()
+    assert pool.connections == {cadb}
+    pool.close()
+    assert len(pool.connections) == 0
+
+
+def test_database_loaded_into_memory():
+    ram_ca = causality_agent.CausalityAgent(_resource_dir, load_to_memory=True)
+    assert ram_ca.pool.memory_bytes > 0
+    param = {'id': 'MAPK1', 'rel': 'modulates'}
+    assert ram_ca.find_causality_targets(param) == ca.find_causality_targets(param)
+    ram_ca.pool.close()
+
+
+def start_biogene_stand_in(delay=0):
+    """
+    Starts a local stand-in of the biogene service. Genes starting with XYZ have no summary
+    and genes starting with FAIL get a server error.
+    :param delay: Seconds each response takes
+    :return: (server, list of the queried genes, agent asking the server with a cache of its own)
+    """
+    queried = []
+
+    class BiogeneHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            gene = self.path.split('query=')[1].split('&')[0]
+            queried.append(gene)
+            time.sleep(delay)
+            if gene.startswith('FAIL'):
+                self.send_response(500)
+                self.end_headers()
+                return
+            gene_info = [] if gene.startswith('XYZ') else [{'geneSummary': gene + ' summary'}]
+            body = json.dumps({'geneInfo': gene_info}).encode()
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), BiogeneHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    summary_ca = causality_agent.CausalityAgent(
+        _resource_dir, gene_summary_url='http://127.0.0.1:%d/biogene/retrieve.do' % server.server_port,
+        gene_summary_cache=os.path.join(tempfile.mkdtemp(), 'gene-summaries.db'))
+    return server, queried, summary_ca
+
+
+def stop_biogene_stand_in(server, summary_ca):
+    server.shutdown()
+    summary_ca.summary_client.close()
+    summary_ca.pool.close()
+
+
+def test_gene_summary_cache():
+    server, queried, summary_ca = start_biogene_stand_in()
+    try:
+        assert summary_ca.find_gene_summary('AKT1') == 'AKT1 summary'
+        assert summary_ca.find_gene_summary('AKT1') == 'AKT1 summary'
+        assert summary_ca.find_gene_summary('XYZ1') == ''
+        assert summary_ca.find_gene_summary('XYZ1') == ''
+        assert len(queried) == 2
+    finally:
+        stop_biogene_stand_in(server, summary_ca)
+
+
+def test_gene_summaries_coalesced():
+    server, queried, summary_ca = start_biogene_stand_in(delay=0.2)
+    try:
+        summaries = summary_ca.find_gene_summaries(['AKT1', 'BRAF', 'AKT1', 'MAPK1'])
+        assert summaries == {'AKT1': 'AKT1 summary', 'BRAF': 'BRAF summary', 'MAPK1': 'MAPK1 summary'}
+        assert len(queried) == 3
+
+        # two requests for a gene being fetched share the fetch
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            summaries = list(executor.map(summary_ca.find_gene_summary, ['JUND', 'JUND']))
+        assert summaries == ['JUND summary', 'JUND summary']
+        assert queried.count('JUND') == 1
+    finally:
+        stop_biogene_stand_in(server, summary_ca)
+
+
+def test_gene_summary_session_per_thread():
+    server, queried, summary_ca = start_biogene_stand_in(delay=0.2)
+    client = summary_ca.summary_client
+    try:
+        genes = ['G%05d' % i for i in range(client.max_concurrent)]
+        summaries = summary_ca.find_gene_summaries(genes)
+        assert summaries == dict((gene, gene + ' summary') for gene in genes)
+        # the requests ran at once, each on a worker thread with a session of its own
+        sessions = list(client.sessions.values())
+        assert 1 < len(sessions) <= client.max_concurrent + client.max_prefetch_concurrent
+        assert len(set(map(id, sessions))) == len(sessions)
+    finally:
+        stop_biogene_stand_in(server, summary_ca)
+    assert client.sessions == {}
+
+
+def test_gene_summary_not_delayed_by_prefetch():
+    server, queried, summary_ca = start_biogene_stand_in(delay=0.2)
+    try:
+        summary_ca.prefetch_gene_summaries(['G%05d' % i for i in range(200)])
+        start = time.time()
+        assert summary_ca.find_gene_summary('AKT1') == 'AKT1 summary'
+        assert time.time() - start < 1
+    finally:
+        stop_biogene_stand_in(server, summary_ca)
+    assert len(queried) <= 51
+
+
+def test_failed_gene_summary_cached():
+    server, queried, summary_ca = start_biogene_stand_in()
+    try:
+        assert summary_ca.find_gene_summary('FAIL1') == ''
+        assert summary_ca.find_gene_summary('FAIL1') == ''
+        assert queried == ['FAIL1']
+        assert summary_ca.summary_client.failures == 1
+    finally:
+        stop_biogene_stand_in(server, summary_ca)
+
+
+def test_result_cache():
+    param = {'source': {'id': 'MAPK1'}, 'target': {'id': ['JUND', 'ERF']}}
+    first = ca.find_causality(param)
+    hits = ca.result_cache.stats()['hits']
+    assert ca.find_causality({'target': {'id': ['JUND', 'ERF']}, 'source': {'id': 'MAPK1'}}) == first
+    assert ca.result_cache.stats()['hits'] == hits + 1
+    hits = ca.result_cache.stats()['hits']
+    assert ca.find_mutex('TP53', 'BRCA') == ca.find_mutex('TP53', 'BRCA', alteration_set='whole')
+    assert ca.result_cache.stats()['hits'] == hits + 1
+
+
+def test_cached_results_are_copies():
+    gene = ca.cadb.execute("SELECT Id1 FROM Causality LIMIT 1").fetchone()[0]
+    param = {'id': gene, 'rel': 'modulates'}
+    expected = ca.find_causality_targets(param)
+    changed = ca.find_causality_targets(param)
+    changed[0]['mods1'][0]['residue'] = 'X'
+    changed[0]['rel'] = 'changed'
+    changed.append(changed[0])
+    assert ca.find_causality_targets(param) == expected
+
+
+def test_tcga_abbr_variants():
+    assert ca.get_tcga_abbr('breast cancer') == 'BRCA'
+    assert ca.get_tcga_abbr('Breast-Cancer') == 'BRCA'
+    assert ca.get_tcga_abbr('cancer of the ovary') == 'OV'
+    assert ca.get_tcga_abbr('pancreatic adenocarcinomas') == 'PAAD'
+    assert ca.get_tcga_abbr('ov') == 'OV'
+    assert ca.get_tcga_abbr('abc cancer') is None
+
+
+def test_mutation_significance_many():
+    result = ca.find_mutation_significance_many(['TP53', 'PTEN', 'NOGENE'], ['OV', 'BRCA'])
+    assert result['TP53']['OV'] == 'highly significant'
+    assert 'NOGENE' not in result
+    for gene, significances in result.items():
+        for disease, significance in significances.items():
+            assert ca.find_mutation_significance(gene, disease) == significance
+    assert len(ca.find_mutation_significance_many(['TP53'])['TP53']) >= 2
+
+
+def rewrite_mutsig_p_values(path, study, p_val):
+    mutsig_file = os.path.join(path, 'TCGA', study, 'scores-mutsig.txt')
+    with open(mutsig_file) as fp:
+        lines = fp.readlines()
+    with open(mutsig_file, 'w') as fp:
+        fp.write(lines[0])
+        for line in lines[1:]:
+            vals = line.rstrip('\n').split('\t')
+            vals[17] = str(p_val)
+            fp.write('\t'.join(vals) + '\n')
+
+
+def test_mutsig_matrix_follows_rebuild():
+    path = tempfile.mkdtemp()
+    try:
+        generate_resources(path)
+        agent = causality_agent.CausalityAgent(path)
+        significant = [gene for gene, significances in agent.find_mutation_significance_many(['G%05d' % i for i in
+                                                                                              range(100)], ['OV']).items()
+                       if significances['OV'] == 'highly significant']
+        gene = significant[0]
+        agent.pool.close()
+
+        os.remove(os.path.join(path, 'causality-dataset.db'))
+        rewrite_mutsig_p_values(path, 'OV', 0.9)
+        rebuilt = causality_agent.CausalityAgent(path)
+        assert rebuilt.find_mutation_significance(gene, 'OV') == 'not significant'
+        rebuilt.pool.close()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def test_incremental_update():
+    path = tempfile.mkdtemp()
+    try:
+        generate_resources(path)
+        db = DatabaseInitializer(path)
+        generation = read_generation(db.cadb)
+        other_p_values = db.cadb.execute("SELECT Id, PVal FROM MutSig WHERE Disease = 'BRCA'").fetchall()
+        db.cadb.close()
+
+        # a touched but unmodified file loads nothing
+        sif_file = os.path.join(path, 'PC.sif')
+        os.utime(sif_file, (os.path.getatime(sif_file), os.path.getmtime(sif_file) + 10))
+        db = DatabaseInitializer(path)
+        assert db.load_stats == {}
+        assert read_generation(db.cadb) == generation
+        db.cadb.close()
+
+        # a changed study is reloaded alone
+        rewrite_mutsig_p_values(path, 'OV', 0.9)
+        db = DatabaseInitializer(path)
+        assert list(db.load_stats) == ['MutSig (OV)']
+        assert read_generation(db.cadb) != generation
+        generation = read_generation(db.cadb)
+        assert db.cadb.execute("SELECT DISTINCT PVal FROM MutSig WHERE Disease = 'OV'").fetchall() == [(0.9,)]
+        assert db.cadb.execute("SELECT Id, PVal FROM MutSig WHERE Disease = 'BRCA'").fetchall() == other_p_values
+        db.cadb.close()
+
+        # the tables derived from a changed table are rebuilt with it
+        with open(os.path.join(path, 'PNNL-ovarian-correlations.txt'), 'a') as fp:
+            fp.write('NEWGENE-S1s\tG00001-T2t\t0.5\t0.01\n')
+        db = DatabaseInitializer(path)
+        assert set(db.load_stats) == {'Correlations', 'Explained_Correlations', 'Unexplained_Correlations',
+                                      'RankedCorrelations'}
+        assert read_generation(db.cadb) != generation
+        assert db.cadb.execute("SELECT COUNT(*) FROM Unexplained_Correlations WHERE Id1 = 'NEWGENE'").fetchone()[0] == 1
+        assert db.cadb.execute("SELECT COUNT(*) FROM RankedCorrelations WHERE Gene = 'NEWGENE'").fetchone()[0] == 1
+        db.cadb.close()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def read_sif_relation_types(cadb):
+    return set(row[0] for row in cadb.execute("SELECT DISTINCT t.Rel FROM Sif_Relations s "
+                                              "JOIN SifRelationTypes t ON s.RelId = t.RelId"))
+
+
+def test_sif_relations_filter():
+    path = tempfile.mkdtemp()
+    try:
+        generate_resources(path)
+        db = DatabaseInitializer(path, sif_relations=['controls-state-change-of', 'in-complex-with'])
+        assert read_sif_relation_types(db.cadb) == {'controls-state-change-of', 'in-complex-with'}
+        generation = read_generation(db.cadb)
+        db.cadb.close()
+
+        # the same filter, in any order, loads nothing
+        db = DatabaseInitializer(path, sif_relations=['in-complex-with', 'controls-state-change-of'])
+        assert db.load_stats == {}
+        db.cadb.close()
+
+        # another filter loads Sif_Relations again
+        db = DatabaseInitializer(path)
+        assert list(db.load_stats) == ['Sif_Relations']
+        assert read_generation(db.cadb) != generation
+        assert len(read_sif_relation_types(db.cadb)) > 2
+        db.cadb.close()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def test_find_mutex_large_group():
+    path = tempfile.mkdtemp()
+    try:
+        generate_resources(path)
+        genes = ['WIDE%d' % i for i in range(9)]
+        file_path = os.path.join(path, 'tcga-mutex-results', 'OV', 'whole', 'no-network', 'ranked-groups.txt')
+        with open(file_path, 'a') as fp:
+            fp.write('0.001\t0.01\t%s\n' % '\t'.join(genes))
+
+        ca_mutex = causality_agent.CausalityAgent(path)
+        members = ca_mutex.cadb.execute("SELECT Gene FROM MutexMembers WHERE GroupId = "
+                                        "(SELECT GroupId FROM MutexMembers WHERE Gene = 'WIDE0') "
+                                        "ORDER BY Position").fetchall()
+        assert [row[0] for row in members] == genes
+        # every gene of the group finds all nine, in the order of the file
+        for gene in [genes[0], genes[5], genes[8]]:
+            mutex = ca_mutex.find_mutex(gene, 'OV')
+            assert [group.group for group in mutex] == [genes]
+        ca_mutex.pool.close()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def table_contents(cadb):
+    """
+    :return: {table: Counter of its rows}, with the mutex groups and the sif relations
+    by content since their ids depend on the load order
+    """
+    contents = {}
+    for table in table_columns:
+        if table not in ('MutexGroups', 'MutexMembers', 'SifGenes', 'SifRelationTypes', 'Sif_Relations'):
+            contents[table] = Counter(cadb.execute("SELECT * FROM %s" % table))
+
+    members = {}
+    for group_id, gene in cadb.execute("SELECT GroupId, Gene FROM MutexMembers ORDER BY GroupId, Position"):
+        members.setdefault(group_id, []).append(gene)
+    contents['Mutex'] = Counter(row[1:] + (tuple(members[row[0]]),) for row in
+                                cadb.execute("SELECT GroupId, Disease, AlterationSet, Network, Score FROM MutexGroups"))
+    contents['Sif_Relations'] = Counter(cadb.execute(
+        "SELECT t.Rel, g1.Symbol, g2.Symbol FROM Sif_Relations s JOIN SifRelationTypes t ON s.RelId = t.RelId "
+        "JOIN SifGenes g1 ON s.Id1 = g1.GeneId JOIN SifGenes g2 ON s.Id2 = g2.GeneId"))
+    return contents
+
+
+def test_parallel_build_matches_sequential():
+    path = tempfile.mkdtemp()
+    try:
+        generate_resources(path)
+        db = DatabaseInitializer(path)
+        sequential = table_contents(db.cadb)
+        db.cadb.close()
+
+        os.remove(os.path.join(path, 'causality-dataset.db'))
+        db = DatabaseInitializer(path, workers=2)
+        parallel = table_contents(db.cadb)
+        db.cadb.close()
+
+        assert all(sequential.values())
+        assert parallel == sequential
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def test_mutsig_matrix_named_by_generation():
+    path = tempfile.mkdtemp()
+    try:
+        first = MutSigMatrix(path, ca.cadb, 'first')
+        second = MutSigMatrix(path, ca.cadb, 'second')
+        assert sorted(os.listdir(path)) == ['mutsig-matrix-second.json', 'mutsig-matrix-second.npy']
+        # a process still on the old generation builds its matrix again rather than mapping another one
+        again = MutSigMatrix(path, ca.cadb, 'first')
+        assert again.find_significance(['TP53']) == first.find_significance(['TP53'])
+        assert second.find_significance(['TP53']) == first.find_significance(['TP53'])
+        assert sorted(os.listdir(path)) == ['mutsig-matrix-first.json', 'mutsig-matrix-first.npy']
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def test_snapshot():
+    path = tempfile.mkdtemp()
+    try:
+        generate_resources(path)
+        snapshot_file = os.path.join(path, snapshot_name)
+        first = causality_agent.CausalityAgent(path, snapshot=True)
+        assert first.pool.db_file == snapshot_file and first.pool.immutable
+        try:
+            first.cadb.execute("CREATE TABLE Scratch(Id INTEGER)")
+            assert False, 'the snapshot was written'
+        except sqlite3.OperationalError:
+            pass
+        significances = first.find_mutation_significance_many(['G%05d' % i for i in range(100)], ['OV'])
+        gene = [gene for gene, significance in significances.items() if significance['OV'] != 'not significant'][0]
+        snapshot_inode = os.stat(snapshot_file).st_ino
+
+        # a second agent opens the same snapshot without writing it again
+        second = causality_agent.CausalityAgent(path, snapshot=True)
+        assert os.stat(snapshot_file).st_ino == snapshot_inode
+        assert second.find_mutation_significance(gene, 'OV') == significances[gene]['OV']
+
+        # a changed data file makes the next agent write a new snapshot
+        rewrite_mutsig_p_values(path, 'OV', 0.9)
+        refreshed = causality_agent.CausalityAgent(path, snapshot=True)
+        assert os.stat(snapshot_file).st_ino != snapshot_inode
+        assert refreshed.find_mutation_significance(gene, 'OV') == 'not significant'
+
+        for agent in (first, second, refreshed):
+            agent.pool.close()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def test_startup_time_from_process_start():
+    # startup is measured from the start of the process, before the imports of the module
+    assert abs(causality_module._load_time - causality_module.process_start_time()) < 0.1
+    assert causality_module._load_time <= causality_module._import_time <= time.time()
+
+
+def test_gene_summary_cache_falls_back_to_memory():
+    cache = GeneSummaryCache(os.path.join(tempfile.mkdtemp(), 'missing-folder', 'gene-summaries.db'))
+    cache.put('AKT1', 'AKT1 summary')
+    assert cache.get('AKT1') == ('AKT1 summary', True)
+
+    cache = GeneSummaryCache(os.path.join(tempfile.mkdtemp(), 'gene-summaries.db'))
+    cache.import_summaries([('BRAF', 'BRAF summary')])
+    # as if the folder had become read-only
+    cache.cadb.execute("PRAGMA query_only = 1")
+    cache.put('AKT1', 'AKT1 summary')
+    assert cache.get('AKT1') == ('AKT1 summary', True)
+    assert cache.get('BRAF') == ('BRAF summary', True)